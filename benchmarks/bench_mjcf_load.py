@@ -0,0 +1,83 @@
+"""
+MJCF加载性能测试
+
+生成嵌套body的合成MJCF（每个body带一个box geom），在已解析的元素树上计时
+XMLParser._load_mujoco_format，输出加载时间随body数量的变化。
+
+用法:
+    python benchmarks/bench_mjcf_load.py [body数量 ...] [--repeat N] [--depth D]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xml_editor.model.xml_parser import XMLParser
+
+# 默认测试的body数量
+DEFAULT_COUNTS = (250, 500, 1000, 2000, 8000, 32000)
+
+
+def build_nested_mjcf(body_count, depth=8, seed=0):
+    """
+    生成嵌套body的合成MJCF
+
+    每个新body挂在最近创建的 depth 个body（或worldbody）之一下面，得到既有深链也有分支的层级。
+
+    参数:
+        body_count: body数量
+        depth: 候选父节点的窗口大小，越小层级越深
+        seed: 随机种子，保证多次运行生成相同的模型
+
+    返回:
+        Element: <mujoco> 根元素
+    """
+    rng = random.Random(seed)
+    root = ET.Element("mujoco")
+    world_body = ET.SubElement(root, "worldbody")
+    bodies = [world_body]
+    for i in range(body_count):
+        parent = rng.choice(bodies[-depth:])
+        body = ET.SubElement(parent, "body", name=f"b{i}", pos="0.1 0 0", quat="1 0 0 0")
+        ET.SubElement(body, "geom", type="box", size=".1 .1 .1")
+        bodies.append(body)
+    return root
+
+
+def time_load(root, repeat):
+    """
+    对同一个元素树多次加载，返回最短耗时（秒）
+
+    参数:
+        root: <mujoco> 根元素
+        repeat: 重复次数
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        XMLParser._load_mujoco_format(root)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MJCF加载时间与body数量的关系")
+    parser.add_argument("counts", nargs="*", type=int, default=list(DEFAULT_COUNTS), help="要测试的body数量")
+    parser.add_argument("--repeat", type=int, default=3, help="每个数量重复加载的次数，取最短耗时")
+    parser.add_argument("--depth", type=int, default=8, help="候选父节点的窗口大小")
+    args = parser.parse_args()
+
+    print(f"{'bodies':>8}  {'load ms':>10}  {'us/body':>8}")
+    for count in args.counts:
+        root = build_nested_mjcf(count, depth=args.depth)
+        seconds = time_load(root, args.repeat)
+        print(f"{count:>8}  {seconds * 1000:>10.1f}  {seconds * 1e6 / count:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
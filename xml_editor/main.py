@@ -39,6 +39,7 @@ class MainWindow(QMainWindow):
         self.scene_viewmodel = SceneViewModel()
         self.property_viewmodel = PropertyViewModel(self.scene_viewmodel)
         self.hierarchy_viewmodel = HierarchyViewModel(self.scene_viewmodel)
+        self.scene_viewmodel.set_hierarchy_viewmodel(self.hierarchy_viewmodel)
         self.control_viewmodel = ControlViewModel(self.scene_viewmodel)
         
         # 创建视图组件
@@ -172,6 +173,14 @@ class MainWindow(QMainWindow):
         reset_view_action.triggered.connect(self._reset_all_views)
         view_menu.addAction(reset_view_action)
         
+        # 工具菜单
+        tools_menu = self.menuBar().addMenu("工具(&T)")
+        
+        # 检查几何体穿插
+        check_overlap_action = QAction("检查穿插(&I)", self)
+        check_overlap_action.triggered.connect(self._check_overlaps)
+        tools_menu.addAction(check_overlap_action)
+        
         # 帮助菜单
         help_menu = self.menuBar().addMenu("帮助(&H)")
         
@@ -269,6 +278,21 @@ class MainWindow(QMainWindow):
             self.hierarchy_viewmodel.remove_geometry(selected)
             self.statusBar().showMessage(f"已删除: {name}")
     
+    def _check_overlaps(self):
+        """检查场景中相互穿插的几何体并显示结果"""
+        pairs = self.scene_viewmodel.find_overlapping_geometries()
+        if not pairs:
+            QMessageBox.information(self, "检查穿插", "没有发现相互穿插的几何体。")
+            return
+        
+        # 列表过长时只显示前若干对
+        max_lines = 20
+        lines = [f"{a.name} - {b.name}" for a, b in pairs[:max_lines]]
+        if len(pairs) > max_lines:
+            lines.append(f"……另有 {len(pairs) - max_lines} 对")
+        QMessageBox.warning(self, "检查穿插", f"发现 {len(pairs)} 对相互穿插的几何体：\n\n" + "\n".join(lines))
+        self.statusBar().showMessage(f"发现 {len(pairs)} 对相互穿插的几何体", 3000)
+    
     def _show_about(self):
         """显示关于对话框"""
         QMessageBox.about(
@@ -359,6 +383,21 @@ class MainWindow(QMainWindow):
         """更新重做按钮状态"""
         self.redo_action.setEnabled(can_redo)
     
+    def check_crash_recovery(self):
+        """启动时检查上一次是否异常退出，提示从编辑日志恢复场景，然后开始记录本次的编辑日志"""
+        if self.control_viewmodel.has_crash_journal():
+            reply = QMessageBox.question(
+                self, "恢复场景",
+                "上一次编辑器没有正常退出，是否从编辑日志恢复当时的场景？",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes
+            )
+            if reply == QMessageBox.Yes:
+                if self.control_viewmodel.recover_from_journal():
+                    self.statusBar().showMessage("已从编辑日志恢复场景")
+                else:
+                    QMessageBox.warning(self, "恢复错误", "无法从编辑日志恢复场景。")
+        self.control_viewmodel.start_journal()
+    
     def closeEvent(self, event):
         """窗口关闭事件"""
         # 提示保存
@@ -374,16 +413,19 @@ class MainWindow(QMainWindow):
                 self._save_file()
                 # 保存完成后清理历史记录
                 self.control_viewmodel.clear_history()
+                self.control_viewmodel.shutdown()
                 event.accept()
             elif reply == QMessageBox.Discard:
                 # 不保存但仍需清理历史记录
                 self.control_viewmodel.clear_history()
+                self.control_viewmodel.shutdown()
                 event.accept()
             else:
                 event.ignore()
         else:
             # 没有几何体也需要清理历史记录
             self.control_viewmodel.clear_history()
+            self.control_viewmodel.shutdown()
             event.accept()
 
 
@@ -400,6 +442,7 @@ def main():
     # 创建主窗口
     window = MainWindow()
     window.show()
+    window.check_crash_recovery()
     
     # 运行应用程序
     sys.exit(app.exec_())
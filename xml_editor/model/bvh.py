@@ -0,0 +1,558 @@
+"""
+层次包围盒
+
+为射线投射提供基于世界空间包围盒的加速结构。
+"""
+
+import heapq
+import numpy as np
+from .geometry import BaseGeometry, update_transforms_batch
+
+# 射线方向分量为0时代替其倒数的大数
+_INV_EPSILON = 1e30
+
+# 射线投射器中有专门相交测试的类型
+_KNOWN_TYPES = {'box', 'sphere', 'cylinder', 'capsule', 'ellipsoid', 'plane'}
+
+
+def local_half_extents(geometry):
+    """
+    获取几何体在局部坐标系中的半尺寸
+
+    与射线投射器中各图元的相交测试保持一致，保证图元完全落在包围盒内。
+
+    参数:
+        geometry: 几何体
+
+    返回:
+        tuple: (x, y, z) 半尺寸
+    """
+    return shape_half_extents(geometry.type, geometry.size)
+
+
+def shape_half_extents(geo_type, size):
+    """
+    按类型和尺寸计算图元在局部坐标系中的半尺寸
+
+    参数:
+        geo_type: 几何体类型字符串
+        size: 几何体尺寸
+
+    返回:
+        tuple: (x, y, z) 半尺寸
+    """
+    # 尺寸分量不足三个时按第一个分量补齐
+    sx = size[0]
+    sy = size[1] if len(size) > 1 else sx
+    sz = size[2] if len(size) > 2 else sx
+    if geo_type == 'sphere':
+        return (sx, sx, sx)
+    elif geo_type == 'cylinder':
+        return (sx, sy, sx)
+    elif geo_type == 'capsule':
+        return (sx, sy + sx, sx)
+    elif geo_type == 'plane':
+        return (sx, sy, 0.0)
+    return (sx, sy, sz)
+
+
+def world_bounds(geometries):
+    """
+    批量计算几何体在世界坐标系中的轴对齐包围盒
+
+    参数:
+        geometries: 几何体列表
+
+    返回:
+        tuple: (最小点数组, 最大点数组)，形状均为 (N, 3)
+    """
+    count = len(geometries)
+    if count == 0:
+        return np.zeros((0, 3)), np.zeros((0, 3))
+
+    matrices = np.array([geo.get_world_transform() for geo in geometries], dtype=np.float64)
+    half = np.array([local_half_extents(geo) for geo in geometries], dtype=np.float64)
+    centers = matrices[:, :3, 3]
+    # 旋转后的包围盒半尺寸为 |R| · h
+    extents = np.einsum('nij,nj->ni', np.abs(matrices[:, :3, :3]), np.abs(half))
+    bounds_min = centers - extents
+    bounds_max = centers + extents
+
+    # 未知类型使用AABB相交测试，包围盒还需覆盖几何体自身的 aabb_min/aabb_max
+    for i, geo in enumerate(geometries):
+        if geo.type in _KNOWN_TYPES:
+            continue
+        bounds_min[i] = np.minimum(bounds_min[i], geo.aabb_min)
+        bounds_max[i] = np.maximum(bounds_max[i], geo.aabb_max)
+    return bounds_min, bounds_max
+
+
+class GeometryBVH:
+    """
+    几何体层次包围盒
+
+    叶节点保存场景中的实际几何体（组只参与变化检测，不进入树）。树的形状固定为按层
+    两两合并的近似完全二叉树，图元顺序由逐层的中位数划分决定，构建过程完全向量化。拓扑变化（增删节点、
+    改变父子关系）时延迟重建；只有位置、旋转、尺寸变化时，根据几何体的修改记录找到
+    受影响的子树，仅重新计算其图元的包围盒并向上调整祖先节点。
+    """
+    # 每个叶节点包含的图元数量
+    LEAF_SIZE = 4
+
+    def __init__(self):
+        self._needs_rebuild = True
+        self._roots = ()  # 构建时的顶层对象，顶层列表没有修订号，逐个比较对象标识发现增删和替换
+        self._synced_revision = 0  # 已经处理过的最大修改记录修订号
+        self._records = {}  # id(节点) -> [节点, 自身修订号, 子节点元组, 图元索引]
+        self.primitives = []  # 图元几何体，按叶节点顺序排列
+        self.scene_order = np.zeros(0, dtype=np.int64)  # 按场景深度优先遍历顺序排列的图元索引
+        self._prim_min = []  # 每个图元的包围盒，Python列表便于逐个访问
+        self._prim_max = []
+        self._prim_arrays = None  # 图元包围盒的数组形式，按需生成，图元包围盒变化时失效
+        self._prim_leaf = []  # 图元所在的叶节点
+        self._node_min = []
+        self._node_max = []
+        self._node_left = []  # 内部节点的子节点，叶节点为-1；只有一个子节点时右子节点为-1
+        self._node_right = []
+        self._node_parent = []
+        self._leaf_offset = 0  # 第一个叶节点的编号，叶节点 k 包含图元 [k*LEAF_SIZE, (k+1)*LEAF_SIZE)
+        self._level_sizes = []  # 自底向上每一层的节点数量
+        self._level_offsets = {}  # 层 -> 该层第一个节点的编号
+
+    def invalidate(self):
+        """标记需要重建（例如场景被整体替换）"""
+        self._needs_rebuild = True
+
+    def __len__(self):
+        """图元数量"""
+        return len(self.primitives)
+
+    def sync(self, roots):
+        """
+        使树与场景保持同步
+
+        参数:
+            roots: 场景中的顶层对象列表
+
+        返回:
+            list: 本次重新计算了包围盒的图元索引；整棵树被重建时返回None
+        """
+        if (self._needs_rebuild or len(roots) != len(self._roots)
+                or any(a is not b for a, b in zip(roots, self._roots))):
+            self.build(roots)
+            return None
+
+        changes = BaseGeometry.recent_changes
+        if not changes or changes[-1][0] <= self._synced_revision:
+            return []
+        if len(changes) == changes.maxlen and changes[0][0] > self._synced_revision:
+            # 修改记录已溢出，无法确定哪些节点发生了变化
+            self.build(roots)
+            return None
+
+        # 从最新的记录向前处理到上次同步的位置
+        moved = []
+        for revision, node in reversed(changes):
+            if revision <= self._synced_revision:
+                break
+            record = self._records.get(id(node))
+            if record is None or record[0] is not node or record[1] == node.local_revision:
+                # 不在场景中（id可能被已回收节点的记录复用），或者同一节点较新的记录已经处理过
+                continue
+            record[1] = node.local_revision
+            children = record[2]
+            if len(children) != len(node.children) or any(a is not b for a, b in zip(node.children, children)):
+                self.build(roots)
+                return None
+            moved.append(node)
+        self._synced_revision = changes[-1][0]
+
+        # 节点移动后其整个子树的世界包围盒都会变化
+        prims = set()
+        stack = moved
+        while stack:
+            node = stack.pop()
+            prim_index = self._records[id(node)][3]
+            if prim_index >= 0:
+                prims.add(prim_index)
+            stack.extend(node.children)
+        prims = sorted(prims)
+        if prims:
+            self.refit(prims)
+        return prims
+
+    def build(self, roots):
+        """
+        根据场景重建整棵树
+
+        参数:
+            roots: 场景中的顶层对象列表
+        """
+        update_transforms_batch(roots)
+
+        self._records = {}
+        primitives = []
+        stack = list(reversed(roots))
+        while stack:
+            node = stack.pop()
+            if node.type != 'group':
+                primitives.append(node)
+            self._records[id(node)] = [node, node.local_revision, tuple(node.children), -1]
+            stack.extend(reversed(node.children))
+
+        self._needs_rebuild = False
+        self._roots = tuple(roots)
+        changes = BaseGeometry.recent_changes
+        self._synced_revision = changes[-1][0] if changes else 0
+
+        count = len(primitives)
+        bounds_min, bounds_max = world_bounds(primitives)
+        leaf_count = -(-count // self.LEAF_SIZE)
+        level_sizes = [leaf_count] if count else []
+        while level_sizes and level_sizes[-1] > 1:
+            level_sizes.append((level_sizes[-1] + 1) // 2)
+
+        if count:
+            order = self._split_order((bounds_min + bounds_max) * 0.5, len(level_sizes))
+            primitives = [primitives[i] for i in order.tolist()]
+            bounds_min = bounds_min[order]
+            bounds_max = bounds_max[order]
+        for prim_index, node in enumerate(primitives):
+            self._records[id(node)][3] = prim_index
+
+        self.primitives = primitives
+        self.scene_order = np.argsort(order) if count else np.zeros(0, dtype=np.int64)
+        self._prim_min = bounds_min.tolist()
+        self._prim_max = bounds_max.tolist()
+        self._prim_arrays = (bounds_min, bounds_max)
+
+        # 节点按层自上而下编号，父节点编号总是小于子节点
+        offsets = {}
+        offset = 0
+        for level in range(len(level_sizes) - 1, -1, -1):
+            offsets[level] = offset
+            offset += level_sizes[level]
+        node_count = offset
+
+        left = np.full(node_count, -1, dtype=np.int64)
+        right = np.full(node_count, -1, dtype=np.int64)
+        parent = np.full(node_count, -1, dtype=np.int64)
+        for level in range(1, len(level_sizes)):
+            base = offsets[level]
+            child_base = offsets[level - 1]
+            child_count = level_sizes[level - 1]
+            indices = np.arange(level_sizes[level])
+            left[base + indices] = child_base + 2 * indices
+            has_right = 2 * indices + 1 < child_count
+            right[base + indices[has_right]] = child_base + 2 * indices[has_right] + 1
+            parent[child_base:child_base + child_count] = base + np.arange(child_count) // 2
+
+        self._leaf_offset = offsets.get(0, 0)
+        self._prim_leaf = (self._leaf_offset + np.arange(count) // self.LEAF_SIZE).tolist()
+        self._node_left = left.tolist()
+        self._node_right = right.tolist()
+        self._node_parent = parent.tolist()
+        self._level_sizes = level_sizes
+        self._level_offsets = offsets
+        self._compute_node_bounds(bounds_min, bounds_max)
+
+    def _split_order(self, centroids, level_count):
+        """
+        计算图元的排列顺序
+
+        树的形状是固定的：第 level 层（叶节点为第0层）的节点包含连续的 LEAF_SIZE * 2**level 个图元。
+        自上而下逐层处理，每层对所有节点同时沿其中心分布最长的轴排序，前后两半即成为左右子节点，
+        相当于对每个节点做中位数划分，但每层只需要一次向量化排序。
+
+        参数:
+            centroids: 图元包围盒中心，形状为 (N, 3)
+            level_count: 树的层数
+
+        返回:
+            np.ndarray: 图元索引的排列
+        """
+        count = len(centroids)
+        order = np.arange(count)
+        rows = np.arange(count)
+        for level in range(level_count - 1, 0, -1):
+            span = self.LEAF_SIZE << level
+            points = centroids[order]
+            starts = np.arange(0, count, span)
+            extent = np.maximum.reduceat(points, starts, axis=0) - np.minimum.reduceat(points, starts, axis=0)
+            segment = rows // span
+            key = points[rows, np.argmax(extent, axis=1)[segment]]
+            # 把坐标归一化到 [0, 1) 后加上节点编号，一次排序即可保持各节点的区间不变
+            low = key.min()
+            scale = key.max() - low
+            key = (key - low) / (scale * 1.000001) if scale > 0 else key * 0.0
+            order = order[np.argsort(segment + key, kind='stable')]
+        return order
+
+    def _compute_node_bounds(self, bounds_min, bounds_max):
+        """
+        批量计算所有节点的包围盒
+
+        参数:
+            bounds_min, bounds_max: 按叶节点顺序排列的图元包围盒数组
+        """
+        node_min = [None] * len(self._node_parent)
+        node_max = [None] * len(self._node_parent)
+        if len(bounds_min):
+            starts = np.arange(0, len(bounds_min), self.LEAF_SIZE)
+            level_min = np.minimum.reduceat(bounds_min, starts, axis=0)
+            level_max = np.maximum.reduceat(bounds_max, starts, axis=0)
+            for level, size in enumerate(self._level_sizes):
+                if level > 0:
+                    # 两两合并下一层，奇数个时最后一个节点直接上移
+                    pair_count = len(level_min) // 2
+                    merged_min = np.minimum(level_min[0:2 * pair_count:2], level_min[1:2 * pair_count:2])
+                    merged_max = np.maximum(level_max[0:2 * pair_count:2], level_max[1:2 * pair_count:2])
+                    if len(level_min) % 2:
+                        merged_min = np.vstack([merged_min, level_min[-1:]])
+                        merged_max = np.vstack([merged_max, level_max[-1:]])
+                    level_min, level_max = merged_min, merged_max
+                offset = self._level_offsets[level]
+                node_min[offset:offset + size] = level_min.tolist()
+                node_max[offset:offset + size] = level_max.tolist()
+        self._node_min = node_min
+        self._node_max = node_max
+
+    def primitive_bounds(self):
+        """
+        获取所有图元的世界包围盒
+
+        返回:
+            tuple: (最小点数组, 最大点数组)，形状均为 (N, 3)，顺序与 primitives 一致；调用者不应修改
+        """
+        if self._prim_arrays is None:
+            self._prim_arrays = (np.array(self._prim_min, dtype=np.float64).reshape(-1, 3),
+                                 np.array(self._prim_max, dtype=np.float64).reshape(-1, 3))
+        return self._prim_arrays
+
+    def overlapping_pairs(self):
+        """
+        找出世界包围盒相交的所有图元对
+
+        从 (根, 根) 开始逐层同时下降：所有叶节点在同一层，每一层的节点对都在同一层，
+        因此可以对整层的节点对一次性展开子节点对并过滤，直到叶节点再展开为图元对。
+
+        返回:
+            tuple: (第一个图元索引数组, 第二个图元索引数组)，每对只出现一次
+        """
+        count = len(self.primitives)
+        if count < 2:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        node_min = np.array(self._node_min, dtype=np.float64)
+        node_max = np.array(self._node_max, dtype=np.float64)
+        left = np.array(self._node_left, dtype=np.int64)
+        right = np.array(self._node_right, dtype=np.int64)
+
+        first = np.zeros(1, dtype=np.int64)
+        second = np.zeros(1, dtype=np.int64)
+        for _ in range(len(self._level_sizes) - 1):
+            la, ra, lb, rb = left[first], right[first], left[second], right[second]
+            same = first == second
+            # 节点与自身配对时 (右, 左) 与 (左, 右) 重复，只保留后者
+            first = np.concatenate([la, la, ra[~same], ra])
+            second = np.concatenate([lb, rb, lb[~same], rb])
+            valid = (first >= 0) & (second >= 0)
+            first, second = first[valid], second[valid]
+            touching = np.all((node_min[first] <= node_max[second]) & (node_max[first] >= node_min[second]), axis=1)
+            first, second = first[touching], second[touching]
+
+        # 叶节点对展开为图元对
+        slots = np.arange(self.LEAF_SIZE)
+        prim_a = ((first - self._leaf_offset) * self.LEAF_SIZE)[:, None, None] + slots[None, :, None]
+        prim_b = ((second - self._leaf_offset) * self.LEAF_SIZE)[:, None, None] + slots[None, None, :]
+        prim_a, prim_b = np.broadcast_arrays(prim_a, prim_b)
+        same_leaf = np.broadcast_to((first == second)[:, None, None], prim_a.shape)
+        valid = (prim_a < count) & (prim_b < count) & (~same_leaf | (prim_a < prim_b))
+        prim_a, prim_b = prim_a[valid], prim_b[valid]
+        prim_min, prim_max = self.primitive_bounds()
+        touching = np.all((prim_min[prim_a] <= prim_max[prim_b]) & (prim_max[prim_a] >= prim_min[prim_b]), axis=1)
+        return prim_a[touching], prim_b[touching]
+
+    def refit(self, prim_indices):
+        """
+        重新计算指定图元的包围盒，并自下而上调整受影响的节点
+
+        参数:
+            prim_indices: 发生移动的图元索引列表
+        """
+        geometries = [self.primitives[i] for i in prim_indices]
+        bounds_min, bounds_max = world_bounds(geometries)
+        for i, bmin, bmax in zip(prim_indices, bounds_min.tolist(), bounds_max.tolist()):
+            self._prim_min[i] = bmin
+            self._prim_max[i] = bmax
+        if self._prim_arrays is not None:
+            self._prim_arrays[0][prim_indices] = bounds_min
+            self._prim_arrays[1][prim_indices] = bounds_max
+
+        if len(prim_indices) * 8 > len(self.primitives):
+            # 大量图元移动时整体重新计算更快
+            self._compute_node_bounds(*self.primitive_bounds())
+            return
+
+        # 子节点编号总是大于父节点，按编号从大到小处理即可保证先子后父
+        pending = [-node for node in {self._prim_leaf[i] for i in prim_indices}]
+        heapq.heapify(pending)
+        queued = set(pending)
+        while pending:
+            node = -heapq.heappop(pending)
+            if self._node_left[node] < 0:
+                start = (node - self._leaf_offset) * self.LEAF_SIZE
+                end = min(start + self.LEAF_SIZE, len(self.primitives))
+                mins = self._prim_min[start:end]
+                maxs = self._prim_max[start:end]
+            else:
+                children = [self._node_left[node]]
+                if self._node_right[node] >= 0:
+                    children.append(self._node_right[node])
+                mins = [self._node_min[child] for child in children]
+                maxs = [self._node_max[child] for child in children]
+            new_min = [min(v[k] for v in mins) for k in range(3)]
+            new_max = [max(v[k] for v in maxs) for k in range(3)]
+            if new_min == self._node_min[node] and new_max == self._node_max[node]:
+                continue
+            self._node_min[node] = new_min
+            self._node_max[node] = new_max
+
+            parent = self._node_parent[node]
+            if parent >= 0 and -parent not in queued:
+                queued.add(-parent)
+                heapq.heappush(pending, -parent)
+
+    def traverse(self, ray_origin, ray_direction, test_batch, batch_size=32, max_distance=float('inf'), extent=None):
+        """
+        由近及远遍历射线经过的叶节点，把其中的图元分批交给精确测试
+
+        图元按遍历顺序累积，攒够一批（或遍历结束时）调用一次批量测试；第一批只有一个叶节点，
+        之后每批的上限加倍，直到 batch_size。
+        进入距离超过当前最近命中的节点直接跳过，因此找到近处的命中后远处的子树不会再被访问。
+
+        参数:
+            ray_origin: 射线起点
+            ray_direction: 射线方向（单位向量）
+            test_batch: 精确测试函数 test_batch(几何体列表)，返回这批几何体中最近的命中距离（未命中为inf）
+            batch_size: 每批图元数量的上限
+            max_distance: 最大检测距离
+            extent: 扫掠形状的 (x, y, z) 半尺寸，所有包围盒按它向外扩展；为None时按射线遍历
+
+        返回:
+            float: 最近的命中距离，未命中时为 max_distance
+        """
+        best_distance = max_distance
+        if not self._node_parent:
+            return best_distance
+
+        ox, oy, oz = (float(v) for v in ray_origin)
+        ix, iy, iz = (1.0 / v if v != 0 else _INV_EPSILON for v in (float(d) for d in ray_direction))
+        ray = (ox, oy, oz, ix, iy, iz)
+
+        node_min = self._node_min
+        node_max = self._node_max
+        left = self._node_left
+        right = self._node_right
+        prim_min = self._prim_min
+        prim_max = self._prim_max
+        primitives = self.primitives
+        prim_count = len(primitives)
+        leaf_offset = self._leaf_offset
+        leaf_size = self.LEAF_SIZE
+
+        ray_box = _ray_box
+        if extent is not None:
+            # 移动的形状与包围盒相交，等价于射线与扩展后的包围盒相交
+            ex, ey, ez = (float(v) for v in extent)
+
+            def ray_box(box_min, box_max, ray, max_distance):
+                return _ray_box((box_min[0] - ex, box_min[1] - ey, box_min[2] - ez),
+                                (box_max[0] + ex, box_max[1] + ey, box_max[2] + ez), ray, max_distance)
+
+        t_root = ray_box(node_min[0], node_max[0], ray, best_distance)
+        if t_root is None:
+            return best_distance
+
+        batch = []
+        limit = leaf_size
+        stack = [(t_root, 0)]
+        while stack or batch:
+            if batch and (not stack or len(batch) >= limit):
+                distance = test_batch(batch)
+                if distance < best_distance:
+                    best_distance = distance
+                batch = []
+                # 最近的命中通常在最先到达的几个叶节点中，批次从一个叶节点开始逐步加倍
+                limit = min(limit * 2, batch_size)
+                continue
+
+            t_enter, node = stack.pop()
+            if t_enter > best_distance:
+                continue
+
+            if left[node] < 0:
+                start = (node - leaf_offset) * leaf_size
+                for prim in range(start, min(start + leaf_size, prim_count)):
+                    # 先用图元自身的包围盒过滤
+                    if ray_box(prim_min[prim], prim_max[prim], ray, best_distance) is not None:
+                        batch.append(primitives[prim])
+                continue
+
+            l, r = left[node], right[node]
+            t_left = ray_box(node_min[l], node_max[l], ray, best_distance)
+            t_right = ray_box(node_min[r], node_max[r], ray, best_distance) if r >= 0 else None
+            # 先压入较远的子节点，使较近的子节点先被处理
+            if t_left is not None and t_right is not None:
+                if t_left <= t_right:
+                    stack.append((t_right, r))
+                    stack.append((t_left, l))
+                else:
+                    stack.append((t_left, l))
+                    stack.append((t_right, r))
+            elif t_left is not None:
+                stack.append((t_left, l))
+            elif t_right is not None:
+                stack.append((t_right, r))
+
+        return best_distance
+
+
+def _ray_box(box_min, box_max, ray, max_distance):
+    """
+    射线与轴对齐包围盒的slab测试
+
+    参数:
+        box_min, box_max: 包围盒
+        ray: (ox, oy, oz, 1/dx, 1/dy, 1/dz)
+        max_distance: 超过该距离视为未命中
+
+    返回:
+        float: 进入包围盒的距离（起点在盒内时为0），未命中时返回None
+    """
+    ox, oy, oz, ix, iy, iz = ray
+    t1 = (box_min[0] - ox) * ix
+    t2 = (box_max[0] - ox) * ix
+    t_near, t_far = (t1, t2) if t1 < t2 else (t2, t1)
+
+    t1 = (box_min[1] - oy) * iy
+    t2 = (box_max[1] - oy) * iy
+    if t1 > t2:
+        t1, t2 = t2, t1
+    if t1 > t_near:
+        t_near = t1
+    if t2 < t_far:
+        t_far = t2
+
+    t1 = (box_min[2] - oz) * iz
+    t2 = (box_max[2] - oz) * iz
+    if t1 > t2:
+        t1, t2 = t2, t1
+    if t1 > t_near:
+        t_near = t1
+    if t2 < t_far:
+        t_far = t2
+
+    if t_far < 0 or t_near > t_far or t_near > max_distance:
+        return None
+    return t_near if t_near > 0 else 0.0
@@ -0,0 +1,269 @@
+"""
+摄像机
+
+保存视图和投影矩阵，并缓存屏幕坐标反投影所需的逆矩阵。
+"""
+
+import numpy as np
+
+
+class Camera:
+    """
+    摄像机
+
+    视图或投影矩阵实际发生变化时修订号加一。逆视图投影矩阵以及每个视口尺寸对应的
+    “屏幕坐标 -> 世界坐标”矩阵都按修订号缓存，摄像机不动时生成射线不需要任何矩阵求逆。
+    """
+    def __init__(self, config=None):
+        """
+        初始化摄像机
+
+        参数:
+            config: 摄像机配置字典，包含 position、target、up、view_matrix、projection_matrix
+        """
+        self.position = np.array([0.0, 0.0, 10.0])
+        self.target = np.array([0.0, 0.0, 0.0])
+        self.up = np.array([0.0, 1.0, 0.0])
+        self._view_matrix = np.eye(4)
+        self._projection_matrix = np.eye(4)
+        self._revision = 0
+        self._view_projection = None
+        self._inv_view_projection = None
+        self._screen_matrices = {}  # (视口宽, 视口高) -> 屏幕坐标到世界坐标的矩阵，只保存当前修订号的结果
+        if config:
+            self.update(config)
+
+    @property
+    def revision(self):
+        """修订号，视图或投影矩阵变化时增大"""
+        return self._revision
+
+    @property
+    def view_matrix(self):
+        """视图矩阵"""
+        return self._view_matrix
+
+    @property
+    def projection_matrix(self):
+        """投影矩阵"""
+        return self._projection_matrix
+
+    def __getitem__(self, key):
+        """兼容以字典形式读取摄像机配置"""
+        if key in ('position', 'target', 'up', 'view_matrix', 'projection_matrix'):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def update(self, config):
+        """
+        更新摄像机配置
+
+        视图每一帧都会重新设置摄像机，只有矩阵真正改变时才使缓存失效。
+
+        参数:
+            config: 摄像机配置字典，可以只包含部分键
+        """
+        for key in ('position', 'target', 'up'):
+            if key in config:
+                setattr(self, key, np.array(config[key], dtype=np.float64))
+
+        changed = False
+        for key in ('view_matrix', 'projection_matrix'):
+            if key in config:
+                matrix = np.array(config[key], dtype=np.float64)
+                if not np.array_equal(matrix, getattr(self, '_' + key)):
+                    setattr(self, '_' + key, matrix)
+                    changed = True
+        if changed:
+            self._revision += 1
+            self._view_projection = None
+            self._inv_view_projection = None
+            self._screen_matrices = {}
+
+    @property
+    def view_projection(self):
+        """视图投影矩阵 P·V，按修订号缓存"""
+        if self._view_projection is None:
+            self._view_projection = self._projection_matrix @ self._view_matrix
+        return self._view_projection
+
+    @property
+    def inverse_view_projection(self):
+        """逆视图投影矩阵 (P·V)^-1，按修订号缓存"""
+        if self._inv_view_projection is None:
+            self._inv_view_projection = np.linalg.inv(self.view_projection)
+        return self._inv_view_projection
+
+    def screen_matrix(self, viewport_width, viewport_height):
+        """
+        获取把屏幕坐标 (x, y, ndc_z, 1) 变换到齐次世界坐标的矩阵
+
+        即逆视图投影矩阵与该视口的屏幕到NDC映射的乘积，按视口尺寸缓存。
+
+        参数:
+            viewport_width: 视口宽度
+            viewport_height: 视口高度
+
+        返回:
+            np.ndarray: 4x4矩阵
+        """
+        key = (viewport_width, viewport_height)
+        matrix = self._screen_matrices.get(key)
+        if matrix is None:
+            # NDC: x = 2x/w - 1, y = 1 - 2y/h（OpenGL坐标系Y轴向上）
+            ndc_from_screen = np.array([
+                [2.0 / viewport_width, 0.0, 0.0, -1.0],
+                [0.0, -2.0 / viewport_height, 0.0, 1.0],
+                [0.0, 0.0, 1.0, 0.0],
+                [0.0, 0.0, 0.0, 1.0],
+            ])
+            matrix = self.inverse_view_projection @ ndc_from_screen
+            self._screen_matrices[key] = matrix
+        return matrix
+
+    def unproject(self, ndc_x, ndc_y, ndc_z):
+        """
+        将归一化设备坐标转换为世界坐标
+
+        参数:
+            ndc_x, ndc_y, ndc_z: 归一化设备坐标
+
+        返回:
+            np.ndarray: 世界坐标 (x, y, z)
+        """
+        world = self.inverse_view_projection @ np.array([ndc_x, ndc_y, ndc_z, 1.0])
+        if world[3] != 0:
+            world = world / world[3]
+        return world[:3]
+
+    def project_bounds(self, bounds_min, bounds_max, viewport_width, viewport_height):
+        """
+        批量计算轴对齐包围盒投影到屏幕后的二维包围矩形
+
+        参数:
+            bounds_min, bounds_max: 包围盒数组，形状均为 (N, 3)
+            viewport_width: 视口宽度
+            viewport_height: 视口高度
+
+        返回:
+            tuple: (屏幕最小点 (N, 2), 屏幕最大点 (N, 2), 角点裁剪空间w分量的最小值 (N,))，
+                   w <= 0 表示有角点位于摄像机平面后方，此时屏幕矩形无意义
+        """
+        rows = self.view_projection[[0, 1, 3]].astype(np.float32)  # 只需要裁剪坐标的 x、y、w
+        # 屏幕坐标只需要亚像素精度，用float32并复用缓冲区以减少内存带宽
+        center = ((bounds_min + bounds_max) * 0.5).T.astype(np.float32)
+        half = ((bounds_max - bounds_min) * 0.5).T.astype(np.float32)
+        clip_center = rows[:, :3] @ center + rows[:, 3:]  # (3, N)
+        axis_terms = [np.outer(rows[:, axis], half[axis]) for axis in range(3)]  # 每轴 (3, N)
+        return _project_box_terms(clip_center, axis_terms, viewport_width, viewport_height)
+
+    def project_boxes(self, centers, half_axes, viewport_width, viewport_height):
+        """
+        批量计算有向包围盒投影到屏幕后的二维包围矩形
+
+        参数:
+            centers: 形状为 (N, 3) 的包围盒中心
+            half_axes: 形状为 (N, 3, 3) 的半轴向量，half_axes[:, :, k] 为第k个半轴
+            viewport_width: 视口宽度
+            viewport_height: 视口高度
+
+        返回:
+            tuple: 同 project_bounds
+        """
+        rows = self.view_projection[[0, 1, 3]].astype(np.float32)
+        clip_center = rows[:, :3] @ centers.T.astype(np.float32) + rows[:, 3:]
+        axis_terms = [rows[:, :3] @ half_axes[:, :, axis].T.astype(np.float32) for axis in range(3)]
+        return _project_box_terms(clip_center, axis_terms, viewport_width, viewport_height)
+
+    def screen_to_ray(self, screen_x, screen_y, viewport_width, viewport_height, near_z=-1.0, far_z=1.0):
+        """
+        从屏幕坐标生成世界空间射线
+
+        参数:
+            screen_x: 屏幕X坐标
+            screen_y: 屏幕Y坐标
+            viewport_width: 视口宽度
+            viewport_height: 视口高度
+            near_z: 射线起点的NDC深度
+            far_z: 确定射线方向的另一个点的NDC深度
+
+        返回:
+            tuple: (射线起点, 单位方向)，起点位于 near_z 对应的平面上
+        """
+        matrix = self.screen_matrix(viewport_width, viewport_height)
+        points = matrix @ np.array([[screen_x, screen_x], [screen_y, screen_y], [near_z, far_z], [1.0, 1.0]])
+        near = points[:3, 0] / points[3, 0]
+        far = points[:3, 1] / points[3, 1]
+        direction = far - near
+        return near, direction / np.linalg.norm(direction)
+
+    def pixel_rays(self, viewport_width, viewport_height):
+        """
+        一次生成视口中每个像素中心的射线
+
+        参数:
+            viewport_width: 视口宽度（像素）
+            viewport_height: 视口高度（像素）
+
+        返回:
+            tuple: (射线起点, 单位方向)，形状均为 (高*宽, 3)，按行优先排列，第0行为屏幕顶部
+        """
+        matrix = self.screen_matrix(viewport_width, viewport_height)
+        xs = np.tile(np.arange(viewport_width) + 0.5, viewport_height)
+        ys = np.repeat(np.arange(viewport_height) + 0.5, viewport_width)
+        # 屏幕坐标 (x, y, z, 1) 的齐次变换按列展开，近平面 z=-1，远平面 z=1
+        base = np.outer(xs, matrix[:, 0]) + np.outer(ys, matrix[:, 1]) + matrix[:, 3]
+        near = base - matrix[:, 2]
+        far = base + matrix[:, 2]
+        near = near[:, :3] / near[:, 3:]
+        direction = far[:, :3] / far[:, 3:] - near
+        direction /= np.linalg.norm(direction, axis=1)[:, None]
+        return near, direction
+
+
+def _project_box_terms(clip_center, axis_terms, viewport_width, viewport_height):
+    """
+    由盒子中心和三个半轴的裁剪坐标计算其投影的屏幕包围矩形
+
+    投影是线性的，8个角点的裁剪坐标等于中心的裁剪坐标加减各半轴的贡献，
+    因此逐个角点累加最小/最大值即可，不需要构造 (N, 8, 4) 的角点数组。
+
+    参数:
+        clip_center: 形状为 (3, N) 的中心裁剪坐标 (x, y, w)
+        axis_terms: 三个形状为 (3, N) 的半轴裁剪坐标增量
+        viewport_width: 视口宽度
+        viewport_height: 视口高度
+
+    返回:
+        tuple: 同 Camera.project_bounds
+    """
+    count = clip_center.shape[1]
+    along_x = np.empty((3, count), dtype=np.float32)
+    along_xy = np.empty((3, count), dtype=np.float32)
+    clip = np.empty((3, count), dtype=np.float32)
+    ndc = np.empty((2, count), dtype=np.float32)
+    ndc_min = np.full((2, count), np.inf, dtype=np.float32)
+    ndc_max = np.full((2, count), -np.inf, dtype=np.float32)
+    w_min = np.full(count, np.inf, dtype=np.float32)
+    for sx in (np.subtract, np.add):
+        sx(clip_center, axis_terms[0], out=along_x)
+        for sy in (np.subtract, np.add):
+            sy(along_x, axis_terms[1], out=along_xy)
+            for sz in (np.subtract, np.add):
+                sz(along_xy, axis_terms[2], out=clip)
+                w = clip[2]
+                np.minimum(w_min, w, out=w_min)
+                # 摄像机平面上的点w为0，除法得到inf/nan，调用者按w过滤
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    np.divide(clip[:2], w, out=ndc)
+                np.minimum(ndc_min, ndc, out=ndc_min)
+                np.maximum(ndc_max, ndc, out=ndc_max)
+
+    # NDC到屏幕：x = (ndc_x + 1) * w / 2，y = (1 - ndc_y) * h / 2（屏幕Y轴向下，最小值来自NDC最大值）
+    screen_min = np.empty((count, 2))
+    screen_max = np.empty((count, 2))
+    screen_min[:, 0] = (ndc_min[0] + 1.0) * (viewport_width * 0.5)
+    screen_max[:, 0] = (ndc_max[0] + 1.0) * (viewport_width * 0.5)
+    screen_min[:, 1] = (1.0 - ndc_max[1]) * (viewport_height * 0.5)
+    screen_max[:, 1] = (1.0 - ndc_min[1]) * (viewport_height * 0.5)
+    return screen_min, screen_max, w_min
@@ -4,9 +4,11 @@
 定义了场景中的几何体数据结构及其操作。
 """
 
+import collections
+import itertools
 import numpy as np
 from enum import Enum, auto
-from scipy.spatial.transform import Rotation as R
+from .scene_arrays import write_array
 
 class OperationMode(Enum):
     """操作模式枚举"""
@@ -26,15 +28,168 @@ class GeometryType(Enum):
     TRIANGLE = "triangle"
 
 
+def euler_to_matrix_batch(euler_degrees):
+    """
+    批量将欧拉角转换为旋转矩阵
+    
+    与 scipy 的 Rotation.from_euler('XYZ', ..., degrees=True) 约定一致（内旋XYZ，即MuJoCo默认的xyz）。
+    
+    参数:
+        euler_degrees: 形状为 (N, 3) 的欧拉角数组（角度制）
+        
+    返回:
+        np.ndarray: 形状为 (N, 3, 3) 的旋转矩阵数组
+    """
+    angles = np.radians(np.asarray(euler_degrees, dtype=np.float64).reshape(-1, 3))
+    cos = np.cos(angles)
+    sin = np.sin(angles)
+    ca, cb, cc = cos[:, 0], cos[:, 1], cos[:, 2]
+    sa, sb, sc = sin[:, 0], sin[:, 1], sin[:, 2]
+    
+    matrices = np.empty((len(angles), 3, 3))
+    matrices[:, 0, 0] = cb * cc
+    matrices[:, 0, 1] = -cb * sc
+    matrices[:, 0, 2] = sb
+    matrices[:, 1, 0] = ca * sc + sa * sb * cc
+    matrices[:, 1, 1] = ca * cc - sa * sb * sc
+    matrices[:, 1, 2] = -sa * cb
+    matrices[:, 2, 0] = sa * sc - ca * sb * cc
+    matrices[:, 2, 1] = sa * cc + ca * sb * sc
+    matrices[:, 2, 2] = ca * cb
+    return matrices
+
+
+def quat_to_matrix_batch(quats):
+    """
+    批量将四元数转换为旋转矩阵
+    
+    参数:
+        quats: 形状为 (N, 4) 的四元数数组，采用MuJoCo的 (w, x, y, z) 顺序，无需预先归一化
+        
+    返回:
+        np.ndarray: 形状为 (N, 3, 3) 的旋转矩阵数组
+    """
+    q = np.asarray(quats, dtype=np.float64).reshape(-1, 4)
+    norm = np.linalg.norm(q, axis=1, keepdims=True)
+    q = q / np.where(norm > 0, norm, 1.0)
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    
+    matrices = np.empty((len(q), 3, 3))
+    matrices[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    matrices[:, 0, 1] = 2 * (x * y - w * z)
+    matrices[:, 0, 2] = 2 * (x * z + w * y)
+    matrices[:, 1, 0] = 2 * (x * y + w * z)
+    matrices[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    matrices[:, 1, 2] = 2 * (y * z - w * x)
+    matrices[:, 2, 0] = 2 * (x * z - w * y)
+    matrices[:, 2, 1] = 2 * (y * z + w * x)
+    matrices[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return matrices
+
+
+def matrix_to_euler_batch(matrices):
+    """
+    批量将旋转矩阵转换为欧拉角（内旋XYZ，角度制），是 euler_to_matrix_batch 的逆运算
+    
+    参数:
+        matrices: 形状为 (N, 3, 3) 的旋转矩阵数组
+        
+    返回:
+        np.ndarray: 形状为 (N, 3) 的欧拉角数组
+    """
+    m = np.asarray(matrices, dtype=np.float64).reshape(-1, 3, 3)
+    beta = np.arcsin(np.clip(m[:, 0, 2], -1.0, 1.0))
+    alpha = np.arctan2(-m[:, 1, 2], m[:, 2, 2])
+    gamma = np.arctan2(-m[:, 0, 1], m[:, 0, 0])
+    
+    # 万向节锁：绕Z的角度无法区分，将其置0并把全部旋转归到X
+    locked = np.abs(m[:, 0, 2]) > 1.0 - 1e-9
+    if np.any(locked):
+        alpha[locked] = np.arctan2(m[locked, 2, 1], m[locked, 1, 1])
+        gamma[locked] = 0.0
+    
+    return np.degrees(np.stack([alpha, beta, gamma], axis=1))
+
+
+def update_transforms_batch(nodes):
+    """
+    批量更新节点及其整个子树的变换矩阵
+    
+    按层级自上而下处理：每一层中局部矩阵失效的节点通过一次向量化计算得到旋转矩阵，
+    世界矩阵则由父节点世界矩阵与局部矩阵批量相乘得到。只有失效的节点会被重新计算。
+    
+    参数:
+        nodes: 根节点列表（或单个节点），其子树中的所有节点都会被更新
+    """
+    if isinstance(nodes, BaseGeometry):
+        nodes = [nodes]
+    level = list(nodes)
+    
+    while level:
+        # 1. 批量重新计算本层失效的局部矩阵
+        local_dirty = [node for node in level if node._local_dirty]
+        if local_dirty:
+            rotations = euler_to_matrix_batch([node._rotation for node in local_dirty])
+            local = np.zeros((len(local_dirty), 4, 4))
+            local[:, :3, :3] = rotations
+            local[:, :3, 3] = [node._position[:3] for node in local_dirty]
+            local[:, 3, 3] = 1.0
+            _scatter_matrices(local_dirty, '_local_matrix', 'local_matrix', local)
+            for node in local_dirty:
+                node._local_dirty = False
+        
+        # 2. 批量组合本层失效的世界矩阵（上一层已全部有效）
+        world_dirty = [node for node in level if node._world_dirty]
+        if world_dirty:
+            parent_worlds = np.empty((len(world_dirty), 4, 4))
+            parent_worlds[:] = np.eye(4)
+            for i, node in enumerate(world_dirty):
+                parent = node._parent
+                if parent is not None:
+                    parent_worlds[i] = parent.transform_matrix
+            local = np.array([node._local_matrix for node in world_dirty], dtype=np.float64)
+            _scatter_matrices(world_dirty, '_world_matrix', 'world_matrix', parent_worlds @ local)
+            for node in world_dirty:
+                node._world_dirty = False
+        
+        # 3. 进入下一层
+        level = [child for node in level for child in node.children]
+
+
+def _scatter_matrices(nodes, attr, column, matrices):
+    """把批量计算得到的矩阵写回节点，节点共用同一个SceneArrays时直接按列写入"""
+    store = nodes[0]._store
+    if store is not None and all(node._store is store for node in nodes):
+        store.column(column)[[node._node_id for node in nodes]] = matrices
+    else:
+        for node, matrix in zip(nodes, matrices):
+            write_array(node, attr, matrix)
+
+
+# 全局递增的修订号，用于标记子树内容的变化
+_revision_counter = itertools.count(1)
+
+
 class Material:
     """
     材质类，定义几何体的外观属性
     """
     def __init__(self):
+        self._owner = None  # 所属几何体，颜色变化时标记其修订号失效
+        self._store = None  # 所属几何体绑定的SceneArrays（可选）
         self._base_color = np.array([1.0, 1.0, 1.0, 1.0])  # 默认白色
-        self.specular = np.array([0.5, 0.5, 0.5, 1.0])
+        self._specular = np.array([0.5, 0.5, 0.5, 1.0])
         self.shininess = 32.0
     
+    def __getstate__(self):
+        """复制时脱离共享存储，副本持有独立的数组"""
+        state = self.__dict__.copy()
+        if self._store is not None:
+            state['_store'] = None
+            state['_base_color'] = np.array(self._base_color)
+            state['_specular'] = np.array(self._specular)
+        return state
+    
     @property
     def color(self):
         """主颜色访问接口（RGBA格式）"""
@@ -47,29 +202,55 @@ class Material:
             raise ValueError("颜色值应为RGB或RGBA格式")
         
         if len(value) == 3:
-            self._base_color = np.array([*value, 1.0], dtype=np.float32)
+            write_array(self, '_base_color', [*value, 1.0], dtype=np.float32)
         else:
-            self._base_color = np.array(value, dtype=np.float32)
+            write_array(self, '_base_color', value, dtype=np.float32)
+        if self._owner is not None:
+            self._owner._touch()
+    
+    @property
+    def specular(self):
+        """高光颜色（RGBA格式）"""
+        return self._specular
+    
+    @specular.setter
+    def specular(self, value):
+        """设置高光颜色"""
+        write_array(self, '_specular', value)
 
 
 class BaseGeometry:
     """
     几何体基类，定义了所有几何体的通用属性和方法
     """
+    # 最近被修改的节点记录 (自身修订号, 节点)，按修订号递增排列，供增量更新的消费者查询；
+    # 容量有限，溢出后较早的记录被丢弃，消费者需要自行回退到全量处理
+    recent_changes = collections.deque(maxlen=4096)
+
     def __init__(self, geo_type, name="Object", position=(0, 0, 0), 
                  size=(1, 1, 1), rotation=(0, 0, 0), parent=None):
         self.type = geo_type
-        self.name = name
+        self._name = name
+        self._revision = next(_revision_counter)  # 子树修订号
+        self._changed = True  # 修订号读取之后子树是否又发生了变化
+        self._local_revision = self._revision  # 节点自身（不含后代）的修订号
+        self._store = None  # 绑定的SceneArrays（可选），绑定后数值属性是其中的行视图
+        self._node_id = None  # 在SceneArrays中的节点ID
         self._visible = True
         self._position = np.array(position, dtype=np.float32)
         self._size = np.array(size, dtype=np.float32)
         self._rotation = np.array(rotation, dtype=np.float32)
-        self.parent = parent
+        self._parent = parent
         self.children = []
         self.material = Material()
         self.aabb_min = np.zeros(3, dtype=np.float32)
         self.aabb_max = np.zeros(3, dtype=np.float32)
-        self.transform_matrix = np.eye(4)
+        
+        # 变换矩阵缓存：局部矩阵和世界矩阵分别缓存，通过脏标记按需重新计算
+        self._local_matrix = np.eye(4)
+        self._world_matrix = np.eye(4)
+        self._local_dirty = True
+        self._world_dirty = True
        
         # 设置默认颜色
         type_colors = {
@@ -82,10 +263,75 @@ class BaseGeometry:
             GeometryType.TRIANGLE.value: (0.2, 0.8, 0.8, 1.0),  # 青色
         }
         self.material.color = type_colors.get(geo_type, (1.0, 1.0, 1.0, 1.0))
+        self.material._owner = self
         
-        self._update_transform()
         self._update_aabb()
     
+    def __getstate__(self):
+        """复制时脱离共享存储，副本持有独立的数组"""
+        state = self.__dict__.copy()
+        if self._store is not None:
+            state['_store'] = None
+            state['_node_id'] = None
+            for attr in self._store.GEOMETRY_FIELDS:
+                state[attr] = np.array(state[attr])
+        return state
+    
+    @property
+    def node_id(self):
+        """在SceneArrays中的节点ID，未绑定时为None"""
+        return self._node_id
+    
+    @property
+    def revision(self):
+        """
+        子树修订号
+        
+        节点自身或任一后代的导出相关属性（名称、变换、尺寸、颜色、子节点）发生变化后，
+        下一次读取会得到更大的值，可以用作子树缓存的键。
+        """
+        if self._changed:
+            # 为变化过的节点分配新的修订号并清除标记；未变化的子树保留原修订号
+            revision = next(_revision_counter)
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                if node._changed:
+                    node._changed = False
+                    node._revision = revision
+                    stack.extend(node.children)
+        return self._revision
+    
+    @property
+    def local_revision(self):
+        """节点自身属性（不含后代）的修订号，节点本身被修改或增删子节点时增大"""
+        return self._local_revision
+    
+    def _touch(self):
+        """
+        标记节点及其祖先发生了变化
+        
+        变化标记的祖先必然也已标记，遇到已标记的节点即可停止传播，
+        因此连续修改同一子树的代价与层级深度无关。
+        """
+        self._local_revision = next(_revision_counter)
+        BaseGeometry.recent_changes.append((self._local_revision, self))
+        node = self
+        while node is not None and not node._changed:
+            node._changed = True
+            node = node._parent
+    
+    @property
+    def name(self):
+        """获取名称"""
+        return self._name
+    
+    @name.setter
+    def name(self, value):
+        """设置名称"""
+        self._name = value
+        self._touch()
+    
     @property
     def visible(self):
         """获取可见性"""
@@ -96,6 +342,17 @@ class BaseGeometry:
         """设置可见性"""
         self._visible = value
 
+    @property
+    def parent(self):
+        """获取父对象"""
+        return self._parent
+    
+    @parent.setter
+    def parent(self, value):
+        """设置父对象，整个子树的世界矩阵随之失效"""
+        self._parent = value
+        self._invalidate_world()
+
     @property
     def position(self):
         """获取位置"""
@@ -104,9 +361,10 @@ class BaseGeometry:
     @position.setter
     def position(self, value):
         """设置位置"""
-        self._position = np.array(value)
-        self._update_transform()
+        write_array(self, '_position', value)
+        self._invalidate_local()
         self._update_aabb()
+        self._touch()
     
     @property
     def size(self):
@@ -115,10 +373,10 @@ class BaseGeometry:
     
     @size.setter
     def size(self, value):
-        """设置尺寸"""
-        self._size = np.array(value)
-        self._update_transform()
+        """设置尺寸（尺寸不参与变换矩阵，只需更新包围盒）"""
+        write_array(self, '_size', value)
         self._update_aabb()
+        self._touch()
     
     @property
     def rotation(self):
@@ -128,9 +386,10 @@ class BaseGeometry:
     @rotation.setter
     def rotation(self, value):
         """设置旋转角度"""
-        self._rotation = np.array(value, dtype=np.float32)
-        self._update_transform()
+        write_array(self, '_rotation', value, dtype=np.float32)
+        self._invalidate_local()
         self._update_aabb()
+        self._touch()
     
     @property
     def aabb_bounds(self):
@@ -141,13 +400,25 @@ class BaseGeometry:
         """添加子对象"""
         self.children.append(child)
         child.parent = self
-        child.update_transform_matrix()
+        self._touch()
+        # 父对象绑定了SceneArrays时，新的子树也放入同一个存储
+        if self._store is not None and child._store is not self._store:
+            self._store.attach(child)
+    
+    def insert_child(self, index, child):
+        """在指定位置插入子对象，用于恢复子对象原来的顺序"""
+        self.children.insert(index, child)
+        child.parent = self
+        self._touch()
+        if self._store is not None and child._store is not self._store:
+            self._store.attach(child)
     
     def remove_child(self, child):
         """移除子对象"""
         if child in self.children:
             self.children.remove(child)
             child.parent = None
+            self._touch()
     
     def _update_aabb(self):
         """更新几何体的轴对齐包围盒"""
@@ -165,32 +436,70 @@ class BaseGeometry:
                 size_array = size_array[:len(self.position)]
         
         # 计算 AABB
-        self.aabb_min = self.position - size_array
-        self.aabb_max = self.position + size_array
+        write_array(self, 'aabb_min', self.position - size_array)
+        write_array(self, 'aabb_max', self.position + size_array)
+    
+    def _invalidate_local(self):
+        """标记局部变换矩阵失效"""
+        self._local_dirty = True
+        self._invalidate_world()
+    
+    def _invalidate_world(self):
+        """
+        标记世界变换矩阵失效，并传播到整个子树
+        
+        世界矩阵只有在父节点的世界矩阵有效时才会被计算，因此一个已经失效的节点
+        其所有子孙节点必然也已失效，遇到这样的节点即可停止传播。
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node._world_dirty:
+                continue
+            node._world_dirty = True
+            stack.extend(node.children)
     
     def _update_transform(self):
-        """更新变换矩阵"""
-        # 使用scipy的Rotation创建旋转矩阵，注意使用角度制
-        rot_3x3 = R.from_euler('XYZ', self.rotation, degrees=True).as_matrix()
+        """重新计算局部变换矩阵"""
+        # 欧拉角为角度制，约定与批量计算一致（内旋XYZ）
+        rot_3x3 = euler_to_matrix_batch(self.rotation[:3])[0]
         translation_matrix = np.eye(4)
         translation_matrix[:3, 3] = self.position
         translation_matrix[:3, :3] = rot_3x3
         
-        self.transform_matrix = translation_matrix
+        write_array(self, '_local_matrix', translation_matrix)
+        self._local_dirty = False
     
-    def update_transform_matrix(self):
-        """更新变换矩阵，考虑位置、旋转和父节点"""
-        # 先更新自身的局部变换矩阵
-        self._update_transform()
-        
-        # 如果有父节点，需要考虑父节点的变换
-        if self.parent is not None and hasattr(self.parent, 'transform_matrix'):
-            self.transform_matrix = self.parent.transform_matrix @ self.transform_matrix
+    @property
+    def local_matrix(self):
+        """获取相对于父节点的局部变换矩阵（带缓存）"""
+        if self._local_dirty:
+            self._update_transform()
+        return self._local_matrix
+    
+    @property
+    def transform_matrix(self):
+        """获取世界变换矩阵（带缓存，仅在失效时重新计算）"""
+        if self._world_dirty:
+            # 向上找到第一个世界矩阵有效的祖先，再自上而下依次计算
+            chain = []
+            node = self
+            while node is not None and node._world_dirty:
+                chain.append(node)
+                node = node._parent
+            
+            for node in reversed(chain):
+                if node._parent is not None:
+                    write_array(node, '_world_matrix', node._parent._world_matrix @ node.local_matrix)
+                else:
+                    write_array(node, '_world_matrix', node.local_matrix)
+                node._world_dirty = False
         
-        # 递归更新所有子节点的变换矩阵
-        for child in self.children:
-            if hasattr(child, 'update_transform_matrix'):
-                child.update_transform_matrix()
+        return self._world_matrix
+    
+    def update_transform_matrix(self):
+        """确保世界变换矩阵为最新状态，只有失效时才会重新计算"""
+        return self.transform_matrix
     
     def get_all_geometries(self):
         """获取所有子几何体（包括自己）"""
@@ -243,9 +552,9 @@ class GeometryGroup(BaseGeometry):
     @size.setter
     def size(self, value):
         """设置尺寸（仅用于显示，不影响子对象）"""
-        self._size = np.array(value)
-        self._update_transform()
+        write_array(self, '_size', value)
         self._update_aabb()
+        self._touch()
         # 注意：不更新子对象的大小
     
     def _update_children_transforms(self):
@@ -0,0 +1,513 @@
+"""
+穿插检测
+
+检查场景中初始姿态下相互穿插的几何体，用于导出仿真前的场景校验。
+"""
+
+import numpy as np
+from typing import List, Tuple
+from .geometry import BaseGeometry
+from .bvh import GeometryBVH, shape_half_extents
+from .raycaster import intersect_kind
+from .scene_arrays import gather_array
+
+# 用线段加半径表示的圆形图元：球体是长度为0的线段，胶囊体沿局部Y轴
+_ROUND_KINDS = ('sphere', 'capsule')
+
+# 求线段到盒子最短距离的三分搜索迭代次数，每次把搜索区间缩小到 2/3
+_TERNARY_STEPS = 40
+
+# 用支撑函数做GJK测试的图元类型编码；其余类型（盒子、平面、按包围盒处理的类型）编码为0
+_SUPPORT_CODES = {'sphere': 1, 'capsule': 2, 'cylinder': 3, 'ellipsoid': 4}
+_CURVED_CODES = (3, 4)
+
+# GJK的最大迭代次数，超过后按当前最近点判断
+_GJK_STEPS = 64
+
+# 单纯形（至多4个顶点）的所有非空顶点子集，按顶点数从少到多排列
+_SIMPLEX_FACES = sorted((tuple(i for i in range(4) if mask >> i & 1) for mask in range(1, 16)), key=len)
+
+
+class OverlapDetector:
+    """
+    几何体穿插检测器
+
+    先在层次包围盒上成对遍历得到世界包围盒相交的候选对，再按类型批量做精确测试：
+    球体、胶囊体之间按线段距离判断；盒子之间用分离轴测试；圆形图元与盒子之间求线段到
+    盒子的最短距离；涉及圆柱体、椭球体的对用各自的支撑函数做GJK测试。平面按零厚度矩形
+    参与测试，与射线投射器的处理方式一致。
+
+    同一个父对象下的几何体、以及父子对象中的几何体（对应MJCF中的同一刚体和父子刚体）不报告。
+    场景修改后只重新检测包围盒变化的几何体所在的候选对。
+    """
+    # 穿透深度不超过该值视为接触而不是穿插
+    TOLERANCE = 1e-5
+    # 变化的图元超过总数的 1/FULL_CHECK_RATIO 时整体重新检测
+    FULL_CHECK_RATIO = 8
+
+    def __init__(self):
+        self._bvh = GeometryBVH()
+        self._pairs = np.zeros((0, 2), dtype=np.int64)  # 穿插的图元索引对，每对中较小的索引在前
+        self._frames = None  # 各图元的精确测试数据，见 _primitive_frames
+        self._bodies = None  # (自身编号, 父对象编号, 祖父对象编号)，无对象时为-1
+
+    def invalidate(self):
+        """标记需要整体重新检测（例如场景被整体替换）"""
+        self._bvh.invalidate()
+
+    def find_overlaps(self, roots) -> List[Tuple[BaseGeometry, BaseGeometry]]:
+        """
+        检测场景中相互穿插的几何体
+
+        参数:
+            roots: 场景中的顶层对象列表
+
+        返回:
+            List[Tuple[BaseGeometry, BaseGeometry]]: 穿插的几何体对，按场景深度优先遍历顺序排列
+        """
+        changed = self._bvh.sync(roots)
+        primitives = self._bvh.primitives
+        if changed is None or self._frames is None or len(changed) * self.FULL_CHECK_RATIO > len(primitives):
+            self._check_all()
+        elif changed:
+            self._check_changed(np.asarray(changed, dtype=np.int64))
+
+        if not len(self._pairs):
+            return []
+        scene_ids = np.empty(len(primitives), dtype=np.int64)
+        scene_ids[self._bvh.scene_order] = np.arange(len(primitives))
+        ordered = np.sort(scene_ids[self._pairs], axis=1)
+        ordered = ordered[np.lexsort((ordered[:, 1], ordered[:, 0]))]
+        scene = self._bvh.scene_order
+        return [(primitives[scene[a]], primitives[scene[b]]) for a, b in ordered.tolist()]
+
+    def _check_all(self):
+        """对所有图元重新做扫描剪枝和精确测试"""
+        primitives = self._bvh.primitives
+        self._frames = _primitive_frames(primitives)
+        self._bodies = _body_indices(primitives)
+        first, second = self._bvh.overlapping_pairs()
+        self._pairs = self._narrow_phase(first, second)
+
+    def _check_changed(self, changed):
+        """
+        只重新检测包含变化图元的候选对
+
+        参数:
+            changed: 包围盒重新计算过的图元索引数组
+        """
+        primitives = self._bvh.primitives
+        frames = _primitive_frames([primitives[i] for i in changed.tolist()])
+        for full, part in zip(self._frames, frames):
+            full[changed] = part
+
+        # 去掉旧结果中涉及变化图元的对，再把变化的图元与所有图元重新配对
+        is_changed = np.zeros(len(primitives), dtype=bool)
+        is_changed[changed] = True
+        kept = self._pairs[~(is_changed[self._pairs[:, 0]] | is_changed[self._pairs[:, 1]])]
+
+        bounds_min, bounds_max = self._bvh.primitive_bounds()
+        touching = np.all((bounds_min[changed][:, None, :] <= bounds_max[None, :, :])
+                          & (bounds_max[changed][:, None, :] >= bounds_min[None, :, :]), axis=2)
+        rows, others = np.nonzero(touching)
+        first = changed[rows]
+        # 两个图元都发生变化时只保留一次
+        keep = (first != others) & (~is_changed[others] | (first < others))
+        pairs = self._narrow_phase(first[keep], others[keep])
+        self._pairs = np.concatenate([kept, pairs])
+
+    def _narrow_phase(self, first, second):
+        """
+        对候选对做同体过滤和精确测试
+
+        参数:
+            first, second: 候选对的图元索引数组
+
+        返回:
+            np.ndarray: 形状为 (M, 2) 的穿插图元对，每对中较小的索引在前
+        """
+        first, second = np.minimum(first, second), np.maximum(first, second)
+        node, body, grandparent = self._bodies
+        # 同一父对象、父子对象、以及几何体与其直接子几何体不参与检测
+        has_body = body[first] >= 0
+        same_body = has_body & (body[first] == body[second])
+        related = ((has_body & (grandparent[first] == body[second]))
+                   | ((body[second] >= 0) & (grandparent[second] == body[first]))
+                   | (body[second] == node[first]) | (body[first] == node[second]))
+        keep = ~(same_body | related)
+        first, second = first[keep], second[keep]
+
+        round_mask, centers, rotations, half_extents, segment_ends, radii, shapes, sizes = self._frames
+        round_a, round_b = round_mask[first], round_mask[second]
+        curved = np.isin(shapes[first], _CURVED_CODES) | np.isin(shapes[second], _CURVED_CODES)
+        overlap = np.zeros(len(first), dtype=bool)
+        tolerance = self.TOLERANCE
+
+        # 涉及圆柱体、椭球体：GJK
+        rows = np.flatnonzero(curved)
+        if len(rows):
+            overlap[rows] = _convex_overlap(first[rows], second[rows], self._frames, tolerance)
+        round_a &= ~curved
+        round_b &= ~curved
+        boxes = ~curved
+
+        # 圆形-圆形：线段间距离小于半径之和
+        rows = np.flatnonzero(round_a & round_b)
+        if len(rows):
+            a, b = first[rows], second[rows]
+            distance = _segment_distance(segment_ends[a, 0], segment_ends[a, 1], segment_ends[b, 0], segment_ends[b, 1])
+            overlap[rows] = distance < radii[a] + radii[b] - tolerance
+
+        # 圆形-盒子：把圆形换到第一个位置
+        rows = np.flatnonzero(boxes & (round_a != round_b))
+        if len(rows):
+            swap = round_b[rows]
+            a = np.where(swap, second[rows], first[rows])
+            b = np.where(swap, first[rows], second[rows])
+            overlap[rows] = _round_box_overlap(segment_ends[a], radii[a], centers[b], rotations[b],
+                                               half_extents[b], tolerance)
+
+        # 盒子-盒子：分离轴测试
+        rows = np.flatnonzero(boxes & ~round_a & ~round_b)
+        if len(rows):
+            a, b = first[rows], second[rows]
+            overlap[rows] = _box_box_overlap(centers[a], rotations[a], half_extents[a],
+                                             centers[b], rotations[b], half_extents[b], tolerance)
+
+        return np.stack([first[overlap], second[overlap]], axis=1)
+
+
+def _primitive_frames(primitives):
+    """
+    读取精确测试所需的图元数据
+
+    参数:
+        primitives: 几何体列表
+
+    返回:
+        list: [是否为圆形图元 (N,), 中心 (N, 3), 旋转矩阵 (N, 3, 3), 局部半尺寸 (N, 3),
+               线段端点 (N, 2, 3), 半径 (N,), 支撑函数类型编码 (N,), 尺寸 (N, 3)]
+    """
+    count = len(primitives)
+    kinds = [intersect_kind(geo) for geo in primitives]
+    matrices = gather_array(primitives, 'world_matrix', lambda geo: geo.get_world_transform()).astype(np.float64)
+    centers = matrices[:, :3, 3].copy()
+    rotations = matrices[:, :3, :3].copy()
+    half_extents = np.array([shape_half_extents(geo.type, geo.size) for geo in primitives],
+                            dtype=np.float64).reshape(count, 3)
+    for row, kind in enumerate(kinds):
+        if kind == 'aabb':
+            # 没有专门测试的类型按世界包围盒处理
+            geo = primitives[row]
+            centers[row] = (geo.aabb_min + geo.aabb_max) * 0.5
+            rotations[row] = np.eye(3)
+            half_extents[row] = (geo.aabb_max - geo.aabb_min) * 0.5
+
+    round_mask = np.array([kind in _ROUND_KINDS for kind in kinds], dtype=bool).reshape(count)
+    sizes = gather_array(primitives, 'size', lambda geo: geo.size).astype(np.float64).reshape(count, 3)
+    radii = np.where(round_mask, sizes[:, 0], 0.0)
+    half_length = np.where(np.array([kind == 'capsule' for kind in kinds], dtype=bool).reshape(count), sizes[:, 1], 0.0)
+    axis = rotations[:, :, 1] * half_length[:, None]
+    segment_ends = np.stack([centers - axis, centers + axis], axis=1)
+    shapes = np.array([_SUPPORT_CODES.get(kind, 0) for kind in kinds], dtype=np.int64).reshape(count)
+    return [round_mask, centers, rotations, half_extents, segment_ends, radii, shapes, sizes]
+
+
+def _body_indices(primitives):
+    """
+    为每个图元编号其自身、父对象和祖父对象
+
+    参数:
+        primitives: 几何体列表
+
+    返回:
+        tuple: 三个形状为 (N,) 的编号数组，不存在的对象为-1
+    """
+    numbers = {}
+
+    def number(node):
+        return -1 if node is None else numbers.setdefault(id(node), len(numbers))
+
+    node_ids, body_ids, grandparent_ids = [], [], []
+    for geo in primitives:
+        parent = geo.parent
+        node_ids.append(number(geo))
+        body_ids.append(number(parent))
+        grandparent_ids.append(number(parent.parent if parent is not None else None))
+    return (np.array(node_ids, dtype=np.int64), np.array(body_ids, dtype=np.int64),
+            np.array(grandparent_ids, dtype=np.int64))
+
+
+def _segment_distance(p1, q1, p2, q2):
+    """
+    批量计算两组线段之间的最短距离
+
+    参数:
+        p1, q1: 形状为 (N, 3) 的第一组线段端点
+        p2, q2: 形状为 (N, 3) 的第二组线段端点
+
+    返回:
+        np.ndarray: 形状为 (N,) 的距离
+    """
+    d1 = q1 - p1
+    d2 = q2 - p2
+    r = p1 - p2
+    a = np.einsum('ni,ni->n', d1, d1)
+    e = np.einsum('ni,ni->n', d2, d2)
+    f = np.einsum('ni,ni->n', d2, r)
+    c = np.einsum('ni,ni->n', d1, r)
+    b = np.einsum('ni,ni->n', d1, d2)
+    eps = 1e-12
+    safe_a = np.where(a > eps, a, 1.0)
+    safe_e = np.where(e > eps, e, 1.0)
+
+    # 先求两条直线上的最近点参数，再截断到线段范围内
+    denom = a * e - b * b
+    s = np.where(denom > eps, np.clip((b * f - c * e) / np.where(denom > eps, denom, 1.0), 0.0, 1.0), 0.0)
+    t = (b * s + f) / safe_e
+    s = np.where(t < 0.0, np.clip(-c / safe_a, 0.0, 1.0), np.where(t > 1.0, np.clip((b - c) / safe_a, 0.0, 1.0), s))
+    t = np.clip(t, 0.0, 1.0)
+
+    # 退化为点的线段
+    s = np.where(a > eps, s, 0.0)
+    t = np.where(e > eps, np.where(a > eps, t, np.clip(f / safe_e, 0.0, 1.0)), 0.0)
+    s = np.where((e <= eps) & (a > eps), np.clip(-c / safe_a, 0.0, 1.0), s)
+
+    closest = (p1 + d1 * s[:, None]) - (p2 + d2 * t[:, None])
+    return np.sqrt(np.einsum('ni,ni->n', closest, closest))
+
+
+def _separated(axes, gap, reach_a, reach_b, tolerance):
+    """
+    分离轴判断
+
+    参数:
+        axes: 形状为 (N, K, 3) 的候选轴（零向量表示无效轴）
+        gap: 形状为 (N, K) 的中心距离投影
+        reach_a, reach_b: 形状为 (N, K) 的两个物体的投影半径
+        tolerance: 穿透容差
+
+    返回:
+        np.ndarray: 形状为 (N,) 的布尔数组，存在分离轴时为True
+    """
+    lengths = np.linalg.norm(axes, axis=2)
+    valid = lengths > 1e-6
+    scale = np.where(valid, lengths, 1.0)
+    return np.any(valid & (np.abs(gap) / scale >= (reach_a + reach_b) / scale - tolerance), axis=1)
+
+
+def _box_box_overlap(centers_a, rotations_a, half_a, centers_b, rotations_b, half_b, tolerance):
+    """批量判断两组有向包围盒是否穿插（15个候选分离轴）"""
+    axes_a = rotations_a.transpose(0, 2, 1)
+    axes_b = rotations_b.transpose(0, 2, 1)
+    cross = np.cross(axes_a[:, :, None, :], axes_b[:, None, :, :]).reshape(len(axes_a), 9, 3)
+    axes = np.concatenate([axes_a, axes_b, cross], axis=1)
+    gap = np.einsum('nki,ni->nk', axes, centers_b - centers_a)
+    reach_a = np.einsum('nkj,nj->nk', np.abs(np.einsum('nki,nji->nkj', axes, axes_a)), half_a)
+    reach_b = np.einsum('nkj,nj->nk', np.abs(np.einsum('nki,nji->nkj', axes, axes_b)), half_b)
+    return ~_separated(axes, gap, reach_a, reach_b, tolerance)
+
+
+def _round_box_overlap(segment_ends, radii, centers, rotations, half_extents, tolerance):
+    """
+    批量判断圆形图元（线段加半径）与有向包围盒是否穿插
+
+    先在盒子的3个轴和盒子轴与线段方向的3个叉积上做分离轴测试快速排除；剩下的对
+    求线段到盒子的最短距离：线段上的点到凸体的距离是凸函数，三分搜索即可收敛到最小值。
+    """
+    box_axes = rotations.transpose(0, 2, 1)
+    direction = segment_ends[:, 1] - segment_ends[:, 0]
+    middle = (segment_ends[:, 0] + segment_ends[:, 1]) * 0.5
+    cross = np.cross(box_axes, direction[:, None, :])
+    axes = np.concatenate([box_axes, cross], axis=1)
+    gap = np.einsum('nki,ni->nk', axes, centers - middle)
+    lengths = np.linalg.norm(axes, axis=2)
+    reach_round = np.abs(np.einsum('nki,ni->nk', axes, direction)) * 0.5 + radii[:, None] * lengths
+    reach_box = np.einsum('nkj,nj->nk', np.abs(np.einsum('nki,nji->nkj', axes, box_axes)), half_extents)
+    overlap = ~_separated(axes, gap, reach_round, reach_box, tolerance)
+
+    rows = np.flatnonzero(overlap)
+    if not len(rows):
+        return overlap
+    # 在盒子的局部坐标系中计算线段上各点到盒子的距离
+    start = np.einsum('nj,nji->ni', segment_ends[rows, 0] - centers[rows], rotations[rows])
+    step = np.einsum('nj,nji->ni', direction[rows], rotations[rows])
+    half = half_extents[rows]
+
+    def box_distance(t):
+        outside = np.maximum(np.abs(start + step * t[:, None]) - half, 0.0)
+        return np.sqrt(np.einsum('ni,ni->n', outside, outside))
+
+    low = np.zeros(len(rows))
+    high = np.ones(len(rows))
+    for _ in range(_TERNARY_STEPS):
+        third = (high - low) / 3.0
+        left = low + third
+        right = high - third
+        closer_left = box_distance(left) < box_distance(right)
+        high = np.where(closer_left, right, high)
+        low = np.where(closer_left, low, left)
+    overlap[rows] = box_distance((low + high) * 0.5) < radii[rows] - tolerance
+    return overlap
+
+
+def _support_points(shapes, centers, rotations, half_extents, sizes, directions, shrink):
+    """
+    批量求图元在给定方向上的支撑点（世界坐标）
+
+    参数:
+        shapes: 形状为 (N,) 的支撑函数类型编码
+        centers, rotations, half_extents, sizes: 图元数据，见 _primitive_frames
+        directions: 形状为 (N, 3) 的世界方向
+        shrink: 各图元向内收缩的距离，用于穿透容差
+
+    返回:
+        np.ndarray: 形状为 (N, 3) 的支撑点
+    """
+    local = np.einsum('nji,nj->ni', rotations, directions)
+    # 盒子、平面和按包围盒处理的类型
+    points = np.sign(local) * np.maximum(half_extents - shrink, 0.0)
+
+    length = np.linalg.norm(local, axis=1)
+    unit = local / np.where(length > 1e-12, length, 1.0)[:, None]
+    radius = np.maximum(sizes[:, 0] - shrink, 0.0)
+    rows = np.flatnonzero((shapes == 1) | (shapes == 2))
+    points[rows] = unit[rows] * radius[rows, None]
+    rows = np.flatnonzero(shapes == 2)
+    points[rows, 1] += np.sign(local[rows, 1]) * sizes[rows, 1]
+
+    # 圆柱体：径向取圆周上的点，轴向取端面
+    rows = np.flatnonzero(shapes == 3)
+    radial = np.hypot(local[rows, 0], local[rows, 2])
+    scale = radius[rows] / np.where(radial > 1e-12, radial, 1.0)
+    points[rows, 0] = local[rows, 0] * scale
+    points[rows, 2] = local[rows, 2] * scale
+    points[rows, 1] = np.sign(local[rows, 1]) * np.maximum(sizes[rows, 1] - shrink, 0.0)
+
+    # 椭球体：a²u / |a∘u|
+    rows = np.flatnonzero(shapes == 4)
+    axes = np.maximum(sizes[rows] - shrink, 0.0)
+    stretched = axes * local[rows]
+    norm = np.linalg.norm(stretched, axis=1)
+    points[rows] = axes * stretched / np.where(norm > 1e-12, norm, 1.0)[:, None]
+
+    return centers + np.einsum('nij,nj->ni', rotations, points)
+
+
+def _closest_on_simplex(points, used):
+    """
+    批量求单纯形上离原点最近的点
+
+    逐个检查单纯形的每个面（顶点子集）：原点在面所在仿射空间上的投影落在面内时，投影是一个
+    候选点；所有候选点中最近的一个就是单纯形上的最近点。
+
+    参数:
+        points: 形状为 (N, 4, 3) 的单纯形顶点
+        used: 形状为 (N, 4) 的布尔数组，标记有效的顶点
+
+    返回:
+        tuple: (最近点 (N, 3), 最近点所在面的顶点 (N, 4) 布尔数组)
+    """
+    count = len(points)
+    best = np.full(count, np.inf)
+    closest = np.zeros((count, 3))
+    face_mask = np.zeros((count, 4), dtype=bool)
+    for face in _SIMPLEX_FACES:
+        rows = np.flatnonzero(np.all(used[:, face], axis=1))
+        if not len(rows):
+            continue
+        vertices = points[rows][:, face]
+        base = vertices[:, 0]
+        if len(face) == 1:
+            valid = np.ones(len(rows), dtype=bool)
+            point = base
+        else:
+            # 以第一个顶点为原点的重心坐标：最小化 |base + Σ μ_j e_j|
+            edges = vertices[:, 1:] - base[:, None, :]
+            gram = np.einsum('nij,nkj->nik', edges, edges)
+            rhs = -np.einsum('nij,nj->ni', edges, base)
+            diagonal = np.prod(np.diagonal(gram, axis1=1, axis2=2), axis=1)
+            regular = np.linalg.det(gram) > 1e-10 * diagonal
+            safe = np.where(regular[:, None, None], gram, np.eye(len(face) - 1))
+            weights = np.linalg.solve(safe, rhs[:, :, None])[:, :, 0]
+            valid = regular & np.all(weights >= -1e-12, axis=1) & (weights.sum(axis=1) <= 1.0 + 1e-12)
+            point = base + np.einsum('ni,nij->nj', weights, edges)
+        distance = np.einsum('ni,ni->n', point, point)
+        better = valid & (distance < best[rows])
+        rows, point = rows[better], point[better]
+        best[rows] = distance[better]
+        closest[rows] = point
+        face_mask[rows] = False
+        face_mask[rows[:, None], list(face)] = True
+    return closest, face_mask
+
+
+def _convex_overlap(first, second, frames, tolerance):
+    """
+    批量判断两组凸图元是否穿插（GJK）
+
+    两个图元各自向内收缩半个容差，在闵可夫斯基差上迭代：找到使差集全部位于一侧的方向即为
+    分离，单纯形包含原点即为穿插。
+
+    参数:
+        first, second: 图元索引数组
+        frames: 图元数据，见 _primitive_frames
+        tolerance: 穿透容差
+
+    返回:
+        np.ndarray: 形状为 (N,) 的布尔数组
+    """
+    shapes, centers, rotations, half_extents, sizes = (frames[6], frames[1], frames[2], frames[3], frames[7])
+    data_a = [array[first] for array in (shapes, centers, rotations, half_extents, sizes)]
+    data_b = [array[second] for array in (shapes, centers, rotations, half_extents, sizes)]
+    shrink = tolerance * 0.5
+
+    def support(rows, direction):
+        return (_support_points(*[array[rows] for array in data_a], direction, shrink)
+                - _support_points(*[array[rows] for array in data_b], -direction, shrink))
+
+    count = len(first)
+    # 判断“原点在差集上”的距离阈值，按图元大小缩放
+    scale = np.linalg.norm(data_a[3], axis=1) + np.linalg.norm(data_b[3], axis=1)
+    epsilon = (1e-9 * (1.0 + scale)) ** 2
+
+    overlap = np.zeros(count, dtype=bool)
+    everything = np.arange(count)
+    direction = data_b[1] - data_a[1]
+    direction[np.einsum('ni,ni->n', direction, direction) < 1e-24] = (1.0, 0.0, 0.0)
+    points = np.zeros((count, 4, 3))
+    used = np.zeros((count, 4), dtype=bool)
+    points[:, 0] = support(everything, direction)
+    used[:, 0] = True
+    closest = points[:, 0].copy()
+    pending = everything
+
+    for _ in range(_GJK_STEPS):
+        length = np.einsum('ni,ni->n', closest[pending], closest[pending])
+        touching = length <= epsilon[pending]
+        overlap[pending[touching]] = True
+        pending = pending[~touching]
+        if not len(pending):
+            break
+
+        vertex = support(pending, -closest[pending])
+        # 差集全部位于 closest·x > 0 一侧：分离
+        separated = np.einsum('ni,ni->n', closest[pending], vertex) > 0.0
+        pending, vertex = pending[~separated], vertex[~separated]
+        if not len(pending):
+            break
+
+        # 新顶点放进空位（单纯形在上一轮化简后至多3个顶点）
+        slot = np.argmin(used[pending], axis=1)
+        points[pending, slot] = vertex
+        used[pending, slot] = True
+        closest[pending], used[pending] = _closest_on_simplex(points[pending], used[pending])
+        # 最近点在四面体内部：原点被包含
+        inside = used[pending].sum(axis=1) == 4
+        overlap[pending[inside]] = True
+        pending = pending[~inside]
+    else:
+        if len(pending):
+            length = np.einsum('ni,ni->n', closest[pending], closest[pending])
+            overlap[pending] = length <= epsilon[pending] * 1e6
+    return overlap
@@ -4,9 +4,13 @@
 用于在3D场景中进行物体选择的射线投射器实现。
 """
 
+import operator
 import numpy as np
 from typing import List, Optional, Tuple, Dict
 from .geometry import BaseGeometry, GeometryGroup
+from .bvh import GeometryBVH, local_half_extents
+from .camera import Camera
+from .scene_arrays import gather_array
 
 class RaycastResult:
     """
@@ -25,30 +29,100 @@ class RaycastResult:
         return self.geometry is not None and self.distance < float('inf')
 
 
+class RaycastImage:
+    """
+    射线投射图像
+
+    GeometryRaycaster.raycast_image 的结果，各缓冲区按行优先排列，第0行对应屏幕顶部
+    """
+    def __init__(self, ids, depth, normals, geometries):
+        self.ids = ids  # 形状为 (高, 宽) 的int32几何体ID，背景为-1
+        self.depth = depth  # 形状为 (高, 宽) 的float32命中距离（从近裁剪面起算），背景为inf
+        self.normals = normals  # 形状为 (高, 宽, 3) 的float32世界坐标系单位法线，背景为0
+        self.geometries = geometries  # ID -> 几何体，按场景深度优先遍历顺序排列
+
+    def geometry_at(self, x, y):
+        """获取指定像素处的几何体，背景返回None"""
+        geometry_id = self.ids[y, x]
+        return self.geometries[geometry_id] if geometry_id >= 0 else None
+
+
+class RaycastFilter:
+    """
+    射线查询的几何体过滤条件
+
+    场景中没有单独的图层概念，按组过滤（只检测指定组的后代）起到图层的作用。
+    """
+    def __init__(self, types=None, visible_only=True, skip_selected=False, groups=None, predicate=None):
+        """
+        参数:
+            types: 允许的几何体类型（GeometryType 或类型字符串），为None时不限制
+            visible_only: 是否跳过不可见的几何体
+            skip_selected: 是否跳过当前选中的几何体
+            groups: 只检测这些组（及其后代）中的几何体，为None时不限制
+            predicate: 额外的过滤函数 predicate(几何体) -> bool
+        """
+        self.types = None if types is None else frozenset(getattr(t, 'value', t) for t in types)
+        self.visible_only = visible_only
+        self.skip_selected = skip_selected
+        self.groups = None if groups is None else frozenset(id(group) for group in groups)
+        self.predicate = predicate
+
+    def accepts(self, geometry):
+        """几何体是否通过过滤"""
+        if self.types is not None and geometry.type not in self.types:
+            return False
+        if self.visible_only and not geometry.visible:
+            return False
+        if self.skip_selected and getattr(geometry, 'selected', False):
+            return False
+        if self.groups is not None:
+            node = geometry
+            while node is not None and id(node) not in self.groups:
+                node = node.parent
+            if node is None:
+                return False
+        return self.predicate is None or bool(self.predicate(geometry))
+
+
 class GeometryRaycaster:
     """
     几何体射线投射器
     
     用于从摄像机位置投射射线，检测与场景中几何体的相交
     """
+    # 同一类型的几何体达到该数量时才使用批量测试，数量很少时numpy的固定开销超过逐个测试
+    BATCH_MIN_SIZE = 4
+    # raycast_image 每批测试的（像素, 几何体）对数量上限，限制临时数组占用的内存
+    IMAGE_BATCH_PAIRS = 1 << 16
+    # raycast_all 不限制命中数量时每批精确测试的图元数量上限
+    ALL_HITS_BATCH_SIZE = 256
+    
     def __init__(self, camera_config, geometries):
         """
         初始化射线投射器
         
         参数:
-            camera_config: 摄像机配置，包含位置、方向等信息
+            camera_config: 摄像机（Camera），或包含位置、方向等信息的摄像机配置字典
             geometries: 场景中的几何体列表
         """
-        self.camera_config = camera_config
+        self.camera = _as_camera(camera_config)
         self.geometries = geometries
+        self._bvh = GeometryBVH()  # 首次投射时构建，之后随场景变化增量更新
+    
+    @property
+    def camera_config(self):
+        """摄像机（兼容旧的字典形式读取）"""
+        return self.camera
     
     def update_camera(self, camera_config):
         """更新摄像机配置"""
-        self.camera_config = camera_config
+        self.camera = _as_camera(camera_config)
     
     def update_geometries(self, geometries):
         """更新场景几何体"""
         self.geometries = geometries
+        self._bvh.invalidate()
     
     def raycast(self, screen_x, screen_y, viewport_width, viewport_height) -> RaycastResult:
         """
@@ -70,7 +144,415 @@ class GeometryRaycaster:
         result = self._intersect_geometries(ray_origin, ray_direction)
         
         return result
-    
+
+    def raycast_all(self, ray, max_distance=float('inf'), filter=None, max_hits=None) -> List[RaycastResult]:
+        """
+        返回射线命中的所有几何体，按距离由近到远排列
+
+        遍历层次包围盒时，超出 max_distance 的节点直接跳过；指定 max_hits 后，
+        一旦收集到足够的命中，遍历只继续访问比第 max_hits 个命中更近的节点。
+        返回的距离都是世界坐标系中的实际距离（椭球体也不例外）。
+
+        参数:
+            ray: (射线起点, 射线方向)，方向不必是单位向量
+            max_distance: 最大检测距离，更远的命中被忽略
+            filter: RaycastFilter，或过滤函数 filter(几何体) -> bool；为None时只检测可见几何体
+            max_hits: 最多返回的命中数量，为None时不限制
+
+        返回:
+            List[RaycastResult]: 命中结果列表
+        """
+        ray_origin = np.asarray(ray[0], dtype=np.float64)
+        ray_direction = np.asarray(ray[1], dtype=np.float64)
+        length = np.linalg.norm(ray_direction)
+        if length < 1e-12 or (max_hits is not None and max_hits <= 0):
+            return []
+        ray_direction = ray_direction / length
+        if filter is None:
+            filter = RaycastFilter()
+        elif not isinstance(filter, RaycastFilter):
+            filter = RaycastFilter(predicate=filter)
+
+        self._bvh.sync(self.geometries)
+        hits = []  # [(距离数组, 几何体列表)]，每批一项
+        hit_count = 0
+        cutoff = max_distance
+
+        def test_batch(geometries):
+            nonlocal hit_count, cutoff
+            geometries = [geo for geo in geometries if filter.accepts(geo)]
+            if not geometries:
+                return cutoff
+            distances = self._intersect_distances(geometries, ray_origin, ray_direction, metric=True)
+            rows = np.flatnonzero(np.isfinite(distances) & (distances <= cutoff))
+            if not len(rows):
+                return cutoff
+            hits.append((distances[rows], [geometries[row] for row in rows.tolist()]))
+            hit_count += len(rows)
+            if max_hits is not None and hit_count >= max_hits:
+                # 已有足够的命中，之后只需要比第 max_hits 个命中更近的结果
+                all_distances = np.concatenate([batch for batch, _ in hits])
+                cutoff = float(np.partition(all_distances, max_hits - 1)[max_hits - 1])
+            return cutoff
+
+        # 不限制数量时没有提前结束的机会，用较大的批次减少批量测试的调用次数
+        batch_size = self.ALL_HITS_BATCH_SIZE if max_hits is None else 32
+        self._bvh.traverse(ray_origin, ray_direction, test_batch, batch_size=batch_size, max_distance=max_distance)
+        if not hits:
+            return []
+
+        distances = np.concatenate([batch for batch, _ in hits])
+        geometries = [geo for _, batch in hits for geo in batch]
+        order = np.argsort(distances, kind='stable')[:max_hits]
+        return self._hit_results([geometries[i] for i in order.tolist()], distances[order], ray_origin, ray_direction)
+
+    def sweep_sphere(self, ray, radius, max_distance=float('inf'), filter=None) -> RaycastResult:
+        """
+        让球体沿射线移动，返回与场景的首次接触
+
+        参数:
+            ray: (球心起点, 移动方向)，方向不必是单位向量
+            radius: 球体半径
+            max_distance: 最大移动距离
+            filter: RaycastFilter 或过滤函数，为None时只检测可见几何体
+
+        返回:
+            RaycastResult: distance 为接触时球心移动的距离，hit_point 为此时的球心位置，
+                           normal 为接触处几何体表面的法线；起点处已经重叠的几何体被忽略
+        """
+        return self._sweep(ray, np.full(3, float(radius)), True, max_distance, filter)
+
+    def sweep_box(self, ray, half_extents, max_distance=float('inf'), filter=None) -> RaycastResult:
+        """
+        让世界坐标轴对齐的盒子沿射线移动，返回与场景的首次接触
+
+        盒子与有向包围盒之间用分离轴测试求精确的接触时间，
+        圆形图元按其局部包围盒计算，接触时间可能略早。
+
+        参数:
+            ray: (盒子中心起点, 移动方向)，方向不必是单位向量
+            half_extents: 盒子的 (x, y, z) 半尺寸
+            max_distance: 最大移动距离
+            filter: RaycastFilter 或过滤函数，为None时只检测可见几何体
+
+        返回:
+            RaycastResult: 含义同 sweep_sphere，hit_point 为接触时的盒子中心
+        """
+        return self._sweep(ray, np.asarray(half_extents, dtype=np.float64), False, max_distance, filter)
+
+    def _sweep(self, ray, extent, sphere, max_distance, filter) -> RaycastResult:
+        """
+        沿层次包围盒由近及远执行形状扫掠
+
+        参数:
+            ray: (起点, 移动方向)
+            extent: 移动形状的 (x, y, z) 半尺寸，球体时三个分量都是半径
+            sphere: 移动形状是否为球体
+            max_distance: 最大移动距离
+            filter: 过滤条件
+
+        返回:
+            RaycastResult: 首次接触结果
+        """
+        ray_origin = np.asarray(ray[0], dtype=np.float64)
+        ray_direction = np.asarray(ray[1], dtype=np.float64)
+        length = np.linalg.norm(ray_direction)
+        if length < 1e-12:
+            return RaycastResult()
+        ray_direction = ray_direction / length
+        if filter is None:
+            filter = RaycastFilter()
+        elif not isinstance(filter, RaycastFilter):
+            filter = RaycastFilter(predicate=filter)
+
+        self._bvh.sync(self.geometries)
+        closest = [None, max_distance, None]
+
+        def test_batch(geometries):
+            geometries = [geo for geo in geometries if filter.accepts(geo)]
+            if not geometries:
+                return np.inf
+            distances, normals = self._sweep_distances(geometries, ray_origin, ray_direction, extent, sphere)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] < closest[1]:
+                closest[:] = [geometries[nearest], distances[nearest], normals[nearest]]
+            return distances[nearest]
+
+        self._bvh.traverse(ray_origin, ray_direction, test_batch, max_distance=max_distance, extent=extent)
+        if closest[0] is None:
+            return RaycastResult()
+        distance = float(closest[1])
+        return RaycastResult(closest[0], distance, ray_origin + distance * ray_direction, closest[2])
+
+    def _sweep_distances(self, geometries, ray_origin, ray_direction, extent, sphere):
+        """
+        批量计算移动形状与一组几何体的首次接触
+
+        球体把图元按半径向外扩展后做射线测试：球体、胶囊体是精确的，盒子、圆柱体的棱角处略早接触，
+        椭球体按各半轴加上半径近似。盒子使用分离轴测试。
+
+        参数:
+            geometries: 几何体列表
+            ray_origin: 起点
+            ray_direction: 移动方向（单位向量）
+            extent: 移动形状的半尺寸
+            sphere: 移动形状是否为球体
+
+        返回:
+            tuple: (形状为 (N,) 的接触距离，未接触为inf, 形状为 (N, 3) 的世界坐标系接触法线)
+        """
+        kind_codes, centers, rotations, sizes, half_extents = self._image_frames(geometries)
+        if not sphere:
+            return sweep_box_batch(ray_origin, ray_direction, extent, centers, rotations, half_extents)
+
+        radius = extent[0]
+        starts, directions = rays_to_local(ray_origin, ray_direction, centers, rotations)
+        distances = np.full(len(geometries), np.inf)
+        normals = np.zeros((len(geometries), 3))
+        for code in np.unique(kind_codes).tolist():
+            rows = np.flatnonzero(kind_codes == code)
+            kind = _IMAGE_KINDS[code] if code >= 0 else 'box'
+            inflated = sizes[rows] + radius
+            if kind in ('sphere', 'capsule'):
+                inflated[:, 1:] = sizes[rows, 1:]
+                inflated[:, 0] = sizes[rows, 0] + radius
+            elif kind == 'cylinder':
+                inflated[:, 2] = sizes[rows, 2]
+            elif kind != 'ellipsoid':
+                # 盒子、平面以及没有批量实现的类型按局部包围盒扩展
+                kind = 'box'
+                inflated = half_extents[rows] + radius
+            kernel = _BATCH_KERNELS[kind]
+            t = kernel(starts[rows], directions[rows], inflated)
+            # 反方向也命中说明起点已经在扩展后的形状内部，忽略这些几何体
+            t = np.where(np.isfinite(kernel(starts[rows], -directions[rows], inflated)), np.inf, t)
+            if kind == 'ellipsoid':
+                t = t / np.linalg.norm(directions[rows] / inflated, axis=1)
+            hit = np.isfinite(t)
+            local = local_normals_batch(kind, starts[rows] + np.where(hit, t, 0.0)[:, None] * directions[rows], inflated)
+            distances[rows] = t
+            normals[rows] = np.einsum('nij,nj->ni', rotations[rows], local)
+        return distances, normals
+
+    def select_in_rect(self, x0, y0, x1, y1, viewport_width, viewport_height, contain=False) -> List[BaseGeometry]:
+        """
+        框选：返回屏幕矩形内的所有可见几何体
+
+        所有图元的世界包围盒一次批量投影到屏幕，取投影后的二维包围矩形与选框比较。
+        有角点位于摄像机后方的几何体（跨越摄像机平面）不参与框选。
+
+        参数:
+            x0, y0, x1, y1: 选框两个对角的屏幕坐标，顺序任意
+            viewport_width: 视口宽度
+            viewport_height: 视口高度
+            contain: 为True时只选择投影完全落在选框内的几何体，否则选择与选框相交的几何体
+
+        返回:
+            List[BaseGeometry]: 被选中的几何体，按场景遍历顺序排列
+        """
+        self._bvh.sync(self.geometries)
+        bounds_min, bounds_max = self._bvh.primitive_bounds()
+        if not len(bounds_min):
+            return []
+
+        screen_min, screen_max, w_min = self.camera.project_bounds(bounds_min, bounds_max, viewport_width, viewport_height)
+
+        left, right = min(x0, x1), max(x0, x1)
+        top, bottom = min(y0, y1), max(y0, y1)
+        mask = w_min > 0
+        if contain:
+            mask &= ((screen_min[:, 0] >= left) & (screen_max[:, 0] <= right)
+                     & (screen_min[:, 1] >= top) & (screen_max[:, 1] <= bottom))
+        else:
+            mask &= ((screen_max[:, 0] >= left) & (screen_min[:, 0] <= right)
+                     & (screen_max[:, 1] >= top) & (screen_min[:, 1] <= bottom))
+
+        scene_order = self._bvh.scene_order
+        indices = scene_order[mask[scene_order]]
+        selected = map(self._bvh.primitives.__getitem__, indices.tolist())
+        return list(filter(operator.attrgetter('visible'), selected))
+
+    def raycast_image(self, width, height) -> RaycastImage:
+        """
+        为每个像素中心投射一条射线，生成几何体ID、深度和法线图像
+
+        不依赖OpenGL，可在无图形环境下生成缩略图、做图像回归测试或遮挡检查。
+        每个几何体只与其局部包围盒（有向包围盒）投影到屏幕的矩形内的像素配对。几何体按视图深度由近及远分批测试，
+        每批开始前用深度缓冲的最大值金字塔剔除整个被遮挡的几何体，配对后再逐像素比较深度，
+        只有可能更近的配对才进入精确测试。
+        隐藏的几何体不参与；与 raycast 不同，被选中的几何体不会被跳过。
+
+        参数:
+            width: 图像宽度（像素）
+            height: 图像高度（像素）
+
+        返回:
+            RaycastImage: ID、深度和法线缓冲区
+        """
+        self._bvh.sync(self.geometries)
+        primitives = self._bvh.primitives
+        scene_order = self._bvh.scene_order
+        pixel_count = width * height
+        depth = np.full(pixel_count, np.inf)
+        winner = np.full(pixel_count, -1, dtype=np.int64)  # 命中的候选几何体序号
+        normals = np.zeros((pixel_count, 3))
+        origins, directions = self.camera.pixel_rays(width, height)
+
+        # 1. 剔除隐藏的和完全位于近平面之后的几何体
+        view_row = self.camera.view_matrix[2]
+        # 视图深度为 -z；射线起点都在近平面上且方向为单位向量，到达深度d至少要走 d - 近平面深度
+        origin_depth = -(origins[0] @ view_row[:3] + view_row[3])
+        candidates = np.zeros(0, dtype=np.int64)
+        if primitives:
+            bounds_min, bounds_max = self._bvh.primitive_bounds()
+            far_depth = (-((bounds_min + bounds_max) * 0.5 @ view_row[:3] + view_row[3])
+                         + (bounds_max - bounds_min) * 0.5 @ np.abs(view_row[:3]))
+            visible = np.fromiter((geo.visible for geo in primitives), dtype=bool, count=len(primitives))
+            candidates = np.flatnonzero(visible & (far_depth >= origin_depth))
+        members = [primitives[i] for i in candidates.tolist()]
+
+        # 2. 用有向包围盒投影得到每个几何体需要测试的像素矩形和距离下界
+        if members:
+            kind_codes, centers, rotations, sizes, half_extents = self._image_frames(members)
+            half_axes = rotations * half_extents[:, None, :]
+            screen_min, screen_max, w_min = self.camera.project_boxes(centers, half_axes, width, height)
+            # 跨越摄像机平面的几何体投影矩形无意义，按覆盖整个图像处理
+            straddle = (w_min <= 0)[:, None]
+            screen_min = np.where(straddle, 0.0, screen_min)
+            screen_max = np.where(straddle, [width, height], screen_max)
+            # 像素 (x, y) 的中心为 (x + 0.5, y + 0.5)
+            first = np.clip(np.ceil(screen_min - 0.5), 0, [width, height]).astype(np.int64)
+            last = np.clip(np.floor(screen_max - 0.5), -1, [width - 1, height - 1]).astype(np.int64)
+            spans = last - first + 1
+            areas = spans[:, 0] * spans[:, 1]
+            depth_extent = np.abs(half_axes.transpose(0, 2, 1) @ view_row[:3]).sum(axis=1)
+            lower_bound = np.maximum(-(centers @ view_row[:3] + view_row[3]) - depth_extent - origin_depth, 0.0)
+
+            order = np.flatnonzero((spans > 0).all(axis=1))
+            order = order[np.argsort(lower_bound[order], kind='stable')]
+            ends = np.cumsum(areas[order])
+        else:
+            order = np.zeros(0, dtype=np.int64)
+
+        # 3. 由近及远分批，每批内按类型生成（像素, 几何体）对并批量测试
+        start = 0
+        while start < len(order):
+            done = ends[start - 1] if start else 0
+            stop = max(int(np.searchsorted(ends, done + self.IMAGE_BATCH_PAIRS, side='right')), start + 1)
+            batch = order[start:stop]
+            if start:
+                # 整个投影矩形都已被更近的命中覆盖的几何体直接跳过
+                batch = batch[_occlusion_max_depth(depth.reshape(height, width), first[batch], last[batch]) > lower_bound[batch]]
+            start = stop
+
+            batch_codes = kind_codes[batch]
+            for code in np.unique(batch_codes).tolist():
+                rows = batch[batch_codes == code]
+                counts = areas[rows]
+                pair_rows = np.repeat(rows, counts)
+                offsets = np.arange(len(pair_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+                row_widths = spans[pair_rows, 0]
+                pair_first = first[pair_rows]
+                pixels = (pair_first[:, 1] + offsets // row_widths) * width + pair_first[:, 0] + offsets % row_widths
+
+                # 已有更近命中的像素不需要测试
+                unoccluded = depth[pixels] > lower_bound[pair_rows]
+                pixels = pixels[unoccluded]
+                pair_rows = pair_rows[unoccluded]
+                if not len(pixels):
+                    continue
+
+                if code < 0:
+                    # 没有批量实现的类型逐个测试
+                    distances = np.array([
+                        self._intersect_geometry(members[row], origins[pixel], directions[pixel]).distance
+                        for row, pixel in zip(pair_rows.tolist(), pixels.tolist())])
+                else:
+                    kind = _IMAGE_KINDS[code]
+                    starts, local_dirs = rays_to_local(origins[pixels], directions[pixels], centers[pair_rows], rotations[pair_rows])
+                    distances = _BATCH_KERNELS[kind](starts, local_dirs, sizes[pair_rows])
+                    if kind == 'ellipsoid':
+                        # 椭球体测试返回单位球空间中的距离，换算回实际距离
+                        distances = distances / np.linalg.norm(local_dirs / sizes[pair_rows], axis=1)
+
+                closer = distances < depth[pixels]
+                pixels = pixels[closer]
+                pair_rows = pair_rows[closer]
+                distances = distances[closer]
+                np.minimum.at(depth, pixels, distances)
+                nearest = distances <= depth[pixels]
+                winner[pixels[nearest]] = pair_rows[nearest]
+
+        # 4. 只为最终命中的像素计算法线
+        hit_pixels = np.flatnonzero(winner >= 0)
+        hit_rows = winner[hit_pixels]
+        hit_codes = kind_codes[hit_rows] if members else hit_rows
+        for code in np.unique(hit_codes).tolist():
+            mask = hit_codes == code
+            pixels = hit_pixels[mask]
+            rows = hit_rows[mask]
+            if code < 0:
+                for row, pixel in zip(rows.tolist(), pixels.tolist()):
+                    normals[pixel] = self._intersect_geometry(members[row], origins[pixel], directions[pixel]).normal
+                continue
+            starts, local_dirs = rays_to_local(origins[pixels], directions[pixels], centers[rows], rotations[rows])
+            points = starts + depth[pixels][:, None] * local_dirs
+            local = local_normals_batch(_IMAGE_KINDS[code], points, sizes[rows])
+            normals[pixels] = np.einsum('nij,nj->ni', rotations[rows], local)
+
+        # 图元索引 -> 场景遍历顺序中的ID
+        scene_ids = np.empty(len(primitives), dtype=np.int32)
+        scene_ids[scene_order] = np.arange(len(primitives))
+        ids = np.full(pixel_count, -1, dtype=np.int32)
+        ids[hit_pixels] = scene_ids[candidates[hit_rows]]
+        return RaycastImage(
+            ids.reshape(height, width),
+            depth.astype(np.float32).reshape(height, width),
+            normals.astype(np.float32).reshape(height, width, 3),
+            [primitives[i] for i in scene_order.tolist()],
+        )
+
+    def _image_frames(self, geometries):
+        """
+        读取 raycast_image 批量测试所需的几何体数据
+
+        通用AABB类型直接在世界坐标系中按盒子测试。
+
+        参数:
+            geometries: 几何体列表
+
+        返回:
+            tuple: (类型编号数组，无批量实现的类型为-1, 中心 (N, 3), 旋转矩阵 (N, 3, 3), 尺寸 (N, 3),
+                    局部坐标系中包围几何体的半尺寸 (N, 3))
+        """
+        kinds = [intersect_kind(geo) for geo in geometries]
+        matrices = gather_array(geometries, 'world_matrix', lambda geo: geo.get_world_transform()).astype(np.float64)
+        centers = matrices[:, :3, 3].copy()
+        rotations = matrices[:, :3, :3].copy()
+        sizes = _kernel_sizes(geometries)
+        for row, kind in enumerate(kinds):
+            if kind == 'aabb':
+                geo = geometries[row]
+                centers[row] = (geo.aabb_min + geo.aabb_max) * 0.5
+                rotations[row] = np.eye(3)
+                sizes[row] = (geo.aabb_max - geo.aabb_min) * 0.5
+                kinds[row] = 'box'
+        kind_codes = np.array([_IMAGE_KINDS.index(kind) if kind in _IMAGE_KINDS else -1 for kind in kinds], dtype=np.int64)
+
+        # 由实际参与测试的尺寸得到局部包围盒，比层次包围盒使用的保守尺寸更紧
+        sphere, cylinder, capsule, plane = (kind_codes == _IMAGE_KINDS.index(kind)
+                                            for kind in ('sphere', 'cylinder', 'capsule', 'plane'))
+        radius = sizes[:, 0]
+        half_extents = sizes.copy()
+        half_extents[sphere, 1] = radius[sphere]
+        half_extents[capsule, 1] += radius[capsule]
+        round_kinds = sphere | cylinder | capsule
+        half_extents[round_kinds, 2] = radius[round_kinds]
+        half_extents[plane, 2] = 0.0
+        for row in np.flatnonzero(kind_codes < 0).tolist():
+            half_extents[row] = local_half_extents(geometries[row])
+        return kind_codes, centers, rotations, sizes, half_extents
+
     def _screen_to_ray(self, screen_x, screen_y, viewport_width, viewport_height) -> Tuple[np.ndarray, np.ndarray]:
         """
         将屏幕坐标转换为射线
@@ -84,34 +566,8 @@ class GeometryRaycaster:
         返回:
             tuple: (射线起点, 射线方向)
         """
-        # 1. 将屏幕坐标归一化到[-1, 1]范围
-        x = 2.0 * screen_x / viewport_width - 1.0
-        y = 1.0 - 2.0 * screen_y / viewport_height  # OpenGL坐标系Y轴向上
-        
-        # 2. 创建NDC（归一化设备坐标）空间中的点
-        ndc_near = np.array([x, y, -1.0, 1.0])  # 近平面点
-        ndc_far = np.array([x, y, 1.0, 1.0])    # 远平面点
-        
-        # 3. 使用逆投影矩阵将点变换到视图空间
-        inv_projection = np.linalg.inv(self.camera_config['projection_matrix'])
-        view_near = inv_projection @ ndc_near
-        view_far = inv_projection @ ndc_far
-        
-        # 归一化w分量
-        view_near /= view_near[3]
-        view_far /= view_far[3]
-        
-        # 4. 使用逆视图矩阵将点变换到世界空间
-        inv_view = np.linalg.inv(self.camera_config['view_matrix'])
-        world_near = inv_view @ view_near
-        world_far = inv_view @ view_far
-        
-        # 5. 计算射线方向和原点
-        ray_origin = world_near[:3]
-        ray_direction = world_far[:3] - ray_origin
-        ray_direction = ray_direction / np.linalg.norm(ray_direction)  # 归一化方向向量
-        
-        return ray_origin, ray_direction
+        # 逆视图投影矩阵由摄像机按修订号缓存，这里只做一次矩阵乘法
+        return self.camera.screen_to_ray(screen_x, screen_y, viewport_width, viewport_height)
     
     def _intersect_geometries(self, ray_origin, ray_direction) -> RaycastResult:
         """
@@ -124,45 +580,112 @@ class GeometryRaycaster:
         返回:
             RaycastResult: 最近的命中结果
         """
-        closest_result = RaycastResult()  # 默认未命中
-        
-        # 递归处理所有几何体（包括组中的子对象）
-        all_geometries = self._collect_all_geometries(self.geometries)
-        
-        for geo in all_geometries:
-            # 只测试实际几何体，不测试组，并且跳过被选中的对象（如果在操作模式下）
-            if (hasattr(geo, 'type') and geo.type != 'group' and not (hasattr(geo, 'selected') and geo.selected)):
-                result = self._intersect_geometry(geo, ray_origin, ray_direction)
-                if result.is_hit() and result.distance < closest_result.distance:
-                    closest_result = result
-        
-        return closest_result
+        # 使层次包围盒与场景同步（拓扑变化时重建，仅移动时局部调整）
+        self._bvh.sync(self.geometries)
+        closest = [None, np.inf]
+        
+        def test_batch(geometries):
+            # 跳过被选中的对象（如果在操作模式下）
+            geometries = [geo for geo in geometries if not getattr(geo, 'selected', False)]
+            if not geometries:
+                return np.inf
+            # 每批按测试类型分组批量计算距离，此时只记录最近的几何体
+            distances = self._intersect_distances(geometries, ray_origin, ray_direction)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] < closest[1]:
+                closest[:] = [geometries[nearest], distances[nearest]]
+            return distances[nearest]
+        
+        # 由近及远分批遍历，最后只为最近的几何体生成完整的命中结果
+        self._bvh.traverse(ray_origin, ray_direction, test_batch)
+        if closest[0] is None:
+            return RaycastResult()
+        return self._intersect_geometry(closest[0], ray_origin, ray_direction)
     
-    def _collect_all_geometries(self, geometries) -> List[BaseGeometry]:
+    def _intersect_distances(self, geometries, ray_origin, ray_direction, metric=False) -> np.ndarray:
         """
-        收集场景中的所有几何体（包括层级结构中的子对象）
+        批量计算射线到一组几何体的命中距离
         
         参数:
-            geometries: 几何体列表或单个几何体
+            geometries: 几何体列表
+            ray_origin: 射线起点
+            ray_direction: 射线方向（单位向量）
+            metric: 为True时椭球体也返回实际距离，否则与单个测试一致返回单位球空间中的距离
             
         返回:
-            List[BaseGeometry]: 场景中的所有几何体
+            np.ndarray: 形状为 (N,) 的距离数组，未命中为inf
         """
-        result = []
-        
-        if isinstance(geometries, list):
-            for geo in geometries:
-                result.extend(self._collect_all_geometries(geo))
-        else:
-            # 单个几何体
-            result.append(geometries)
-            
-            # 如果是组，添加其所有子对象
-            if hasattr(geometries, 'children'):
-                for child in geometries.children:
-                    result.extend(self._collect_all_geometries(child))
-        
-        return result
+        kinds = [intersect_kind(geo) for geo in geometries]
+        distances = np.full(len(geometries), np.inf)
+        counts = {}
+        for kind in kinds:
+            counts[kind] = counts.get(kind, 0) + 1
+        
+        # 没有批量实现的类型、以及数量太少不值得批量计算的类型逐个测试
+        batched = []
+        for i, (geo, kind) in enumerate(zip(geometries, kinds)):
+            if kind in _BATCH_KERNELS and counts[kind] >= self.BATCH_MIN_SIZE:
+                batched.append(i)
+                continue
+            result = self._intersect_geometry(geo, ray_origin, ray_direction)
+            if result.is_hit():
+                distances[i] = result.distance
+                if metric and kind == 'ellipsoid':
+                    distances[i] = np.linalg.norm(result.hit_point - ray_origin)
+        if not batched:
+            return distances
+        
+        # 所有几何体一次变换到各自的局部坐标系，再按类型分组调用批量测试
+        members = [geometries[i] for i in batched]
+        matrices = gather_array(members, 'world_matrix', lambda geo: geo.get_world_transform()).astype(np.float64)
+        sizes = _kernel_sizes(members)
+        starts, directions = rays_to_local(ray_origin, ray_direction, matrices[:, :3, 3], matrices[:, :3, :3])
+        
+        groups = {}
+        for row, i in enumerate(batched):
+            groups.setdefault(kinds[i], []).append(row)
+        for kind, rows in groups.items():
+            kind_distances = _BATCH_KERNELS[kind](starts[rows], directions[rows], sizes[rows])
+            if metric and kind == 'ellipsoid':
+                # 单位球空间中的距离换算回实际距离
+                kind_distances = kind_distances / np.linalg.norm(directions[rows] / sizes[rows], axis=1)
+            distances[[batched[row] for row in rows]] = kind_distances
+        return distances
+
+    def _hit_results(self, geometries, distances, ray_origin, ray_direction) -> List[RaycastResult]:
+        """
+        为已知命中距离的几何体批量生成完整的命中结果
+
+        参数:
+            geometries: 命中的几何体列表
+            distances: 对应的实际命中距离
+            ray_origin: 射线起点
+            ray_direction: 射线方向（单位向量）
+
+        返回:
+            List[RaycastResult]: 与 geometries 一一对应的命中结果
+        """
+        points = ray_origin + distances[:, None] * ray_direction
+        normals = np.zeros((len(geometries), 3))
+        kinds = [intersect_kind(geo) for geo in geometries]
+        rows = [row for row, kind in enumerate(kinds) if kind in _BATCH_KERNELS]
+        for row, kind in enumerate(kinds):
+            if kind not in _BATCH_KERNELS:
+                normals[row] = self._intersect_geometry(geometries[row], ray_origin, ray_direction).normal
+        if rows:
+            members = [geometries[row] for row in rows]
+            matrices = gather_array(members, 'world_matrix', lambda geo: geo.get_world_transform()).astype(np.float64)
+            centers, rotations = matrices[:, :3, 3], matrices[:, :3, :3]
+            sizes = _kernel_sizes(members)
+            # 世界命中点变换到局部坐标系：R^T · (p - c)
+            local_points = np.einsum('nj,nji->ni', points[rows] - centers, rotations)
+            member_kinds = np.array([kinds[row] for row in rows])
+            for kind in np.unique(member_kinds).tolist():
+                group = np.flatnonzero(member_kinds == kind)
+                local = local_normals_batch(kind, local_points[group], sizes[group])
+                normals[np.asarray(rows)[group]] = np.einsum('nij,nj->ni', rotations[group], local)
+        return [RaycastResult(geo, float(distance), point, normal)
+                for geo, distance, point, normal in zip(geometries, distances.tolist(), points, normals)]
     
     def _intersect_geometry(self, geometry, ray_origin, ray_direction) -> RaycastResult:
         """
@@ -176,49 +699,14 @@ class GeometryRaycaster:
         返回:
             RaycastResult: 命中结果
         """
-        # 检查是否是控制器几何体（可以通过tag识别）
-        is_controller = hasattr(geometry, 'tag') and geometry.tag in ['x_axis', 'y_axis', 'z_axis']
-        
-        # 检查是否是旋转控制器
-        is_rotation_controller = hasattr(geometry, 'tag') and 'rotation' in getattr(geometry, 'tag', '')
-        
-        # 基于几何体类型进行不同的相交测试
-        if geometry.type == 'box' or (is_controller and hasattr(geometry, 'type') and geometry.type == 'box'):
-            return self._intersect_box(geometry, ray_origin, ray_direction)
-        elif (is_rotation_controller and geometry.type == 'cylinder') or geometry.type == 'cylinder':
-            return self._intersect_cylinder(geometry, ray_origin, ray_direction)
-        elif (is_rotation_controller and geometry.type == 'torus'):
-            # 对于环形旋转控制器，可以使用特殊的相交检测方法
-            return self._intersect_rotation_ring(geometry, ray_origin, ray_direction)
-        elif geometry.type == 'sphere':
-            return self._intersect_sphere(geometry, ray_origin, ray_direction)
-        elif geometry.type == 'capsule':
-            return self._intersect_capsule(geometry, ray_origin, ray_direction)
-        elif geometry.type == 'ellipsoid':
-            return self._intersect_ellipsoid(geometry, ray_origin, ray_direction)
-        elif geometry.type == 'plane':
-            return self._intersect_plane(geometry, ray_origin, ray_direction)
-        else:
-            # 默认使用AABB（轴对齐包围盒）检测
-            return self._intersect_aabb(geometry, ray_origin, ray_direction)
+        return getattr(self, _SCALAR_METHODS[intersect_kind(geometry)])(geometry, ray_origin, ray_direction)
     
     def _intersect_box(self, geometry, ray_origin, ray_direction) -> RaycastResult:
         """盒子碰撞检测"""
         # 从世界坐标系获取几何体数据
-        center = geometry.get_world_position()
+        center, rotation_matrix = self._get_world_frame(geometry)
         size = geometry.size
         
-        # 获取旋转矩阵
-        rotation_matrix = geometry.transform_matrix[:3, :3]
-        if geometry.parent:
-            parent_transform = geometry.parent.transform_matrix
-            # 提取父变换中的旋转部分
-            parent_rotation = parent_transform[:3, :3]
-            # 组合旋转
-            rotation_matrix = parent_rotation @ rotation_matrix                    # 更新中心位置
-            center = parent_transform @ np.append(geometry.position, 1)
-            center = center[:3]
-        
         # 转换射线到盒子的局部坐标系
         local_start, local_direction = self.transform_ray_to_local(ray_origin, ray_direction, center, rotation_matrix)
         
@@ -270,19 +758,8 @@ class GeometryRaycaster:
     def _intersect_sphere(self, geometry, ray_origin, ray_direction) -> RaycastResult:
         """球体碰撞检测"""
         # 从世界坐标系获取几何体数据
-        center = geometry.get_world_position()
+        center, rotation_matrix = self._get_world_frame(geometry)
         size = geometry.size
-        
-        # 获取旋转矩阵
-        rotation_matrix = geometry.transform_matrix[:3, :3]
-        if geometry.parent:
-            parent_transform = geometry.parent.transform_matrix
-            # 提取父变换中的旋转部分
-            parent_rotation = parent_transform[:3, :3]
-            # 组合旋转
-            rotation_matrix = parent_rotation @ rotation_matrix                    # 更新中心位置
-            center = parent_transform @ np.append(geometry.position, 1)
-            center = center[:3]
         # 球心在世界坐标系中的位置
 
         radius = size[0]
@@ -324,32 +801,10 @@ class GeometryRaycaster:
         """圆柱体碰撞检测"""
         # 从世界坐标系获取几何体数据
 
-        center = geometry.get_world_position()
+        center, rotation_matrix = self._get_world_frame(geometry)
         size = geometry.size
-        
-        # 获取旋转矩阵
-        rotation_matrix = geometry.transform_matrix[:3, :3]
-        if geometry.parent:
-            parent_transform = geometry.parent.transform_matrix
-            # 提取父变换中的旋转部分
-            parent_rotation = parent_transform[:3, :3]
-            # 组合旋转
-            rotation_matrix = parent_rotation @ rotation_matrix                    # 更新中心位置
-            center = parent_transform @ np.append(geometry.position, 1)
-            center = center[:3]
-        
-        # 检查是否是旋转控制器
-        is_rotation_controller = hasattr(geometry, 'tag') and 'rotation' in getattr(geometry, 'tag', '')
-        
-        # 如果是旋转控制器，可以调整碰撞检测的精度或行为
-        if is_rotation_controller:
-            # 可以调整大小以增加选择区域，或者修改其他参数
-            # 例如，扩大半径使控制器更容易被选中
-            radius = size[0] * 1.2  # 增加20%的选择区域
-            half_height = size[1]
-        else:
-            radius = size[0]
-            half_height = size[1]
+        radius = size[0]
+        half_height = size[1]
         
         # 转换射线到圆柱体的局部坐标系
         local_start, local_direction = self.transform_ray_to_local(ray_origin, ray_direction, center, rotation_matrix)
@@ -441,19 +896,8 @@ class GeometryRaycaster:
         """平面碰撞检测"""
         # 从世界坐标系获取几何体数据
         # 从世界坐标系获取几何体数据
-        center = geometry.get_world_position()
+        center, rotation_matrix = self._get_world_frame(geometry)
         size = geometry.size
-        
-        # 获取旋转矩阵
-        rotation_matrix = geometry.transform_matrix[:3, :3]
-        if geometry.parent:
-            parent_transform = geometry.parent.transform_matrix
-            # 提取父变换中的旋转部分
-            parent_rotation = parent_transform[:3, :3]
-            # 组合旋转
-            rotation_matrix = parent_rotation @ rotation_matrix                    # 更新中心位置
-            center = parent_transform @ np.append(geometry.position, 1)
-            center = center[:3]
         # 转换射线到平面的局部坐标系
         local_start, local_direction = self.transform_ray_to_local(ray_origin, ray_direction, center, rotation_matrix)
         
@@ -492,20 +936,9 @@ class GeometryRaycaster:
         """椭球体碰撞检测"""
         # 从世界坐标系获取几何体数据
         # 从世界坐标系获取几何体数据
-        center = geometry.get_world_position()
+        center, rotation_matrix = self._get_world_frame(geometry)
         size = geometry.size
         
-        # 获取旋转矩阵
-        rotation_matrix = geometry.transform_matrix[:3, :3]
-        if geometry.parent:
-            parent_transform = geometry.parent.transform_matrix
-            # 提取父变换中的旋转部分
-            parent_rotation = parent_transform[:3, :3]
-            # 组合旋转
-            rotation_matrix = parent_rotation @ rotation_matrix                    # 更新中心位置
-            center = parent_transform @ np.append(geometry.position, 1)
-            center = center[:3]
-        
         # 转换射线到椭球体的局部坐标系
         local_start, local_direction = self.transform_ray_to_local(ray_origin, ray_direction, center, rotation_matrix)
         
@@ -609,20 +1042,9 @@ class GeometryRaycaster:
         """胶囊体碰撞检测"""
         # 从世界坐标系获取几何体数据
         # 从世界坐标系获取几何体数据
-        center = geometry.get_world_position()
+        center, rotation_matrix = self._get_world_frame(geometry)
         size = geometry.size
         
-        # 获取旋转矩阵
-        rotation_matrix = geometry.transform_matrix[:3, :3]
-        if geometry.parent:
-            parent_transform = geometry.parent.transform_matrix
-            # 提取父变换中的旋转部分
-            parent_rotation = parent_transform[:3, :3]
-            # 组合旋转
-            rotation_matrix = parent_rotation @ rotation_matrix                    # 更新中心位置
-            center = parent_transform @ np.append(geometry.position, 1)
-            center = center[:3]
-        
         # 转换射线到胶囊体的局部坐标系
         local_start, local_direction = self.transform_ray_to_local(ray_origin, ray_direction, center, rotation_matrix)
         
@@ -721,6 +1143,15 @@ class GeometryRaycaster:
         
         return RaycastResult()  # 未命中
     
+    def _get_world_frame(self, geometry):
+        """
+        获取几何体在世界坐标系中的中心和旋转矩阵
+        
+        直接读取几何体缓存的世界变换矩阵（已包含所有父节点的变换）
+        """
+        world_matrix = geometry.get_world_transform()
+        return world_matrix[:3, 3], world_matrix[:3, :3]
+    
     def transform_ray_to_local(self, ray_start, ray_direction, center, rotation):
         """将射线从世界坐标系转换到物体的局部坐标系"""
         # 先平移射线起点
@@ -751,108 +1182,361 @@ class GeometryRaycaster:
         world_point = world_point + center
         
         return world_point
-    
-    def _intersect_rotation_ring(self, geometry, ray_origin, ray_direction) -> RaycastResult:
-        """环形旋转控制器碰撞检测"""
-        # 从世界坐标系获取几何体数据
-        # 从世界坐标系获取几何体数据
-        center = geometry.get_world_position()
-        size = geometry.size
-        
-        # 获取旋转矩阵
-        rotation_matrix = geometry.transform_matrix[:3, :3]
-        if geometry.parent:
-            parent_transform = geometry.parent.transform_matrix
-            # 提取父变换中的旋转部分
-            parent_rotation = parent_transform[:3, :3]
-            # 组合旋转
-            rotation_matrix = parent_rotation @ rotation_matrix                    # 更新中心位置
-            center = parent_transform @ np.append(geometry.position, 1)
-            center = center[:3]
-        
-        # 转换射线到环的局部坐标系
-        local_start, local_direction = self.transform_ray_to_local(ray_origin, ray_direction, center, rotation_matrix)
-        
-        # 获取环的几何参数
-        major_radius = size[0]  # 环的主半径
-        minor_radius = size[1]  # 环的次半径（管道粗细）
-        # 可以忽略 size[2]，或者将其用作其他目的
-        
-        # 根据控制器标签确定环所在的平面
-        tag = getattr(geometry, 'tag', '')
-        
-        # 确定环的法线方向
-        normal = np.array([0.0, 0.0, 0.0])
-        if 'x_rotation' in tag:
-            normal = np.array([1.0, 0.0, 0.0])  # X轴旋转环在YZ平面
-        elif 'y_rotation' in tag:
-            normal = np.array([0.0, 1.0, 0.0])  # Y轴旋转环在XZ平面
-        elif 'z_rotation' in tag:
-            normal = np.array([0.0, 0.0, 1.0])  # Z轴旋转环在XY平面
-        
-        # 计算射线与平面的交点
-        denom = np.dot(normal, local_direction)
-        
-        # 如果射线几乎平行于平面，则没有交点
-        if abs(denom) < 1e-6:
-            return RaycastResult()
-        
-        # 计算射线到平面的参数t
-        t = -np.dot(local_start, normal) / denom
-        
-        # 如果t为负值，则交点在射线的反方向
-        if t < 0:
-            return RaycastResult()
-        
-        # 计算交点
-        intersection = local_start + t * local_direction
-        
-        # 计算交点到环中心的距离
-        if 'x_rotation' in tag:
-            # 在YZ平面上计算
-            distance_to_center = np.sqrt(intersection[1]**2 + intersection[2]**2)
-        elif 'y_rotation' in tag:
-            # 在XZ平面上计算
-            distance_to_center = np.sqrt(intersection[0]**2 + intersection[2]**2)
-        elif 'z_rotation' in tag:
-            # 在XY平面上计算
-            distance_to_center = np.sqrt(intersection[0]**2 + intersection[1]**2)
-        else:
-            return RaycastResult()  # 无法确定平面
-        
-        # 检查距离是否在环的有效范围内（主半径 +/- 次半径）
-        if abs(distance_to_center - major_radius) <= minor_radius:
-            # 命中了环
-            # 计算世界坐标系中的交点
-            world_hit = self.transform_point_to_world(intersection, center, rotation_matrix)
-            
-            # 计算法线
-            # 对于环形，法线方向是从环的中心轴到交点的方向
-            local_normal = np.array([0.0, 0.0, 0.0])
-            
-            if 'x_rotation' in tag:
-                # 计算YZ平面上的单位向量
-                if distance_to_center > 0:
-                    local_normal = np.array([0.0, intersection[1], intersection[2]]) / distance_to_center
-                else:
-                    local_normal = np.array([0.0, 1.0, 0.0])  # 默认值
-            elif 'y_rotation' in tag:
-                # 计算XZ平面上的单位向量
-                if distance_to_center > 0:
-                    local_normal = np.array([intersection[0], 0.0, intersection[2]]) / distance_to_center
-                else:
-                    local_normal = np.array([1.0, 0.0, 0.0])  # 默认值
-            elif 'z_rotation' in tag:
-                # 计算XY平面上的单位向量
-                if distance_to_center > 0:
-                    local_normal = np.array([intersection[0], intersection[1], 0.0]) / distance_to_center
-                else:
-                    local_normal = np.array([1.0, 0.0, 0.0])  # 默认值
-            
-            # 将法线转换到世界坐标系
-            world_normal = rotation_matrix @ local_normal
-            world_normal = world_normal / np.linalg.norm(world_normal) if np.linalg.norm(world_normal) > 0 else normal
-            
-            return RaycastResult(geometry, t, world_hit, world_normal)
-        
-        return RaycastResult()  # 未命中环 
\ No newline at end of file
+
+
+def _as_camera(camera_config):
+    """把摄像机配置字典包装为 Camera，已经是 Camera 时直接返回"""
+    if isinstance(camera_config, Camera):
+        return camera_config
+    return Camera(camera_config)
+
+
+def intersect_kind(geometry):
+    """
+    确定几何体使用的相交测试类型，与 GeometryRaycaster._intersect_geometry 的分派规则一致
+
+    参数:
+        geometry: 几何体
+
+    返回:
+        str: 相交测试类型，见 _SCALAR_METHODS
+    """
+    geo_type = geometry.type
+    if geo_type in _PRIMITIVE_KINDS:
+        return geo_type
+    return 'aabb'
+
+
+def _occlusion_max_depth(depth, first, last):
+    """
+    查询一组屏幕矩形内深度缓冲的最大值（保守值，可能偏大）
+
+    构建逐级2x2取最大值的深度金字塔，每个矩形选择纹素不小于矩形尺寸的一级，
+    此时矩形最多跨越2x2个纹素，取这4个纹素的最大值即可。
+
+    参数:
+        depth: 形状为 (高, 宽) 的深度缓冲
+        first: 形状为 (N, 2) 的矩形左上角像素 (x, y)
+        last: 形状为 (N, 2) 的矩形右下角像素 (x, y)，包含在内
+
+    返回:
+        np.ndarray: 形状为 (N,) 的最大深度
+    """
+    levels = [depth]
+    while levels[-1].shape[0] > 1 or levels[-1].shape[1] > 1:
+        level = levels[-1]
+        # 奇数尺寸用-inf补齐，不影响最大值
+        padded = level
+        if level.shape[0] % 2 or level.shape[1] % 2:
+            padded = np.pad(level, ((0, level.shape[0] % 2), (0, level.shape[1] % 2)), constant_values=-np.inf)
+        levels.append(np.maximum(np.maximum(padded[0::2, 0::2], padded[0::2, 1::2]),
+                                 np.maximum(padded[1::2, 0::2], padded[1::2, 1::2])))
+
+    extent = (last - first).max(axis=1)
+    level_index = np.minimum(np.ceil(np.log2(extent + 1.0)).astype(np.int64), len(levels) - 1)
+    result = np.empty(len(first))
+    for index in np.unique(level_index).tolist():
+        rows = np.flatnonzero(level_index == index)
+        low = first[rows] >> index
+        high = last[rows] >> index
+        level = levels[index]
+        result[rows] = np.maximum(np.maximum(level[low[:, 1], low[:, 0]], level[low[:, 1], high[:, 0]]),
+                                  np.maximum(level[high[:, 1], low[:, 0]], level[high[:, 1], high[:, 0]]))
+    return result
+
+
+def _kernel_sizes(geometries):
+    """
+    读取批量测试使用的几何体尺寸
+
+    参数:
+        geometries: 几何体列表
+
+    返回:
+        np.ndarray: 形状为 (N, 3) 的尺寸数组
+    """
+    return gather_array(geometries, 'size', lambda geo: geo.size).astype(np.float64)
+
+
+def rays_to_local(ray_origin, ray_direction, centers, rotations):
+    """
+    批量把射线变换到多个几何体的局部坐标系
+
+    参数:
+        ray_origin: 射线起点，形状为 (3,)，或每个几何体各一条射线时为 (N, 3)
+        ray_direction: 射线方向，形状同 ray_origin
+        centers: 形状为 (N, 3) 的几何体世界坐标中心
+        rotations: 形状为 (N, 3, 3) 的几何体世界旋转矩阵
+
+    返回:
+        tuple: (局部起点, 局部方向)，形状均为 (N, 3)，方向已归一化
+    """
+    # R^T · v 等价于 v · R
+    starts = np.einsum('nj,nji->ni', ray_origin - centers, rotations)
+    directions = np.einsum('nj,nji->ni', np.broadcast_to(ray_direction, centers.shape), rotations)
+    norms = np.sqrt(np.einsum('ni,ni->n', directions, directions))[:, None]
+    directions = np.where(norms > 1e-10, directions / np.where(norms > 1e-10, norms, 1.0), [0.0, 0.0, -1.0])
+    return starts, directions
+
+
+def _nearest_root(b, discriminant, a=1.0):
+    """
+    求二次方程 a·t² + b·t + c = 0 的两个根
+
+    判别式为负的位置返回NaN，与任何距离比较的结果都为假。
+    """
+    root = np.sqrt(np.where(discriminant >= 0, discriminant, np.nan))
+    return (-b - root) / (2.0 * a), (-b + root) / (2.0 * a)
+
+
+def intersect_box_batch(starts, directions, sizes):
+    """
+    批量盒子相交测试（局部坐标系）
+
+    参数:
+        starts: 形状为 (N, 3) 的局部射线起点
+        directions: 形状为 (N, 3) 的局部射线方向
+        sizes: 形状为 (N, 3) 的几何体尺寸
+
+    返回:
+        np.ndarray: 形状为 (N,) 的命中距离，未命中为inf
+    """
+    inv_dir = np.where(np.abs(directions) > 1e-6, 1.0 / np.where(directions != 0, directions, 1.0), 1e10)
+    t1 = (-sizes - starts) * inv_dir
+    t2 = (sizes - starts) * inv_dir
+    t_min = np.maximum(np.minimum(t1, t2).max(axis=1), -1e10)
+    t_max = np.minimum(np.maximum(t1, t2).min(axis=1), 1e10)
+    t = np.where(t_min >= 0, t_min, t_max)
+    hit = (t_max >= t_min) & (t_max >= 0)
+    return np.where(hit, t, np.inf)
+
+
+def intersect_sphere_batch(starts, directions, sizes):
+    """批量球体相交测试（局部坐标系），参数与返回值同 intersect_box_batch"""
+    radius = sizes[:, 0]
+    b = 2.0 * np.einsum('ni,ni->n', starts, directions)
+    c = np.einsum('ni,ni->n', starts, starts) - radius * radius
+    t1, t2 = _nearest_root(b, b * b - 4 * c)
+    t = np.where(t1 >= 0, t1, t2)
+    return np.where(t >= 0, t, np.inf)
+
+
+def intersect_cylinder_batch(starts, directions, sizes):
+    """
+    批量圆柱体相交测试（局部坐标系，轴为Y轴），参数与返回值同 intersect_box_batch
+
+    旋转控制器的半径放大已在 sizes 中体现。
+    """
+    radius = sizes[:, 0]
+    half_height = sizes[:, 1]
+    ox, oy, oz = starts[:, 0], starts[:, 1], starts[:, 2]
+    dx, dy, dz = directions[:, 0], directions[:, 1], directions[:, 2]
+    inside_circle = ox * ox + oz * oz <= radius * radius
+    has_dy = np.abs(dy) > 1e-6
+    safe_dy = np.where(has_dy, dy, 1.0)
+
+    # 1. 射线几乎平行于轴：只可能与端盖相交
+    top = (half_height - oy) / safe_dy
+    bottom = (-half_height - oy) / safe_dy
+    parallel_t = np.minimum(np.where(top >= 0, top, np.inf), np.where(bottom >= 0, bottom, np.inf))
+    parallel_t = np.where(inside_circle & has_dy, parallel_t, np.inf)
+
+    # 2. 一般情况：先求与无限长圆柱的第一个交点，超出高度时再测试对应的端盖
+    a = dx * dx + dz * dz
+    safe_a = np.where(a < 1e-6, 1.0, a)
+    b = 2.0 * (ox * dx + oz * dz)
+    c = ox * ox + oz * oz - radius * radius
+    t1, t2 = _nearest_root(b, b * b - 4 * safe_a * c, safe_a)
+    t = np.where(t1 >= 0, t1, np.where(t2 >= 0, t2, np.inf))
+    hit_y = oy + np.where(np.isfinite(t), t, 0.0) * dy
+    side_t = np.where(np.abs(hit_y) <= half_height, t, np.inf)
+
+    cap_y = np.where(hit_y > 0, half_height, -half_height)
+    cap_t = (cap_y - oy) / safe_dy
+    cap_x = ox + cap_t * dx
+    cap_z = oz + cap_t * dz
+    cap_valid = (np.isfinite(t) & (np.abs(hit_y) > half_height) & has_dy & (cap_t >= 0)
+                 & (cap_x * cap_x + cap_z * cap_z <= radius * radius))
+    general_t = np.where(np.isfinite(side_t), side_t, np.where(cap_valid, cap_t, np.inf))
+
+    return np.where(a < 1e-6, parallel_t, general_t)
+
+
+def intersect_capsule_batch(starts, directions, sizes):
+    """批量胶囊体相交测试（局部坐标系，轴为Y轴），参数与返回值同 intersect_box_batch"""
+    radius = sizes[:, 0]
+    half_height = sizes[:, 1]
+    ox, oy, oz = starts[:, 0], starts[:, 1], starts[:, 2]
+    dx, dy, dz = directions[:, 0], directions[:, 1], directions[:, 2]
+    best = np.full(len(starts), np.inf)
+
+    # 1. 圆柱体部分
+    a = dx * dx + dz * dz
+    side = a > 1e-6
+    safe_a = np.where(side, a, 1.0)
+    b = 2.0 * (ox * dx + oz * dz)
+    c = ox * ox + oz * oz - radius * radius
+    for t in _nearest_root(b, b * b - 4 * safe_a * c, safe_a):
+        valid = side & (t >= 0) & (t < best) & (np.abs(oy + t * dy) <= half_height)
+        best = np.where(valid, t, best)
+
+    # 2. 上下两个半球
+    a = np.einsum('ni,ni->n', directions, directions)
+    for sign in (1.0, -1.0):
+        cy = oy - sign * half_height
+        b = 2.0 * (ox * dx + cy * dy + oz * dz)
+        c = ox * ox + cy * cy + oz * oz - radius * radius
+        for t in _nearest_root(b, b * b - 4 * a * c, a):
+            valid = (t >= 0) & (t < best) & (sign * (cy + t * dy) >= 0)
+            best = np.where(valid, t, best)
+    return best
+
+
+def intersect_ellipsoid_batch(starts, directions, sizes):
+    """
+    批量椭球体相交测试（局部坐标系），参数与返回值同 intersect_box_batch
+
+    与单个测试一致，返回的是缩放到单位球空间后的距离。
+    """
+    inv_size = 1.0 / sizes
+    scaled_start = starts * inv_size
+    scaled_dir = directions * inv_size
+    norms = np.linalg.norm(scaled_dir, axis=1)
+    valid = norms > 1e-6
+    scaled_dir = scaled_dir / np.where(valid, norms, 1.0)[:, None]
+    b = 2.0 * np.einsum('ni,ni->n', scaled_start, scaled_dir)
+    c = np.einsum('ni,ni->n', scaled_start, scaled_start) - 1.0
+    t1, t2 = _nearest_root(b, b * b - 4 * c)
+    t = np.where(t1 >= 0, t1, np.where(t2 >= 0, t2, np.inf))
+    return np.where(valid, t, np.inf)
+
+
+def intersect_plane_batch(starts, directions, sizes):
+    """批量平面相交测试（局部坐标系，法线为Z轴），参数与返回值同 intersect_box_batch"""
+    dz = directions[:, 2]
+    facing = np.abs(dz) > 1e-6
+    t = -starts[:, 2] / np.where(facing, dz, 1.0)
+    hit_x = starts[:, 0] + t * directions[:, 0]
+    hit_y = starts[:, 1] + t * directions[:, 1]
+    hit = facing & (t >= 0) & (np.abs(hit_x) <= sizes[:, 0]) & (np.abs(hit_y) <= sizes[:, 1])
+    return np.where(hit, t, np.inf)
+
+
+def sweep_box_batch(ray_origin, ray_direction, extent, centers, rotations, half_extents):
+    """
+    世界坐标轴对齐的盒子沿射线移动时，与一组有向包围盒的首次接触（分离轴测试）
+
+    在15个候选分离轴（3个世界轴、3个包围盒轴及两两叉积）上分别求投影区间重叠的时间段，
+    所有时间段的交集的起点就是接触时间。
+
+    参数:
+        ray_origin: 盒子中心起点，形状为 (3,)
+        ray_direction: 移动方向（单位向量），形状为 (3,)
+        extent: 移动盒子的半尺寸，形状为 (3,)
+        centers: 形状为 (N, 3) 的包围盒中心
+        rotations: 形状为 (N, 3, 3) 的包围盒旋转矩阵
+        half_extents: 形状为 (N, 3) 的包围盒半尺寸
+
+    返回:
+        tuple: (形状为 (N,) 的接触距离，未接触或起点已重叠为inf, 形状为 (N, 3) 的接触法线)
+    """
+    count = len(centers)
+    box_axes = rotations.transpose(0, 2, 1)  # 每行是包围盒的一个轴
+    world_axes = np.broadcast_to(np.eye(3), (count, 3, 3))
+    cross_axes = np.cross(world_axes[:, :, None, :], box_axes[:, None, :, :]).reshape(count, 9, 3)
+    axes = np.concatenate([world_axes, box_axes, cross_axes], axis=1)
+    lengths = np.linalg.norm(axes, axis=2)
+    valid = lengths > 1e-6  # 平行的轴叉积为零，不构成分离轴
+    axes = axes / np.where(valid, lengths, 1.0)[:, :, None]
+
+    # 两个盒子在轴上的投影半径之和，以及中心距离的投影和相对速度
+    reach = np.abs(axes) @ extent + np.einsum('naj,nj->na', np.abs(np.einsum('nai,nji->naj', axes, box_axes)), half_extents)
+    gap = np.einsum('nai,ni->na', axes, centers - ray_origin)
+    speed = axes @ ray_direction
+
+    moving = np.abs(speed) > 1e-12
+    safe_speed = np.where(moving, speed, 1.0)
+    t0 = (gap - reach) / safe_speed
+    t1 = (gap + reach) / safe_speed
+    overlapping = np.abs(gap) <= reach
+    enter = np.where(moving, np.minimum(t0, t1), np.where(overlapping, -np.inf, np.inf))
+    leave = np.where(moving, np.maximum(t0, t1), np.where(overlapping, np.inf, -np.inf))
+    enter = np.where(valid, enter, -np.inf)
+    leave = np.where(valid, leave, np.inf)
+
+    contact_axis = np.argmax(enter, axis=1)
+    rows = np.arange(count)
+    t_enter = enter[rows, contact_axis]
+    hit = (t_enter <= leave.min(axis=1)) & (t_enter >= 0)
+    # 法线与移动方向相反
+    normals = axes[rows, contact_axis] * -np.sign(speed[rows, contact_axis])[:, None]
+    return np.where(hit, t_enter, np.inf), normals
+
+
+def local_normals_batch(kind, points, sizes):
+    """
+    批量计算局部坐标系中表面点的单位法线
+
+    参数:
+        kind: 相交测试类型，须在 _BATCH_KERNELS 中
+        points: 形状为 (N, 3) 的局部坐标系表面点
+        sizes: 形状为 (N, 3) 的几何体尺寸
+
+    返回:
+        np.ndarray: 形状为 (N, 3) 的单位法线
+    """
+    normals = np.zeros_like(points)
+    rows = np.arange(len(points))
+    if kind == 'box':
+        # 离哪个面最近（按尺寸归一化后绝对值最大的分量）就取哪个面的法线
+        scaled = np.abs(points) / np.where(sizes > 0, sizes, 1.0)
+        axis = np.argmax(scaled, axis=1)
+        normals[rows, axis] = np.where(points[rows, axis] >= 0, 1.0, -1.0)
+        return normals
+    if kind == 'plane':
+        normals[:, 2] = 1.0
+        return normals
+    if kind == 'sphere':
+        normals = points.copy()
+    elif kind == 'ellipsoid':
+        # 法线与隐式方程的梯度 (x/a², y/b², z/c²) 同向
+        normals = points / np.where(sizes != 0, sizes * sizes, 1.0)
+    elif kind == 'capsule':
+        normals = points.copy()
+        normals[:, 1] -= np.clip(points[:, 1], -sizes[:, 1], sizes[:, 1])
+    elif kind == 'cylinder':
+        radial = np.hypot(points[:, 0], points[:, 2])
+        on_cap = np.abs(np.abs(points[:, 1]) - sizes[:, 1]) < np.abs(radial - sizes[:, 0])
+        normals[:, 0] = np.where(on_cap, 0.0, points[:, 0])
+        normals[:, 1] = np.where(on_cap, np.where(points[:, 1] >= 0, 1.0, -1.0), 0.0)
+        normals[:, 2] = np.where(on_cap, 0.0, points[:, 2])
+    norms = np.linalg.norm(normals, axis=1)[:, None]
+    return np.where(norms > 1e-12, normals / np.where(norms > 1e-12, norms, 1.0), [0.0, 1.0, 0.0])
+
+
+# 相交测试类型 -> GeometryRaycaster 上对应的单个几何体测试方法
+_SCALAR_METHODS = {
+    'box': '_intersect_box',
+    'cylinder': '_intersect_cylinder',
+    'sphere': '_intersect_sphere',
+    'capsule': '_intersect_capsule',
+    'ellipsoid': '_intersect_ellipsoid',
+    'plane': '_intersect_plane',
+    'aabb': '_intersect_aabb',
+}
+
+# 相交测试类型 -> 批量测试函数；不在表中的类型逐个测试
+_BATCH_KERNELS = {
+    'box': intersect_box_batch,
+    'cylinder': intersect_cylinder_batch,
+    'sphere': intersect_sphere_batch,
+    'capsule': intersect_capsule_batch,
+    'ellipsoid': intersect_ellipsoid_batch,
+    'plane': intersect_plane_batch,
+}
+
+# 有专门相交测试的几何体类型
+_PRIMITIVE_KINDS = frozenset(_BATCH_KERNELS)
+
+# raycast_image 中批量测试类型的编号
+_IMAGE_KINDS = tuple(_BATCH_KERNELS)
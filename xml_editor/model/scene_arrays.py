@@ -0,0 +1,306 @@
+"""
+场景数组存储
+
+以结构化数组（Structure of Arrays）的形式集中保存场景中所有节点的数值数据。
+"""
+
+import numpy as np
+
+
+class SceneArrays:
+    """
+    场景数值数据存储
+
+    将所有节点的位置、旋转、尺寸、包围盒、变换矩阵和材质颜色保存在按节点ID索引的
+    连续float32数组中。绑定到存储的几何体，其对应属性是这些数组中某一行的视图，
+    因此渲染、射线投射、序列化等批量处理可以直接按列操作整个场景。
+
+    存储是可选的：未绑定的几何体仍然各自持有独立的小数组。
+    """
+    # 列名 -> 每个节点的数据形状
+    COLUMNS = {
+        'position': (3,),
+        'rotation': (3,),
+        'size': (3,),
+        'aabb_min': (3,),
+        'aabb_max': (3,),
+        'local_matrix': (4, 4),
+        'world_matrix': (4, 4),
+        'color': (4,),
+        'specular': (4,),
+    }
+
+    # 几何体属性名 -> 列名
+    GEOMETRY_FIELDS = {
+        '_position': 'position',
+        '_rotation': 'rotation',
+        '_size': 'size',
+        'aabb_min': 'aabb_min',
+        'aabb_max': 'aabb_max',
+        '_local_matrix': 'local_matrix',
+        '_world_matrix': 'world_matrix',
+    }
+
+    # 材质属性名 -> 列名
+    MATERIAL_FIELDS = {
+        '_base_color': 'color',
+        '_specular': 'specular',
+    }
+
+    def __init__(self, capacity=1024):
+        """
+        初始化存储
+
+        参数:
+            capacity: 初始容量（节点数），容量不足时自动翻倍扩展
+        """
+        self._capacity = max(1, int(capacity))
+        self._columns = {
+            name: np.zeros((self._capacity,) + shape, dtype=np.float32)
+            for name, shape in self.COLUMNS.items()
+        }
+        self._nodes = [None] * self._capacity
+        # 空闲ID栈，优先复用较小的ID，保持数据紧凑
+        self._free_ids = list(range(self._capacity - 1, -1, -1))
+
+    def __len__(self):
+        """已分配的节点数量"""
+        return self._capacity - len(self._free_ids)
+
+    @property
+    def capacity(self):
+        """当前容量"""
+        return self._capacity
+
+    def column(self, name):
+        """
+        获取整列数据
+
+        参数:
+            name: 列名，见 COLUMNS
+
+        返回:
+            np.ndarray: 形状为 (capacity, ...) 的数组，未分配的行内容无意义
+        """
+        return self._columns[name]
+
+    @property
+    def position(self):
+        """所有节点的局部位置"""
+        return self._columns['position']
+
+    @property
+    def rotation(self):
+        """所有节点的局部欧拉角（角度制）"""
+        return self._columns['rotation']
+
+    @property
+    def size(self):
+        """所有节点的尺寸"""
+        return self._columns['size']
+
+    @property
+    def aabb_min(self):
+        """所有节点的包围盒最小点"""
+        return self._columns['aabb_min']
+
+    @property
+    def aabb_max(self):
+        """所有节点的包围盒最大点"""
+        return self._columns['aabb_max']
+
+    @property
+    def local_matrix(self):
+        """所有节点的局部变换矩阵"""
+        return self._columns['local_matrix']
+
+    @property
+    def world_matrix(self):
+        """所有节点的世界变换矩阵"""
+        return self._columns['world_matrix']
+
+    @property
+    def color(self):
+        """所有节点的材质颜色（RGBA）"""
+        return self._columns['color']
+
+    @property
+    def specular(self):
+        """所有节点的高光颜色（RGBA）"""
+        return self._columns['specular']
+
+    def node(self, node_id):
+        """根据节点ID获取几何体"""
+        return self._nodes[node_id]
+
+    def active_ids(self):
+        """
+        获取所有已分配的节点ID
+
+        返回:
+            np.ndarray: 升序排列的节点ID数组，可直接用于按列索引
+        """
+        return np.array([i for i, node in enumerate(self._nodes) if node is not None], dtype=np.intp)
+
+    def attach(self, geometries):
+        """
+        将几何体（及其整个子树）绑定到存储
+
+        当前的数值会被复制到存储中，之后几何体的属性即成为存储数组的视图。
+        已绑定到其他存储的节点会先从原存储中解绑。
+
+        参数:
+            geometries: 单个几何体或几何体列表
+        """
+        if not isinstance(geometries, (list, tuple)):
+            geometries = [geometries]
+
+        stack = list(geometries)
+        while stack:
+            node = stack.pop()
+            if node._store is not self:
+                if node._store is not None:
+                    node._store.detach(node, recursive=False)
+                node_id = self._allocate(node)
+                self._copy_in(node, node_id)
+                self._bind(node, node_id)
+            stack.extend(node.children)
+
+    def detach(self, geometries, recursive=True):
+        """
+        将几何体从存储中解绑
+
+        几何体会重新持有独立的数组副本，原来占用的节点ID被回收。
+
+        参数:
+            geometries: 单个几何体或几何体列表
+            recursive: 是否同时解绑整个子树
+        """
+        if not isinstance(geometries, (list, tuple)):
+            geometries = [geometries]
+
+        stack = list(geometries)
+        while stack:
+            node = stack.pop()
+            if node._store is self:
+                node_id = node._node_id
+                for attr in self.GEOMETRY_FIELDS:
+                    node.__dict__[attr] = np.array(node.__dict__[attr])
+                for attr in self.MATERIAL_FIELDS:
+                    node.material.__dict__[attr] = np.array(node.material.__dict__[attr])
+                node._store = None
+                node._node_id = None
+                node.material._store = None
+                self._nodes[node_id] = None
+                self._free_ids.append(node_id)
+            if recursive:
+                stack.extend(node.children)
+
+    def _allocate(self, node):
+        """为节点分配ID，容量不足时扩展"""
+        if not self._free_ids:
+            self._grow(self._capacity * 2)
+        node_id = self._free_ids.pop()
+        self._nodes[node_id] = node
+        return node_id
+
+    def _grow(self, new_capacity):
+        """扩展容量，并把所有已绑定节点的视图重新指向新数组"""
+        old_capacity = self._capacity
+        for name, shape in self.COLUMNS.items():
+            column = np.zeros((new_capacity,) + shape, dtype=np.float32)
+            column[:old_capacity] = self._columns[name]
+            self._columns[name] = column
+
+        self._nodes.extend([None] * (new_capacity - old_capacity))
+        self._free_ids = list(range(new_capacity - 1, old_capacity - 1, -1)) + self._free_ids
+        self._capacity = new_capacity
+
+        for node_id, node in enumerate(self._nodes):
+            if node is not None:
+                self._bind(node, node_id)
+
+    def _copy_in(self, node, node_id):
+        """把节点当前的数值写入存储"""
+        for attr, name in self.GEOMETRY_FIELDS.items():
+            _copy_row(self._columns[name][node_id], node.__dict__[attr])
+        for attr, name in self.MATERIAL_FIELDS.items():
+            _copy_row(self._columns[name][node_id], node.material.__dict__[attr])
+
+    def _bind(self, node, node_id):
+        """把节点的数值属性替换为存储中对应行的视图"""
+        for attr, name in self.GEOMETRY_FIELDS.items():
+            node.__dict__[attr] = self._columns[name][node_id]
+        for attr, name in self.MATERIAL_FIELDS.items():
+            node.material.__dict__[attr] = self._columns[name][node_id]
+        node._store = self
+        node._node_id = node_id
+        node.material._store = self
+
+
+def _copy_row(target, value):
+    """
+    把数值写入存储中的一行
+
+    长度与列宽不一致时（例如只给出半径的尺寸）截断或以0补齐。
+    """
+    value = np.asarray(value, dtype=target.dtype)
+    if value.shape == target.shape:
+        target[...] = value
+    else:
+        flat = value.reshape(-1)[:target.size]
+        target[...] = 0
+        target.reshape(-1)[:flat.size] = flat
+
+
+def write_array(owner, attr, value, dtype=None):
+    """
+    写入对象的数值属性
+
+    对象绑定到 SceneArrays 时，属性是共享数组中某一行的视图，需要原地写入；
+    否则按原有方式替换为新的数组。
+
+    参数:
+        owner: 几何体或材质对象
+        attr: 属性名
+        value: 新的数值
+        dtype: 未绑定时新数组的数据类型
+    """
+    if owner._store is None:
+        setattr(owner, attr, np.array(value, dtype=dtype))
+    else:
+        _copy_row(getattr(owner, attr), value)
+
+
+def gather_array(nodes, column, getter):
+    """
+    批量读取一组几何体的数值属性
+    
+    所有节点绑定到同一个 SceneArrays 时直接按节点ID从列中取出；否则逐个读取，
+    长度与列宽不一致的数组会按 _copy_row 的规则截断或补齐。
+    
+    参数:
+        nodes: 几何体列表
+        column: 列名，见 SceneArrays.COLUMNS
+        getter: 未绑定时从几何体读取数值的函数
+        
+    返回:
+        np.ndarray: 形状为 (N, ...) 的float32数组
+    """
+    store = nodes[0]._store if nodes else None
+    if store is not None and all(node._store is store for node in nodes):
+        return store.column(column)[[node._node_id for node in nodes]]
+    
+    # 常见情况下所有数组形状一致，一次转换即可
+    shape = SceneArrays.COLUMNS[column]
+    try:
+        result = np.array([getter(node) for node in nodes], dtype=np.float32)
+    except ValueError:
+        result = None
+    if result is not None and result.shape == (len(nodes),) + shape:
+        return result
+    
+    result = np.zeros((len(nodes),) + shape, dtype=np.float32)
+    for row, node in zip(result, nodes):
+        _copy_row(row, getter(node))
+    return result
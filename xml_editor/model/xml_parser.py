@@ -4,9 +4,202 @@ XML解析器
 处理MJCF文件的加载、解析和保存功能。
 """
 
+import os
+import threading
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import quoteattr
 import numpy as np
-from .geometry import Geometry, GeometryGroup, GeometryType
+from .geometry import (Geometry, GeometryGroup, GeometryType, update_transforms_batch,
+                       quat_to_matrix_batch, matrix_to_euler_batch)
+from .scene_arrays import gather_array
+
+class AssetIndex:
+    """
+    MJCF资源索引
+    
+    在遍历body之前一次性收集 asset 中的 material、texture、mesh、hfield，按名称索引，
+    之后的引用解析都是O(1)的字典查找，并且不受名称中特殊字符（如引号）的影响。
+    材质的rgba只解析一次并缓存，被多个geom共享的材质不会重复解析。
+    """
+    KINDS = ("material", "texture", "mesh", "hfield")
+    
+    def __init__(self, root=None):
+        """
+        初始化索引
+        
+        参数:
+            root: XML根元素，为None时创建空索引（流式加载时逐个添加）
+        """
+        self._entries = {kind: {} for kind in self.KINDS}
+        self._rgba_cache = {}
+        
+        if root is not None:
+            for asset in root.iter("asset"):
+                for elem in asset:
+                    self.add(elem)
+    
+    def add(self, elem):
+        """
+        添加一个资源元素，非资源元素和未命名的元素会被忽略
+        
+        参数:
+            elem: asset下的子元素
+        """
+        entries = self._entries.get(elem.tag)
+        if entries is None:
+            return
+        name = elem.get("name")
+        if name is None and elem.tag in ("mesh", "hfield") and elem.get("file"):
+            # mesh/hfield未命名时，MuJoCo使用去掉扩展名的文件名作为名称
+            name = os.path.splitext(os.path.basename(elem.get("file")))[0]
+        if name is None:
+            return
+        # 复制属性字典，流式加载时元素在处理后会被释放
+        entries[name] = dict(elem.attrib)
+        if elem.tag == "material":
+            self._rgba_cache.pop(name, None)
+    
+    def get(self, kind, name):
+        """
+        按名称获取资源属性
+        
+        参数:
+            kind: 资源类型，见 KINDS
+            name: 资源名称
+            
+        返回:
+            dict: 资源元素的属性字典，不存在时返回None
+        """
+        return self._entries[kind].get(name)
+    
+    def has(self, kind, name):
+        """资源是否存在"""
+        return name in self._entries[kind]
+    
+    def material_rgba(self, name):
+        """
+        获取材质颜色
+        
+        参数:
+            name: 材质名称
+            
+        返回:
+            tuple: RGBA颜色，材质不存在或未指定rgba时返回None
+        """
+        if name in self._rgba_cache:
+            return self._rgba_cache[name]
+        
+        rgba = None
+        material = self._entries["material"].get(name)
+        if material is not None and 'rgba' in material:
+            color = XMLParser._parse_floats(material['rgba'], [])
+            if len(color) == 3:
+                color.append(1.0)  # 添加默认透明度
+            if len(color) >= 4:
+                rgba = tuple(color[:4])
+        
+        if material is not None:
+            self._rgba_cache[name] = rgba
+        return rgba
+
+
+class DefaultClasses:
+    """
+    MJCF默认类（<default>）解析引擎
+    
+    加载时把默认类树一次性编译为按 (类名, 元素类型) 索引的扁平属性字典，每个类的字典
+    已经合并了所有祖先类的属性。之后每个geom/body的查询只是一次字典查找加一次合并。
+    """
+    # 顶层默认类的名称
+    ROOT_CLASS = "main"
+    
+    # 方向属性互斥：元素自身给出任一方向属性时，忽略默认类中的方向属性
+    ORIENTATION_ATTRS = ("quat", "euler", "axisangle", "xyaxes", "zaxis")
+    
+    def __init__(self, root=None):
+        """
+        初始化并编译默认类
+        
+        参数:
+            root: XML根元素，为None时创建空的默认类表（流式加载时逐个添加）
+        """
+        self._classes = {}  # 类名 -> {元素类型: 扁平属性字典}
+        
+        if root is not None:
+            for default in root.findall("default"):
+                self.add_tree(default)
+    
+    def add_tree(self, default_elem):
+        """
+        编译一棵顶层 <default> 树
+        
+        参数:
+            default_elem: 根元素下的 default 元素
+        """
+        # 显式栈遍历：(default元素, 类名, 父类名)。父类总是先于子类编译完成
+        stack = [(default_elem, default_elem.get("class", self.ROOT_CLASS), None)]
+        while stack:
+            elem, class_name, parent_class = stack.pop()
+            
+            # 先继承父类中所有元素类型的属性
+            resolved = self._classes.setdefault(class_name, {})
+            if parent_class is not None:
+                for tag, attrs in self._classes[parent_class].items():
+                    resolved[tag] = dict(attrs)
+            
+            for child in elem:
+                if child.tag == "default":
+                    stack.append((child, child.get("class", class_name), class_name))
+                else:
+                    attrs = resolved.setdefault(child.tag, {})
+                    if any(key in child.attrib for key in self.ORIENTATION_ATTRS):
+                        for key in self.ORIENTATION_ATTRS:
+                            attrs.pop(key, None)
+                    attrs.update(child.attrib)
+    
+    def has_class(self, class_name):
+        """默认类是否存在"""
+        return class_name in self._classes
+    
+    def get(self, class_name, tag):
+        """
+        获取某个类中某种元素的默认属性
+        
+        参数:
+            class_name: 默认类名称
+            tag: 元素类型，如 'geom'
+            
+        返回:
+            dict: 扁平属性字典（不要修改），没有默认值时返回空字典
+        """
+        return self._classes.get(class_name, {}).get(tag, {})
+    
+    def resolve(self, elem, childclass=None):
+        """
+        计算元素应用默认类后的属性
+        
+        类的选择顺序为：元素自身的 class，最近的祖先body的 childclass，顶层默认类。
+        
+        参数:
+            elem: XML元素
+            childclass: 从祖先body继承的 childclass
+            
+        返回:
+            dict: 合并后的属性；没有任何默认值时直接返回元素自身的属性字典
+        """
+        class_name = elem.get("class") or childclass or self.ROOT_CLASS
+        defaults = self.get(class_name, elem.tag)
+        if not defaults:
+            return elem.attrib
+        
+        attrs = dict(defaults)
+        if any(key in elem.attrib for key in self.ORIENTATION_ATTRS):
+            for key in self.ORIENTATION_ATTRS:
+                attrs.pop(key, None)
+        attrs.update(elem.attrib)
+        return attrs
+
 
 class XMLParser:
     """
@@ -17,20 +210,30 @@ class XMLParser:
     2. MuJoCo XML格式（标准MJCF格式）
     """
     
+    # 超过该大小（字节）的文件默认使用流式加载
+    STREAMING_THRESHOLD = 64 * 1024 * 1024
+    
     @staticmethod
-    def load(filename):
+    def load(filename, streaming=None):
         """
         从XML文件导入几何体和组层级结构
         
         参数:
             filename: 要加载的XML文件路径
+            streaming: 是否使用流式加载（仅对MuJoCo格式有效）。
+                       为None时根据文件大小自动选择，见 STREAMING_THRESHOLD
             
         返回:
             几何体对象列表
         """
         try:
-            tree = ET.parse(filename)
-            root = tree.getroot()
+            if streaming is None:
+                streaming = os.path.getsize(filename) >= XMLParser.STREAMING_THRESHOLD
+            if streaming:
+                return XMLParser._load_mujoco_streaming(filename)
+            
+            # 解析主文件并展开其中的<include>
+            root = XMLParser._parse_with_includes(filename)
             
             # 检查文件格式类型
             is_mujoco_format = root.tag == "mujoco"
@@ -46,6 +249,251 @@ class XMLParser:
             print(f"加载XML文件时出错: {e}")
             return []
     
+    # 解析缓存：绝对路径 -> ((修改时间, 文件大小), 根元素)，按最近使用顺序排列
+    PARSE_CACHE_SIZE = 64
+    _parse_cache = {}
+    _parse_cache_lock = threading.Lock()
+    
+    # 并行解析include片段的最大线程数
+    INCLUDE_WORKERS = 8
+    
+    @staticmethod
+    def _parse_cached(path):
+        """
+        解析XML文件，结果按 (绝对路径, 修改时间, 文件大小) 缓存
+        
+        缓存中的树是共享的，调用方只能读取，不能修改。
+        
+        参数:
+            path: 文件的绝对路径
+            
+        返回:
+            ET.Element: 根元素
+        """
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with XMLParser._parse_cache_lock:
+            entry = XMLParser._parse_cache.pop(path, None)
+            if entry is not None and entry[0] == key:
+                XMLParser._parse_cache[path] = entry
+                return entry[1]
+        
+        root = ET.parse(path).getroot()
+        
+        with XMLParser._parse_cache_lock:
+            XMLParser._parse_cache[path] = (key, root)
+            while len(XMLParser._parse_cache) > XMLParser.PARSE_CACHE_SIZE:
+                XMLParser._parse_cache.pop(next(iter(XMLParser._parse_cache)))
+        return root
+    
+    @staticmethod
+    def _parse_with_includes(filename):
+        """
+        解析文件并展开所有 <include file="..."/>
+        
+        先逐层发现整个include图，同一层中互不依赖的片段文件在线程池中并行解析；
+        解析结果经过 _parse_cached 缓存，只有修改过的片段会被重新解析。
+        include路径相对于主文件所在目录，找不到时再相对于包含它的文件。
+        
+        参数:
+            filename: 主文件路径
+            
+        返回:
+            ET.Element: 展开后的根元素（没有include时就是缓存中的根元素）
+        """
+        main_path = os.path.abspath(filename)
+        main_dir = os.path.dirname(main_path)
+        roots = {}  # 绝对路径 -> 根元素
+        include_paths = {}  # id(include元素) -> 片段的绝对路径
+        
+        level = [main_path]
+        with ThreadPoolExecutor(max_workers=XMLParser.INCLUDE_WORKERS) as pool:
+            while level:
+                next_level = []
+                for path, root in zip(level, pool.map(XMLParser._parse_cached, level)):
+                    roots[path] = root
+                    for include in root.iter("include"):
+                        include_file = include.get("file")
+                        if not include_file:
+                            raise ValueError(f"{path} 中的include缺少file属性")
+                        include_path = os.path.normpath(os.path.join(main_dir, include_file))
+                        if not os.path.exists(include_path):
+                            include_path = os.path.normpath(
+                                os.path.join(os.path.dirname(path), include_file))
+                        include_paths[id(include)] = include_path
+                        if include_path not in roots and include_path not in level \
+                                and include_path not in next_level:
+                            next_level.append(include_path)
+                level = next_level
+        
+        if not include_paths:
+            return roots[main_path]
+        
+        expanded = {}  # 绝对路径 -> 展开后的根元素
+        expanding = set()  # 正在展开的文件，用于检测循环include
+        
+        def expand_file(path):
+            if path in expanded:
+                return expanded[path]
+            if path in expanding:
+                raise ValueError(f"检测到循环include：{path}")
+            expanding.add(path)
+            root = roots[path]
+            
+            # 标记包含include的元素路径，只复制这些元素，其余子树与缓存共享
+            dirty = set()
+            ancestors = []
+            stack = [(root, False)]
+            while stack:
+                elem, leaving = stack.pop()
+                if leaving:
+                    ancestors.pop()
+                elif elem.tag == "include":
+                    # 祖先一旦已标记，更上层的元素也必然已标记
+                    for elem_id in reversed(ancestors):
+                        if elem_id in dirty:
+                            break
+                        dirty.add(elem_id)
+                else:
+                    ancestors.append(id(elem))
+                    stack.append((elem, True))
+                    stack.extend((child, False) for child in elem)
+            
+            def expand_elem(elem):
+                new_elem = ET.Element(elem.tag, elem.attrib)
+                new_elem.text = elem.text
+                new_elem.tail = elem.tail
+                for child in elem:
+                    if child.tag == "include":
+                        # 片段文件的根元素（<mujoco>）本身不保留，只插入其子元素
+                        new_elem.extend(list(expand_file(include_paths[id(child)])))
+                    elif id(child) in dirty:
+                        new_elem.append(expand_elem(child))
+                    else:
+                        new_elem.append(child)
+                return new_elem
+            
+            result = expand_elem(root) if dirty else root
+            expanding.discard(path)
+            expanded[path] = result
+            return result
+        
+        return expand_file(main_path)
+    
+    @staticmethod
+    def _load_mujoco_streaming(filename):
+        """
+        以流式方式加载MuJoCo XML文件
+        
+        基于 ET.iterparse 边解析边构建几何体节点，处理完的元素立即从树中移除，
+        峰值内存接近最终场景图的大小，而不是整棵ElementTree加场景图。
+        非MuJoCo格式的文件会回退到普通加载。
+        
+        参数:
+            filename: 要加载的XML文件路径
+            
+        返回:
+            几何体对象列表
+        """
+        geometries = []
+        pending_quats = []
+        assets = AssetIndex()  # 随asset元素的到达逐个添加
+        defaults = DefaultClasses()  # 每个顶层default结束时编译
+        unresolved_materials = []  # 引用了尚未出现的材质的 (几何体, 材质名称)
+        
+        elem_stack = []  # 当前打开的元素
+        group_stack = []  # 当前打开的body对应的组
+        class_stack = []  # 当前打开的body生效的 childclass
+        default_depth = 0  # default元素的嵌套深度，其子树要保留到编译完成
+        in_worldbody = False
+        world_group = None
+        
+        for event, elem in ET.iterparse(filename, events=("start", "end")):
+            if event == "start":
+                if not elem_stack and elem.tag != "mujoco":
+                    # 不是MuJoCo格式，交给普通加载流程处理
+                    return XMLParser.load(filename, streaming=False)
+                elem_stack.append(elem)
+                
+                if elem.tag == "include":
+                    # 含include的文件交给普通加载流程，由 _parse_with_includes 展开
+                    return XMLParser.load(filename, streaming=False)
+                elif elem.tag == "default":
+                    default_depth += 1
+                elif elem.tag == "worldbody":
+                    in_worldbody = True
+                elif in_worldbody and elem.tag == "body":
+                    parent = group_stack[-1] if group_stack else None
+                    group = XMLParser._create_mujoco_group(elem, parent, pending_quats)
+                    if parent is None:
+                        geometries.append(group)
+                    else:
+                        parent.add_child(group)
+                    group_stack.append(group)
+                    class_stack.append(elem.get('childclass', class_stack[-1] if class_stack else None))
+                elif in_worldbody and elem.tag == "geom":
+                    if group_stack:
+                        parent = group_stack[-1]
+                        geom_name = elem.get('name', f"{parent.name}_geom")
+                    else:
+                        # worldbody下的直接geom，排除参考平面和坐标轴
+                        geom_name = elem.get('name', '')
+                        if geom_name in ["ground", "x_axis", "y_axis", "z_axis"]:
+                            continue
+                        if world_group is None:
+                            world_group = GeometryGroup(name="World")
+                        parent = world_group
+                        geom_name = geom_name or "Object"
+                    
+                    attrs = defaults.resolve(elem, class_stack[-1] if class_stack else None)
+                    geo = XMLParser._create_mujoco_geom(attrs, assets, parent, geom_name, pending_quats)
+                    parent.add_child(geo)
+                    
+                    # 材质可能在文件后面才声明，记录下来待解析结束后处理
+                    material_name = attrs.get('material')
+                    if ('rgba' not in attrs and material_name is not None
+                            and not assets.has("material", material_name)):
+                        unresolved_materials.append((geo, material_name))
+                continue
+            
+            # end事件
+            elem_stack.pop()
+            if elem.tag == "default":
+                default_depth -= 1
+                if default_depth > 0:
+                    continue
+                defaults.add_tree(elem)
+            elif default_depth > 0:
+                # default子树在顶层default结束时整体编译，先不释放
+                continue
+            elif elem.tag == "worldbody":
+                in_worldbody = False
+            elif in_worldbody and elem.tag == "body":
+                group_stack.pop()
+                class_stack.pop()
+            elif elem_stack and elem_stack[-1].tag == "asset":
+                assets.add(elem)
+            
+            # 处理完的元素一定是父元素的最后一个子元素，直接删除以释放内存
+            if elem_stack:
+                del elem_stack[-1][-1]
+        
+        # 世界组放在所有body之后，与普通加载保持一致
+        if world_group is not None:
+            geometries.append(world_group)
+        
+        for geo, material_name in unresolved_materials:
+            material_rgba = assets.material_rgba(material_name)
+            if material_rgba is not None:
+                geo.material.color = material_rgba
+        
+        XMLParser._apply_pending_quats(pending_quats)
+        
+        # 最后，按层级批量计算所有对象的局部和世界变换
+        update_transforms_batch(geometries)
+        
+        return geometries
+    
     @staticmethod
     def _load_enhanced_format(root):
         """
@@ -93,9 +541,6 @@ class XMLParser:
                         # 创建组对象
                         group = GeometryGroup(name=name, position=position, rotation=rotation, parent=parent)
                         
-                        # 确保变换矩阵被更新
-                        if hasattr(group, "update_transform_matrix"):
-                            group.update_transform_matrix()
                         
                         # 处理子节点
                         children_elem = child.find("Children")
@@ -155,9 +600,6 @@ class XMLParser:
                             parent=parent
                         )
                         
-                        # 确保变换矩阵被更新
-                        if hasattr(geo, "update_transform_matrix"):
-                            geo.update_transform_matrix()
                         
                         # 处理材质
                         material_elem = child.find("Material")
@@ -189,6 +631,10 @@ class XMLParser:
         """
         处理MuJoCo XML格式
         
+        对worldbody做一次递归下降遍历，按文档顺序直接构建 GeometryGroup/Geometry 树，
+        耗时与元素数量成线性关系。body按元素本身建立层级，未命名或重名的body
+        不会被合并。
+        
         参数:
             root: XML根元素
             
@@ -196,391 +642,479 @@ class XMLParser:
             几何体对象列表
         """
         geometries = []
+        # include展开后可能有多个worldbody，按文档顺序合并
+        world_bodies = root.findall("worldbody") or root.findall(".//worldbody")
+        if not world_bodies:
+            return geometries
         
-        # 创建一个字典来跟踪body和对应的几何体组
-        body_groups = {}
-        parent_map = {}  # 用于跟踪父子关系
-        
-        # 构建父子关系映射
-        for body in root.findall(".//body"):
-            body_name = body.get('name', 'Unnamed')
-            # 寻找直接父body
-            parent_body = None
-            for parent in root.findall(".//body"):
-                if body in parent.findall("./body"):
-                    parent_body = parent
-                    break
-            
-            if parent_body is not None:
-                parent_map[body_name] = parent_body.get('name', 'Unnamed')
-        
-        # 处理所有body
-        for body in root.findall(".//body"):
-            body_name = body.get('name', 'Unnamed')
-            if body_name in body_groups:
-                continue  # 跳过已处理的body
-            
-            body_pos = list(map(float, body.get('pos', '0 0 0').split()))
-            body_euler = list(map(float, body.get('euler', '0 0 0').split())) if 'euler' in body.attrib else [0, 0, 0]
-            
-            # 检查四元数表示
-            if 'quat' in body.attrib:
-                quat = list(map(float, body.get('quat').split()))
-                if len(quat) == 4:
-                    body_euler = XMLParser._quat_to_euler(quat)
-            
-            # 创建组对象
-            group = GeometryGroup(
-                name=body_name,
-                position=body_pos,
-                rotation=body_euler
-            )
-            
-            # 确保变换矩阵被更新
-            if hasattr(group, "update_transform_matrix"):
-                group.update_transform_matrix()
-            
-            body_groups[body_name] = group
-            
-            # 添加所有geom子对象
-            for geom in body.findall("geom"):
-                geo_type = geom.get('type', 'box')
-                geom_name = geom.get('name', f"{body_name}_geom")
-                
-                # 解析尺寸
-                size_str = geom.get('size', '1 1 1')
-                size = list(map(float, size_str.split()))
-                
-                # 适当地处理尺寸格式
-                if geo_type == 'sphere':
-                    if len(size) == 1:
-                        size = [size[0], size[0], size[0]]  # 保持三个相同的半径值
-                elif geo_type == 'ellipsoid':
-                    # 确保有三个尺寸
-                    if len(size) < 3:
-                        size.extend([size[0]] * (3 - len(size)))
-                elif geo_type in ['capsule', 'cylinder']:
-                    # 确保有两个尺寸
-                    if len(size) < 2:
-                        size.append(1.0)  # 默认半高
-                    if len(size) < 3:
-                        size.append(0)  # 补充第三个参数
-                
-                # 解析位置（相对于body的局部坐标）
-                local_pos = list(map(float, geom.get('pos', '0 0 0').split())) if 'pos' in geom.attrib else [0, 0, 0]
-                
-                # 解析旋转
-                local_euler = [0, 0, 0]
-                if 'euler' in geom.attrib:
-                    local_euler = list(map(float, geom.get('euler').split()))
-                elif 'quat' in geom.attrib:
-                    quat = list(map(float, geom.get('quat').split()))
-                    if len(quat) == 4:
-                        local_euler = XMLParser._quat_to_euler(quat)
-                
-                # 解析颜色
-                color = [0.8, 0.8, 0.8, 1.0]  # 默认灰色
-                
-                # 优先使用rgba属性
-                if 'rgba' in geom.attrib:
-                    rgba_str = geom.get('rgba')
-                    rgba_values = list(map(float, rgba_str.split()))
-                    # 确保有四个值
-                    if len(rgba_values) == 3:
-                        rgba_values.append(1.0)  # 添加alpha默认值
-                    elif len(rgba_values) < 3:
-                        rgba_values = [0.8, 0.8, 0.8, 1.0]  # 默认灰色
-                    color = rgba_values
-                # 检查是否引用了material
-                elif 'material' in geom.attrib:
-                    material_name = geom.get('material')
-                    # 尝试在asset下找到对应的material
-                    material_elem = root.find(f".//asset/material[@name='{material_name}']")
-                    if material_elem is not None and 'rgba' in material_elem.attrib:
-                        rgba_str = material_elem.get('rgba')
-                        color = list(map(float, rgba_str.split()))
-                        if len(color) == 3:
-                            color.append(1.0)  # 添加默认透明度
-                
-                # 创建几何体
-                geo = Geometry(
-                    geo_type=geo_type,
-                    name=geom_name,
-                    position=local_pos,
-                    size=size,
-                    rotation=local_euler,
-                    parent=group
-                )
-                
-                # 设置颜色
-                geo.material.color = color
-                
-                # 确保变换矩阵被更新
-                if hasattr(geo, "update_transform_matrix"):
-                    geo.update_transform_matrix()
-                
-                # 添加到组中
-                group.add_child(geo)
-        
-        # 在返回前进行一次全面的变换矩阵更新
-        # 先确保所有父子关系已经建立
-        for body_name, parent_name in parent_map.items():
-            if body_name in body_groups and parent_name in body_groups:
-                child_group = body_groups[body_name]
-                parent_group = body_groups[parent_name]
-                
-                # 避免重复添加
-                if child_group not in parent_group.children:
-                    parent_group.add_child(child_group)
-        
-        # 收集所有顶层组（没有父组的组）
-        top_level_groups = []
-        for name, group in body_groups.items():
-            if name not in parent_map:  # 没有父组
-                top_level_groups.append(group)
-        
-        # 如果找到了顶层组，将它们添加到geometries
-        if top_level_groups:
-            geometries.extend(top_level_groups)
-        
-        # 处理worldbody下的直接geom
-        world_body = root.find(".//worldbody")
-        if world_body is not None:
-            # 创建一个世界组来容纳直接的几何体
-            world_group = None
-            
-            for geom in world_body.findall("geom"):
-                # 排除参考平面和坐标轴
-                geom_name = geom.get('name', '')
-                if geom_name in ["ground", "x_axis", "y_axis", "z_axis"]:
-                    continue
-                
-                # 如果还没有创建世界组并且找到有效几何体，创建一个世界组
-                if world_group is None:
-                    world_group = GeometryGroup(name="World")
-                    geometries.append(world_group)
-                
-                geo_type = geom.get('type', 'box')
-                pos = list(map(float, geom.get('pos', '0 0 0').split()))
-                size_str = geom.get('size', '1 1 1')
-                size = list(map(float, size_str.split()))
-                
-                # 根据类型调整尺寸格式
-                if geo_type == 'sphere':
-                    if len(size) == 1:
-                        size = [size[0], size[0], size[0]]
-                elif geo_type in ['capsule', 'cylinder']:
-                    if len(size) < 2:
-                        size.append(1.0)
-                    if len(size) < 3:
-                        size.append(0)
-                elif len(size) < 3:
-                    size.extend([1.0] * (3 - len(size)))
-                
-                # 解析旋转
-                euler = [0, 0, 0]
-                if 'euler' in geom.attrib:
-                    euler = list(map(float, geom.get('euler').split()))
-                elif 'quat' in geom.attrib:
-                    quat = list(map(float, geom.get('quat').split()))
-                    if len(quat) == 4:
-                        euler = XMLParser._quat_to_euler(quat)
-                
-                # 解析颜色
-                color = [0.8, 0.8, 0.8, 1.0]  # 默认灰色
-                
-                if 'rgba' in geom.attrib:
-                    rgba_str = geom.get('rgba')
-                    rgba_values = list(map(float, rgba_str.split()))
-                    if len(rgba_values) >= 3:
-                        color = rgba_values
-                        if len(color) == 3:
-                            color.append(1.0)  # 添加alpha默认值
-                
-                # 创建几何体
-                geo = Geometry(
-                    geo_type=geo_type,
-                    name=geom_name or "Object",
-                    position=pos,
-                    size=size,
-                    rotation=euler,
-                    parent=world_group
-                )
-                
-                # 设置材质
-                geo.material.color = color
-                
-                # 确保变换矩阵被更新
-                if hasattr(geo, "update_transform_matrix"):
-                    geo.update_transform_matrix()
-                
-                if world_group is not None:
-                    world_group.add_child(geo)
-                else:
-                    geometries.append(geo)
+        # 使用四元数表示旋转的节点，遍历结束后统一批量转换为欧拉角
+        pending_quats = []
+        
+        # 遍历body之前一次性建立资源索引并编译默认类
+        assets = AssetIndex(root)
+        defaults = DefaultClasses(root)
+        
+        # 顶层body
+        for world_body in world_bodies:
+            for body in world_body.findall("body"):
+                geometries.append(XMLParser._load_mujoco_body(body, assets, defaults, None, pending_quats))
+        
+        # 处理worldbody下的直接geom，放入一个世界组
+        world_group = None
+        for geom in (geom for world_body in world_bodies for geom in world_body.findall("geom")):
+            # 排除参考平面和坐标轴
+            geom_name = geom.get('name', '')
+            if geom_name in ["ground", "x_axis", "y_axis", "z_axis"]:
+                continue
+            
+            # 找到第一个有效几何体时再创建世界组
+            if world_group is None:
+                world_group = GeometryGroup(name="World")
+                geometries.append(world_group)
+            
+            attrs = defaults.resolve(geom)
+            geo = XMLParser._create_mujoco_geom(attrs, assets, world_group, geom_name or "Object", pending_quats)
+            world_group.add_child(geo)
         
-        # 最后，对所有对象进行两遍更新以确保变换正确传播
-        # 第一遍：更新所有对象的本地变换
-        XMLParser._update_transforms_recursive(geometries)
+        XMLParser._apply_pending_quats(pending_quats)
         
-        # 第二遍：确保世界变换正确传播
-        XMLParser._update_world_transforms_recursive(geometries)
+        # 最后，按层级批量计算所有对象的局部和世界变换
+        update_transforms_batch(geometries)
         
         return geometries
     
     @staticmethod
-    def _update_transforms_recursive(objects):
-        """递归更新所有几何体的变换矩阵"""
-        if isinstance(objects, list):
-            for obj in objects:
-                XMLParser._update_transforms_recursive(obj)
-        else:
-            # 更新当前对象的变换矩阵
-            if hasattr(objects, "update_transform_matrix"):
-                objects.update_transform_matrix()
+    def _load_mujoco_body(body, assets, defaults, parent, pending_quats):
+        """
+        创建body对应的组及其整个子树
+        
+        使用显式栈代替函数递归，深层嵌套的模型也不会超出Python的递归深度限制；
+        每个组的子节点仍按文档顺序添加。
+        
+        参数:
+            body: body元素
+            assets: 资源索引 AssetIndex
+            defaults: 默认类 DefaultClasses
+            parent: 父组，顶层body为None
+            pending_quats: 待批量转换的 (节点, 四元数) 列表
+            
+        返回:
+            GeometryGroup: 创建的组对象
+        """
+        top_group = XMLParser._create_mujoco_group(body, parent, pending_quats)
+        # 栈中同时记录body的 childclass，子元素未指定 class 时使用
+        stack = [(body, top_group, body.get('childclass'))]
+        
+        while stack:
+            body, group, childclass = stack.pop()
+            for child in body:
+                if child.tag == "geom":
+                    geom_name = child.get('name', f"{group.name}_geom")
+                    attrs = defaults.resolve(child, childclass)
+                    group.add_child(XMLParser._create_mujoco_geom(attrs, assets, group, geom_name, pending_quats))
+                elif child.tag == "body":
+                    child_group = XMLParser._create_mujoco_group(child, group, pending_quats)
+                    group.add_child(child_group)
+                    stack.append((child, child_group, child.get('childclass', childclass)))
+        
+        return top_group
+    
+    @staticmethod
+    def _create_mujoco_group(body, parent, pending_quats):
+        """
+        根据body元素创建组（不包含子节点）
+        
+        参数:
+            body: body元素
+            parent: 父组，顶层body为None
+            pending_quats: 待批量转换的 (节点, 四元数) 列表
             
-            # 如果是组，递归更新子对象
-            if hasattr(objects, "children") and objects.children:
-                for child in objects.children:
-                    XMLParser._update_transforms_recursive(child)
+        返回:
+            GeometryGroup: 创建的组对象
+        """
+        group = GeometryGroup(
+            name=body.get('name', 'Unnamed'),
+            position=XMLParser._parse_floats(body.get('pos'), [0, 0, 0]),
+            rotation=XMLParser._parse_floats(body.get('euler'), [0, 0, 0]),
+            parent=parent
+        )
+        XMLParser._collect_quat(body.attrib, group, pending_quats)
+        return group
     
     @staticmethod
-    def _update_world_transforms_recursive(objects):
-        """递归更新所有几何体的世界变换矩阵"""
-        if isinstance(objects, list):
-            for obj in objects:
-                XMLParser._update_world_transforms_recursive(obj)
-        else:
-            # 更新当前对象的全局变换
-            if hasattr(objects, "update_global_transform"):
-                objects.update_global_transform()
-            elif hasattr(objects, "update_transform_matrix"):
-                # 如果没有专门的全局变换更新方法，使用常规更新
-                objects.update_transform_matrix()
-            
-            # 如果是组，递归更新子对象
-            if hasattr(objects, "children") and objects.children:
-                for child in objects.children:
-                    XMLParser._update_world_transforms_recursive(child)
+    def _create_mujoco_geom(attrs, assets, parent, geom_name, pending_quats):
+        """
+        根据geom属性创建几何体
+        
+        参数:
+            attrs: 已应用默认类的geom属性，见 DefaultClasses.resolve
+            assets: 资源索引 AssetIndex
+            parent: 所属的组
+            geom_name: 几何体名称
+            pending_quats: 待批量转换的 (节点, 四元数) 列表
+            
+        返回:
+            Geometry: 创建的几何体
+        """
+        geo_type = attrs.get('type', 'box')
+        
+        # 解析尺寸
+        size = XMLParser._parse_floats(attrs.get('size'), [1, 1, 1])
+        
+        # 适当地处理尺寸格式
+        if geo_type == 'sphere':
+            if len(size) == 1:
+                size = [size[0], size[0], size[0]]  # 保持三个相同的半径值
+        elif geo_type == 'ellipsoid':
+            # 确保有三个尺寸
+            if len(size) < 3:
+                size.extend([size[0]] * (3 - len(size)))
+        elif geo_type in ['capsule', 'cylinder']:
+            # 确保有两个尺寸
+            if len(size) < 2:
+                size.append(1.0)  # 默认半高
+            if len(size) < 3:
+                size.append(0)  # 补充第三个参数
+        elif len(size) < 3:
+            size.extend([1.0] * (3 - len(size)))
+        
+        # 解析位置（相对于body的局部坐标）
+        local_pos = XMLParser._parse_floats(attrs.get('pos'), [0, 0, 0])
+        
+        # 解析旋转，四元数在遍历结束后批量转换
+        local_euler = XMLParser._parse_floats(attrs.get('euler'), [0, 0, 0])
+        
+        # 解析颜色
+        color = [0.8, 0.8, 0.8, 1.0]  # 默认灰色
+        
+        # 优先使用rgba属性
+        if 'rgba' in attrs:
+            rgba_values = XMLParser._parse_floats(attrs.get('rgba'), color)
+            # 确保有四个值
+            if len(rgba_values) == 3:
+                rgba_values.append(1.0)  # 添加alpha默认值
+            elif len(rgba_values) < 3:
+                rgba_values = [0.8, 0.8, 0.8, 1.0]  # 默认灰色
+            color = rgba_values
+        # 检查是否引用了material
+        elif 'material' in attrs:
+            # 通过资源索引解析材质颜色
+            material_rgba = assets.material_rgba(attrs.get('material'))
+            if material_rgba is not None:
+                color = material_rgba
+        
+        # 创建几何体
+        geo = Geometry(
+            geo_type=geo_type,
+            name=geom_name,
+            position=local_pos,
+            size=size,
+            rotation=local_euler,
+            parent=parent
+        )
+        
+        # 设置颜色
+        geo.material.color = color
+        
+        XMLParser._collect_quat(attrs, geo, pending_quats)
+        
+        return geo
+    
+    @staticmethod
+    def _collect_quat(attrs, node, pending_quats):
+        """记录属性中的四元数旋转，留待批量转换"""
+        if 'quat' in attrs and 'euler' not in attrs:
+            quat = XMLParser._parse_floats(attrs.get('quat'), [])
+            if len(quat) == 4:
+                pending_quats.append((node, quat))
+    
+    @staticmethod
+    def _apply_pending_quats(pending_quats):
+        """批量转换记录下来的四元数，并写入对应节点的旋转"""
+        if not pending_quats:
+            return
+        nodes, quats = zip(*pending_quats)
+        eulers = XMLParser._quats_to_eulers(np.array(quats, dtype=np.float64))
+        for node, euler in zip(nodes, eulers):
+            node.rotation = euler
+    
+    @staticmethod
+    def _parse_floats(text, default):
+        """
+        解析以空白分隔的数值属性
+        
+        参数:
+            text: 属性字符串，可以为None
+            default: 属性缺失时的默认值
+            
+        返回:
+            list: 浮点数列表（默认值会被复制，调用方可以安全修改）
+        """
+        if text is None:
+            return list(default)
+        return [float(v) for v in text.split()]
+    
+    # 导出时每批格式化的节点数量
+    EXPORT_CHUNK_SIZE = 4096
     
     @staticmethod
-    def export_mujoco_xml(filename, geometries):
+    def export_mujoco_xml(filename, geometries, precision=6, cache=None):
         """
         导出场景为MuJoCo XML格式
         
+        遍历场景图时直接把带缩进的MJCF写入带缓冲的文件，不再构建ElementTree和minidom，
+        额外内存只与单批节点数量有关。
+        
         参数:
             filename: 保存文件路径
             geometries: 几何体对象列表
+            precision: 数值属性保留的有效数字位数
+            cache: 可选的片段缓存字典，由调用方在多次保存之间持有。提供时每个顶层对象的
+                   XML片段按子树修订号缓存，只有修改过的子树会重新生成
             
         返回:
             bool: 是否成功导出
         """
         try:
-            # 创建MuJoCo XML根节点
-            root = ET.Element("mujoco")
-            root.set("model", "MJCFScene")
-            
-            # 添加编译器选项
-            compiler = ET.SubElement(root, "compiler")
-            compiler.set("angle", "degree")  # 使用角度而不是弧度
-            
-            # 创建资源部分
-            asset = ET.SubElement(root, "asset")
-            
-            # 创建世界体
-            worldbody = ET.SubElement(root, "worldbody")
-            
-            # 递归添加几何体
-            for obj in geometries:
-                XMLParser._add_object_to_mujoco(worldbody, obj)
-            
-            # 创建并格式化XML树
-            tree = ET.ElementTree(root)
-            
-            # 使用minidom格式化XML
-            from xml.dom import minidom
-            rough_string = ET.tostring(root, 'utf-8')
-            reparsed = minidom.parseString(rough_string)
-            pretty_xml = reparsed.toprettyxml(indent="  ")
-            
-            # 写入文件
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(pretty_xml)
-            
+            with open(filename, 'w', encoding='utf-8', buffering=1 << 20) as f:
+                XMLParser._write_mujoco_xml(f.write, geometries, precision, cache)
             return True
         except Exception as e:
             print(f"导出MuJoCo XML时出错: {e}")
             return False
     
     @staticmethod
-    def _add_object_to_mujoco(parent_elem, obj, prefix=""):
-        """递归添加对象到MuJoCo XML"""
-        if obj.type == "group":
-            # 处理组 -> body
-            body_elem = ET.SubElement(parent_elem, "body")
-            body_elem.set("name", f"{prefix}{obj.name}")
+    def _write_mujoco_xml(write, geometries, precision, cache=None):
+        """
+        输出完整的MJCF文档
+        
+        参数:
+            write: 写入字符串的函数
+            geometries: 几何体对象列表
+            precision: 数值属性保留的有效数字位数
+            cache: 可选的片段缓存字典，见 export_mujoco_xml
+        """
+        write('<?xml version="1.0" encoding="utf-8"?>\n')
+        write('<mujoco model="MJCFScene">\n')
+        # 使用角度而不是弧度
+        write('  <compiler angle="degree"/>\n')
+        write('  <asset/>\n')
+        
+        if not geometries:
+            write('  <worldbody/>\n')
+        else:
+            write('  <worldbody>\n')
+            for obj in geometries:
+                if cache is None:
+                    XMLParser._write_mujoco_subtree(write, obj, 2, precision)
+                else:
+                    write(XMLParser._render_cached_subtree(obj, precision, cache))
+            write('  </worldbody>\n')
+        
+        if cache is not None:
+            # 丢弃已经不在场景顶层的对象的缓存
+            alive = {id(obj) for obj in geometries}
+            for key in [key for key in cache if key not in alive]:
+                del cache[key]
+        
+        write('</mujoco>\n')
+    
+    @staticmethod
+    def _write_mujoco_subtree(write, obj, depth, precision):
+        """
+        输出一个对象及其子树
+        
+        节点按批收集，每批的数值属性一次性取出并格式化后再写入。
+        
+        参数:
+            write: 写入字符串的函数
+            obj: 子树的根对象
+            depth: 根对象的缩进层级
+            precision: 数值属性保留的有效数字位数
+        """
+        events = []
+        for event in XMLParser._iter_mujoco_events(obj, depth):
+            events.append(event)
+            if len(events) >= XMLParser.EXPORT_CHUNK_SIZE:
+                write(XMLParser._format_mujoco_events(events, precision))
+                events = []
+        if events:
+            write(XMLParser._format_mujoco_events(events, precision))
+    
+    @staticmethod
+    def _render_cached_subtree(obj, precision, cache):
+        """
+        获取顶层对象的XML片段，子树未修改时直接使用缓存
+        
+        参数:
+            obj: 顶层对象
+            precision: 数值属性保留的有效数字位数
+            cache: 片段缓存字典，id(对象) -> (对象, (修订号, 精度), 片段)
+            
+        返回:
+            str: 子树的XML片段
+        """
+        key = (obj.revision, precision)
+        entry = cache.get(id(obj))
+        if entry is not None and entry[0] is obj and entry[1] == key:
+            return entry[2]
+        
+        parts = []
+        XMLParser._write_mujoco_subtree(parts.append, obj, 2, precision)
+        fragment = "".join(parts)
+        cache[id(obj)] = (obj, key, fragment)
+        return fragment
+    
+    @staticmethod
+    def _iter_mujoco_events(obj, depth, prefix=""):
+        """
+        先序遍历子树，生成输出事件
+        
+        组的子对象名称带上组名前缀，与之前的导出结果保持一致。
+        
+        参数:
+            obj: 子树的根对象
+            depth: 根对象的缩进层级
+            prefix: 名称前缀
+            
+        返回:
+            生成器，元素为 (节点, 缩进层级, 完整名称, 是否有子节点)；
+            节点为None表示关闭一个body
+        """
+        stack = [(obj, depth, prefix)]
+        while stack:
+            node, depth, prefix = stack.pop()
+            if node is None:
+                yield None, depth, None, False
+                continue
+            
+            name = f"{prefix}{node.name}"
+            if node.type == "group" and node.children:
+                yield node, depth, name, True
+                stack.append((None, depth, None))
+                child_prefix = f"{name}_"
+                stack.extend((child, depth + 1, child_prefix) for child in reversed(node.children))
+            else:
+                yield node, depth, name, False
+    
+    @staticmethod
+    def _format_mujoco_events(events, precision):
+        """
+        把一批输出事件格式化为MJCF文本
+        
+        参数:
+            events: _iter_mujoco_events 生成的事件列表
+            precision: 数值属性保留的有效数字位数
             
-            # 设置位置
-            body_elem.set("pos", f"{obj.position[0]} {obj.position[1]} {obj.position[2]}")
+        返回:
+            str: 格式化后的文本
+        """
+        # 一次性取出整批节点的数值，并按统一精度批量格式化
+        nodes = [node for node, _, _, _ in events if node is not None]
+        fmt = f"%.{precision}g"
+        fmt3 = f"{fmt} {fmt} {fmt}"
+        if nodes:
+            positions = XMLParser._format_rows(fmt3, gather_array(nodes, 'position', lambda n: n.position))
+            rotation_array = gather_array(nodes, 'rotation', lambda n: n.rotation)
+            rotations = XMLParser._format_rows(fmt3, rotation_array)
+            has_rotation = rotation_array.any(axis=1).tolist()
+            # 尺寸按分量格式化，再根据类型选择需要的分量
+            size_values = XMLParser._format_rows(fmt, gather_array(nodes, 'size', lambda n: n.size).reshape(-1, 1))
+            colors = XMLParser._format_rows(f"{fmt3} {fmt}", gather_array(nodes, 'color', lambda n: n.material.color))
+        
+        sphere = GeometryType.SPHERE.value
+        cylinder_like = (GeometryType.CYLINDER.value, GeometryType.CAPSULE.value)
+        
+        lines = []
+        index = 0
+        for node, depth, name, has_children in events:
+            indent = "  " * depth
+            if node is None:
+                lines.append(f"{indent}</body>\n")
+                continue
             
+            i = index
+            index += 1
             # 设置旋转（使用欧拉角）
-            if any(obj.rotation):
-                body_elem.set("euler", f"{obj.rotation[0]} {obj.rotation[1]} {obj.rotation[2]}")
+            euler = f' euler="{rotations[i]}"' if has_rotation[i] else ""
             
-            # 递归处理子对象
-            for child in obj.children:
-                XMLParser._add_object_to_mujoco(body_elem, child, prefix=f"{prefix}{obj.name}_")
-        else:
-            # 处理几何体 -> geom
-            geom_elem = ET.SubElement(parent_elem, "geom")
-            geom_elem.set("name", f"{prefix}{obj.name}")
-            geom_elem.set("type", obj.type)
+            if node.type == "group":
+                # 处理组 -> body
+                end = ">\n" if has_children else "/>\n"
+                lines.append(f'{indent}<body name={XMLParser._quote_attr(name)} pos="{positions[i]}"{euler}{end}')
+                continue
             
-            # 根据几何体类型设置尺寸
-            if obj.type == GeometryType.SPHERE.value:
+            # 处理几何体 -> geom，根据几何体类型设置尺寸
+            if node.type == sphere:
                 # 球体：只使用第一个尺寸作为半径
-                geom_elem.set("size", f"{obj.size[0]}")
-            elif obj.type in [GeometryType.CYLINDER.value, GeometryType.CAPSULE.value]:
+                size_str = size_values[3 * i]
+            elif node.type in cylinder_like:
                 # 圆柱/胶囊：第一个尺寸为半径，第三个尺寸为半高
-                geom_elem.set("size", f"{obj.size[0]} {obj.size[2]}")
-            elif obj.type == "plane":
+                size_str = f"{size_values[3 * i]} {size_values[3 * i + 2]}"
+            elif node.type == "plane":
                 # 平面：使用固定尺寸 0 0 0.01
-                geom_elem.set("size", "0 0 0.01")
+                size_str = "0 0 0.01"
             else:
                 # 其他几何体：使用所有尺寸
-                geom_elem.set("size", f"{obj.size[0]} {obj.size[1]} {obj.size[2]}")
-            
-            # 设置位置
-            geom_elem.set("pos", f"{obj.position[0]} {obj.position[1]} {obj.position[2]}")
+                size_str = " ".join(size_values[3 * i:3 * i + 3])
             
-            # 设置旋转（使用欧拉角）
-            if any(obj.rotation):
-                geom_elem.set("euler", f"{obj.rotation[0]} {obj.rotation[1]} {obj.rotation[2]}")
-            
-            # 设置颜色
-            geom_elem.set("rgba", f"{obj.material.color[0]} {obj.material.color[1]} {obj.material.color[2]} {obj.material.color[3]}")
+            lines.append(f'{indent}<geom name={XMLParser._quote_attr(name)} '
+                         f'type={XMLParser._quote_attr(str(node.type))} size="{size_str}" '
+                         f'pos="{positions[i]}"{euler} rgba="{colors[i]}"/>\n')
+        
+        return "".join(lines)
     
     @staticmethod
-    def _quat_to_euler(quat):
-        """四元数转欧拉角（ZYX顺序）"""
-        # 实现四元数到欧拉角的转换
-        # 这里使用简化的计算方法
-        w, x, y, z = quat
+    def _format_rows(row_format, array):
+        """
+        批量格式化数值数组
         
-        # 计算姿态角
-        t0 = 2.0 * (w * x + y * z)
-        t1 = 1.0 - 2.0 * (x * x + y * y)
-        roll = np.degrees(np.arctan2(t0, t1))
+        把整批数值拼成一个格式串，一次 % 运算完成格式化后再按行拆分。
         
-        t2 = 2.0 * (w * y - z * x)
-        t2 = np.clip(t2, -1.0, 1.0)
-        pitch = np.degrees(np.arcsin(t2))
+        参数:
+            row_format: 单行的格式串，如 "%.6g %.6g %.6g"
+            array: 形状为 (N, M) 的数组，M与格式串中的字段数一致
+            
+        返回:
+            list: N个格式化后的字符串
+        """
+        if len(array) == 0:
+            return []
+        values = tuple(np.asarray(array, dtype=np.float64).ravel().tolist())
+        return ("\0".join([row_format] * len(array)) % values).split("\0")
+    
+    @staticmethod
+    def _quote_attr(value):
+        """转义并加引号的属性值，绝大多数名称不含特殊字符，直接拼接"""
+        if '&' in value or '<' in value or '>' in value or '"' in value or '\n' in value:
+            return quoteattr(value)
+        return f'"{value}"'
+    
+    @staticmethod
+    def _quat_to_euler(quat):
+        """
+        四元数转欧拉角
         
-        t3 = 2.0 * (w * z + x * y)
-        t4 = 1.0 - 2.0 * (y * y + z * z)
-        yaw = np.degrees(np.arctan2(t3, t4))
+        参数:
+            quat: MuJoCo顺序的四元数 (w, x, y, z)
+            
+        返回:
+            list: 与 Geometry.rotation 一致的内旋XYZ欧拉角（角度制）
+        """
+        return XMLParser._quats_to_eulers([quat])[0].tolist()
+    
+    @staticmethod
+    def _quats_to_eulers(quats):
+        """
+        批量将四元数转换为欧拉角
         
-        return [roll, pitch, yaw]
+        参数:
+            quats: 形状为 (N, 4) 的四元数数组，顺序为 (w, x, y, z)
+            
+        返回:
+            np.ndarray: 形状为 (N, 3) 的欧拉角数组（角度制）
+        """
+        return matrix_to_euler_batch(quat_to_matrix_batch(quats))
     
     
     # 保存方法别名，使用增强XML格式
@@ -7,7 +7,8 @@
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
                           QGroupBox, QRadioButton, QComboBox, QLabel, 
                           QButtonGroup, QToolButton, QGridLayout, QFileDialog, QMessageBox,
-                          QDialog, QListWidget, QListWidgetItem, QAbstractItemView, QApplication)
+                          QDialog, QListWidget, QListWidgetItem, QAbstractItemView, QApplication,
+                          QSlider)
 from PyQt5.QtCore import Qt, QMimeData, QSize
 from PyQt5.QtGui import QDrag, QPixmap, QIcon
 import os
@@ -78,10 +79,48 @@ class ControlPanel(QWidget):
         # 添加到主布局
         main_layout.addWidget(save_group)
         
+        # 创建历史时间线组
+        self._create_history_tools(main_layout)
+        
         # 连接视图模型的信号
         self._control_viewmodel.saveStateCompleted.connect(self.on_save_completed)
         self._control_viewmodel.loadStateCompleted.connect(self.on_load_completed)
     
+    def _create_history_tools(self, parent_layout):
+        """
+        创建历史时间线组，拖动滑块可以直接跳转到任意一步
+        
+        参数:
+            parent_layout: 父布局
+        """
+        history_group = QGroupBox("历史记录")
+        history_layout = QVBoxLayout(history_group)
+        
+        self._history_slider = QSlider(Qt.Horizontal)
+        self._history_slider.setToolTip("拖动以回到历史中的任意一步")
+        self._history_slider.valueChanged.connect(self._on_history_slider_changed)
+        history_layout.addWidget(self._history_slider)
+        
+        self._history_label = QLabel()
+        history_layout.addWidget(self._history_label)
+        
+        parent_layout.addWidget(history_group)
+        
+        self._control_viewmodel.historyChanged.connect(self._update_history_slider)
+        self._update_history_slider(*self._control_viewmodel.history_range())
+    
+    def _update_history_slider(self, first_step, last_step, current_step):
+        """根据时间线范围更新滑块，不触发跳转"""
+        self._history_slider.blockSignals(True)
+        self._history_slider.setRange(first_step, last_step)
+        self._history_slider.setValue(current_step)
+        self._history_slider.blockSignals(False)
+        self._history_label.setText(f"步骤 {current_step} / {last_step}")
+    
+    def _on_history_slider_changed(self, step):
+        """滑块拖动时跳转到对应的步骤"""
+        self._control_viewmodel.jump_to_step(step)
+    
     def _create_operation_tools(self, parent_layout):
         """
         创建操作工具组
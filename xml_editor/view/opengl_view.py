@@ -15,8 +15,8 @@ from OpenGL.GLUT import *  # 添加GLUT库导入
 
 from ..model.geometry import GeometryType, OperationMode
 from ..viewmodel.scene_viewmodel import SceneViewModel
-from ..model.raycaster import GeometryRaycaster, RaycastResult
-from ..model.geometry import Geometry
+from ..model.raycaster import intersect_box_batch
+from ..model.bvh import shape_half_extents
 
 # 在文件顶部添加导入语句
 from scipy.spatial.transform import Rotation as R
@@ -28,6 +28,62 @@ except Exception as e:
     print(f"警告: 无法初始化GLUT: {e}")
     raise e
 
+
+def _controller_handles(shaft_length, tip_center, tip_half_length, tip_half_width):
+    """
+    构建变换控制器三个轴的拾取代理
+
+    每个轴由轴杆和末端手柄两个轴对齐盒子组成，尺寸与绘制的控制器一致。
+
+    参数:
+        shaft_length: 轴杆长度
+        tip_center: 末端手柄中心到原点的距离
+        tip_half_length: 末端手柄沿轴方向的半长
+        tip_half_width: 末端手柄垂直于轴方向的半宽
+
+    返回:
+        tuple: (轴名列表, 形状为 (6, 3) 的盒子中心, 形状为 (6, 3) 的盒子半尺寸)
+    """
+    axes, centers, half_sizes = [], [], []
+    for index, axis in enumerate('xyz'):
+        shaft_center = np.zeros(3)
+        shaft_center[index] = shaft_length / 2
+        shaft_half = np.full(3, _CONTROLLER_SHAFT_HALF_WIDTH)
+        shaft_half[index] = shaft_length / 2
+
+        tip_center_point = np.zeros(3)
+        tip_center_point[index] = tip_center
+        tip_half = np.full(3, tip_half_width)
+        tip_half[index] = tip_half_length
+
+        axes += [axis, axis]
+        centers += [shaft_center, tip_center_point]
+        half_sizes += [shaft_half, tip_half]
+    return axes, np.array(centers), np.array(half_sizes)
+
+
+# 控制器轴杆的拾取半宽
+_CONTROLLER_SHAFT_HALF_WIDTH = 0.05
+
+# 各操作模式下控制器手柄在控制器坐标系中的静态拾取代理
+_CONTROLLER_HANDLES = {
+    # 轴杆 0~2，箭头圆锥位于 2~2.3，半径 0.1
+    OperationMode.TRANSLATE: _controller_handles(2.0, 2.15, 0.15, 0.1),
+    OperationMode.ROTATE: _controller_handles(2.0, 2.15, 0.15, 0.1),
+    # 轴杆 0~1.5，立方体手柄中心位于 1.5，半边长 0.2
+    OperationMode.SCALE: _controller_handles(1.5, 1.5, 0.2, 0.2),
+}
+
+# 拖放创建几何体时各类型的默认尺寸
+_DEFAULT_DROP_SIZES = {
+    GeometryType.BOX: (0.5, 0.5, 0.5),
+    GeometryType.SPHERE: (0.5, 0.5, 0.5),
+    GeometryType.CYLINDER: (0.5, 0.5, 0.5),
+    GeometryType.PLANE: (1.0, 0.01, 1.0),
+    GeometryType.CAPSULE: (0.5, 0.5, 0.5),
+    GeometryType.ELLIPSOID: (0.5, 0.3, 0.5)
+}
+
 class OpenGLView(QOpenGLWidget):
     """
     OpenGL视图类
@@ -80,18 +136,23 @@ class OpenGLView(QOpenGLWidget):
         # 捕获焦点
         self.setFocusPolicy(Qt.StrongFocus)
         
+        # 始终跟踪鼠标移动，用于变换控制器的悬停高亮
+        self.setMouseTracking(True)
+        
         # 变换控制器状态
         self._dragging_controller = False
         self._controller_axis = None  # 'x', 'y', 'z' 或 None
         self._drag_start_pos = None
         self._drag_start_value = None
         
+        # 框选状态（Shift+左键拖动），起点和当前点为屏幕坐标
+        self._marquee_start = None
+        self._marquee_end = None
+        
         # 坐标系选择 (True: 局部坐标系, False: 全局坐标系)
         self._use_local_coords = True
 
         # 射线投射器
-        self._controllor_raycaster = None
-        self._controller_geometries = []
         
         # 启用拖拽功能
         self.setAcceptDrops(True)
@@ -175,6 +236,10 @@ class OpenGLView(QOpenGLWidget):
             glDisable(GL_DEPTH_TEST)
             self._draw_drag_preview()
             glEnable(GL_DEPTH_TEST)
+        
+        # 框选矩形绘制在最上层
+        if self._marquee_start is not None and self._marquee_end is not None:
+            self._draw_marquee()
     
     def _update_projection(self, width, height):
         """更新投影矩阵"""
@@ -307,10 +372,9 @@ class OpenGLView(QOpenGLWidget):
         # 保存当前矩阵
         glPushMatrix()
 
-        # 应用几何体的变换
+        # 应用几何体的变换（读取缓存的世界矩阵，只有失效时才会重新计算）
         if hasattr(geometry, 'transform_matrix'):
             # 将NumPy矩阵转换为OpenGL兼容的格式
-            geometry.update_transform_matrix()
             geom_transform = geometry.transform_matrix.T.flatten().tolist()
             glMultMatrixf(geom_transform)
         
@@ -780,30 +844,26 @@ class OpenGLView(QOpenGLWidget):
                 self._drag_start_pos = event.pos()
                 self._drag_start_value = None  # 将在首次拖动时设置
                 
+                # 整个拖动在历史记录中作为一步，松开鼠标时结束
+                self._scene_viewmodel.begin_gesture()
+                
                 # 强制重绘以显示高亮效果
                 self.update()
                 return
         
-        # 选择或取消选择对象
+        # Shift+左键拖动开始框选
+        if event.button() == Qt.LeftButton and event.modifiers() & Qt.ShiftModifier:
+            self._marquee_start = event.pos()
+            self._marquee_end = event.pos()
+            self.mousePressed.emit(event)
+            return
+        
+        # 选择或取消选择对象：在同一位置重复点击依次选中层叠的几何体，最后一个之后清除选择
         if event.button() == Qt.LeftButton:
-            # 获取当前鼠标位置的几何体
-            clicked_geo = self._scene_viewmodel.get_geometry_at(event.x(), event.y(), self.width(), self.height())
-            
-            # 如果点击的是当前已选中的几何体，则取消选择
-            if clicked_geo == self._scene_viewmodel.selected_geometry:
-                self._scene_viewmodel.clear_selection()
-            # 否则，选择点击的几何体
-            elif clicked_geo:
-                self._scene_viewmodel.selected_geometry = clicked_geo
-            # 如果没有点击到任何几何体，清除选择
-            else:
-                self._scene_viewmodel.clear_selection()
+            self._scene_viewmodel.cycle_selection_at(event.x(), event.y(), self.width(), self.height())
         
         # 发出信号
         self.mousePressed.emit(event)
-        
-        # 接收后续的鼠标移动事件
-        self.setMouseTracking(True)
     
     def mouseReleaseEvent(self, event):
         """处理鼠标释放事件"""
@@ -828,15 +888,16 @@ class OpenGLView(QOpenGLWidget):
                 
                 # 通知对象发生变化
                 self._scene_viewmodel.notify_object_changed(selected_geo)
-                
-                # 在拖动完成后触发状态记录（仅当有实际变化时）
-                if hasattr(self._scene_viewmodel, 'control_viewmodel'):
-                    self._scene_viewmodel.control_viewmodel._on_geometry_modified()
         
         self._is_mouse_pressed = False
         
-        # 重置变换控制器状态
+        # 结束框选
+        if self._marquee_start is not None:
+            self._finish_marquee(event.pos())
+        
+        # 重置变换控制器状态，结束拖动操作（有实际变化时记录为一步）
         if self._dragging_controller:
+            self._scene_viewmodel.end_gesture()
             self._dragging_controller = False
             self._controller_axis = None
             self._drag_start_pos = None
@@ -848,8 +909,8 @@ class OpenGLView(QOpenGLWidget):
         # 发出信号
         self.mouseReleased.emit(event)
         
-        # 不再跟踪鼠标移动
-        self.setMouseTracking(False)
+        # 释放后立即按当前位置刷新悬停高亮
+        self._update_controller_hover(event.x(), event.y())
     
     def mouseMoveEvent(self, event):
         """处理鼠标移动事件"""
@@ -873,6 +934,10 @@ class OpenGLView(QOpenGLWidget):
                 
                 # 强制更新界面
                 self.update()
+        # 框选中只更新选框
+        elif self._marquee_start is not None:
+            self._marquee_end = event.pos()
+            self.update()
         # 如果鼠标按下，根据当前模式执行不同操作
         elif self._is_mouse_pressed:
             # 处理摄像机旋转（左键拖动）
@@ -911,6 +976,9 @@ class OpenGLView(QOpenGLWidget):
                 self._camera_target -= world_up * dy * 0.01 * self._camera_distance
                 
                 self.update()
+        # 未按下鼠标时检测控制器悬停
+        else:
+            self._update_controller_hover(event.x(), event.y())
         
         # 更新鼠标位置
         self._last_mouse_pos = event.pos()
@@ -918,6 +986,33 @@ class OpenGLView(QOpenGLWidget):
         # 发出信号
         self.mouseMoved.emit(event)
     
+    def leaveEvent(self, event):
+        """鼠标离开视图时取消控制器悬停高亮"""
+        self._update_controller_hover(None, None)
+        super().leaveEvent(event)
+    
+    def _update_controller_hover(self, screen_x, screen_y):
+        """
+        根据鼠标位置更新变换控制器的悬停高亮轴
+
+        只在悬停轴发生变化时重绘，鼠标在场景中移动不会触发额外的渲染。
+
+        参数:
+            screen_x: 屏幕X坐标，为None表示鼠标不在视图内
+            screen_y: 屏幕Y坐标
+        """
+        # 拖动控制器时保持拖动轴的高亮
+        if self._dragging_controller:
+            return
+        
+        axis = None
+        if screen_x is not None:
+            axis = self._pick_controller(screen_x, screen_y, just_hover=True)
+        
+        if axis != self._controller_axis:
+            self._controller_axis = axis
+            self.update()
+    
     def wheelEvent(self, event):
         """处理鼠标滚轮事件"""
         # 更新摄像机距离
@@ -955,7 +1050,6 @@ class OpenGLView(QOpenGLWidget):
                 parent_window.statusBar().showMessage(f"当前模式: {coord_system}", 2000)
             
             # 更新控制器显示
-            self._update_controllor_raycaster()
             self.update()
             
             print(f"坐标系已切换为: {'局部坐标系' if self._use_local_coords else '全局坐标系'}")
@@ -973,6 +1067,82 @@ class OpenGLView(QOpenGLWidget):
         if event.key() == Qt.Key_Shift:
             self._is_shift_pressed = False
     
+    def _finish_marquee(self, end_pos):
+        """
+        结束框选并选择选框内的几何体
+
+        从左向右拖动时只选择完全落在选框内的几何体，从右向左拖动时选择与选框相交的几何体。
+
+        参数:
+            end_pos: 选框终点的屏幕坐标
+        """
+        start = self._marquee_start
+        self._marquee_start = None
+        self._marquee_end = None
+        self.update()
+
+        # 几乎没有拖动时视为单击空白处，不改变选择
+        if abs(end_pos.x() - start.x()) < 3 and abs(end_pos.y() - start.y()) < 3:
+            return
+
+        contain = end_pos.x() >= start.x()
+        geometries = self._scene_viewmodel.get_geometries_in_rect(
+            start.x(), start.y(), end_pos.x(), end_pos.y(), self.width(), self.height(), contain)
+
+        hierarchy_viewmodel = getattr(self._scene_viewmodel, 'hierarchyViewModel', None)
+        if hierarchy_viewmodel:
+            hierarchy_viewmodel.select_geometries(geometries)
+        else:
+            self._scene_viewmodel.selected_geometry = geometries[-1] if geometries else None
+
+        parent_window = self.window()
+        if hasattr(parent_window, 'statusBar'):
+            parent_window.statusBar().showMessage(f"框选了 {len(geometries)} 个对象", 2000)
+
+    def _draw_marquee(self):
+        """在屏幕空间绘制框选矩形"""
+        x0, y0 = self._marquee_start.x(), self._marquee_start.y()
+        x1, y1 = self._marquee_end.x(), self._marquee_end.y()
+
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        # 与Qt的屏幕坐标一致：原点在左上角，Y轴向下
+        glOrtho(0, self.width(), self.height(), 0, -1, 1)
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+        glDisable(GL_DEPTH_TEST)
+        glDisable(GL_LIGHTING)
+
+        # 半透明填充，包含模式为蓝色，相交模式为绿色
+        if x1 >= x0:
+            glColor4f(0.3, 0.5, 1.0, 0.15)
+        else:
+            glColor4f(0.3, 1.0, 0.5, 0.15)
+        glBegin(GL_QUADS)
+        glVertex2f(x0, y0)
+        glVertex2f(x1, y0)
+        glVertex2f(x1, y1)
+        glVertex2f(x0, y1)
+        glEnd()
+
+        glColor4f(1.0, 1.0, 1.0, 0.8)
+        glLineWidth(1.0)
+        glBegin(GL_LINE_LOOP)
+        glVertex2f(x0, y0)
+        glVertex2f(x1, y0)
+        glVertex2f(x1, y1)
+        glVertex2f(x0, y1)
+        glEnd()
+
+        glEnable(GL_LIGHTING)
+        glEnable(GL_DEPTH_TEST)
+        glPopMatrix()
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+
     def reset_camera(self):
         """重置摄像机到默认位置"""
         self._camera_distance = 10.0
@@ -983,370 +1153,109 @@ class OpenGLView(QOpenGLWidget):
     
     def _on_selection_changed(self, selected_object):
         """处理选中对象变化事件"""
-        self._update_controllor_raycaster()
+        self._clear_controller_hover()
         self.update()
 
     def _on_object_changed(self, obj):
         """处理对象属性变化事件"""
-        if obj == self._scene_viewmodel.selected_geometry:
-            self._update_controllor_raycaster()
         self.update()
 
     def _on_operation_mode_changed(self, mode):
         """处理操作模式变化事件"""
-        self._update_controllor_raycaster()
+        self._clear_controller_hover()
         self.update()
 
-    def _update_controllor_raycaster(self):
-        """更新控制器射线投射器"""
+    def _clear_controller_hover(self):
+        """控制器形状或位置改变后清除悬停高亮，等待下一次鼠标移动重新检测"""
+        if not self._dragging_controller:
+            self._controller_axis = None
+
+    def _controller_frame(self):
+        """
+        获取变换控制器所在坐标系的变换矩阵
+
+        返回:
+            np.ndarray: 4x4控制器坐标系矩阵，没有可操作的控制器时返回None
+        """
         operation_mode = self._scene_viewmodel.operation_mode
         selected_geo = self._scene_viewmodel.selected_geometry
-        
-        # 清空现有的控制器几何体
-        self._controller_geometries = []
-        
-        # 如果没有选中对象或者处于观察模式，不需要创建控制器
-        if not selected_geo or operation_mode == OperationMode.OBSERVE or not selected_geo.visible:
-            self._controllor_raycaster = None
-            return
 
-        # 获取控制器在世界空间中的位置
-        controller_origin = selected_geo.get_world_position()
-        
-        # 根据坐标系模式选择使用的坐标轴
-        if self._use_local_coords:
-            # 使用局部坐标系
-            transform_matrix = selected_geo.transform_matrix.copy()
-        else:
-            # 使用全局坐标系
-            transform_matrix = np.eye(4)
-            transform_matrix[:3, 3] = controller_origin
-        
-        # 根据操作模式创建不同的控制器几何体
-        if operation_mode == OperationMode.TRANSLATE:
-            # 平移控制器代码不变...
-            scale_factor = 2.0
-            axis_length = 2.0 * scale_factor
-            arrow_size = 0.25 * scale_factor
-            
-            # X轴
-            x_axis = Geometry(
-                geo_type="box",
-                name="x_axis_controller",
-                position=(axis_length/2, 0, 0),
-                size=(axis_length/2, 0.05, 0.05),
-                rotation=(0, 0, 0)
-            )
-            x_axis.tag = "x_axis"
-            x_axis.material.color = (1.0, 0.0, 0.0, 1.0)  # 红色
-            x_axis.transform_matrix = transform_matrix.copy()
-            
-            # X轴箭头
-            x_arrow = Geometry(
-                geo_type="box",
-                name="x_arrow_controller",
-                position=(axis_length, 0, 0),
-                size=(arrow_size, arrow_size, arrow_size),
-                rotation=(0, 0, 45)
-            )
-            x_arrow.tag = "x_axis"
-            x_arrow.material.color = (1.0, 0.0, 0.0, 1.0)  # 红色
-            x_arrow.transform_matrix = transform_matrix.copy()
-            
-            # Y轴
-            y_axis = Geometry(
-                geo_type="box",
-                name="y_axis_controller",
-                position=(0, axis_length/2, 0),
-                size=(0.05, axis_length/2, 0.05),
-                rotation=(0, 0, 0)
-            )
-            y_axis.tag = "y_axis"
-            y_axis.material.color = (0.0, 1.0, 0.0, 1.0)  # 绿色
-            y_axis.transform_matrix = transform_matrix.copy()
-            
-            # Y轴箭头
-            y_arrow = Geometry(
-                geo_type="box",
-                name="y_arrow_controller",
-                position=(0, axis_length, 0),
-                size=(arrow_size, arrow_size, arrow_size),
-                rotation=(0, 0, 45)
-            )
-            y_arrow.tag = "y_axis"
-            y_arrow.material.color = (0.0, 1.0, 0.0, 1.0)  # 绿色
-            y_arrow.transform_matrix = transform_matrix.copy()
-            
-            # Z轴
-            z_axis = Geometry(
-                geo_type="box",
-                name="z_axis_controller",
-                position=(0, 0, axis_length/2),
-                size=(0.05, 0.05, axis_length/2),
-                rotation=(0, 0, 0)
-            )
-            z_axis.tag = "z_axis"
-            z_axis.material.color = (0.0, 0.0, 1.0, 1.0)  # 蓝色
-            z_axis.transform_matrix = transform_matrix.copy()
-            
-            # Z轴箭头
-            z_arrow = Geometry(
-                geo_type="box",
-                name="z_arrow_controller",
-                position=(0, 0, axis_length),
-                size=(arrow_size, arrow_size, arrow_size),
-                rotation=(45, 0, 0)
-            )
-            z_arrow.tag = "z_axis"
-            z_arrow.material.color = (0.0, 0.0, 1.0, 1.0)  # 蓝色
-            z_arrow.transform_matrix = transform_matrix.copy()
-            
-            self._controller_geometries = [x_axis, x_arrow, y_axis, y_arrow, z_axis, z_arrow]
-        
-        elif operation_mode == OperationMode.ROTATE:
-            # 完全照搬平移控制器的逻辑
-            scale_factor = 2.0
-            axis_length = 2.0 * scale_factor
-            arrow_size = 0.25 * scale_factor
-            
-            # X轴旋转控制器（红色）
-            x_axis = Geometry(
-                geo_type="box",
-                name="x_rotation_controller",
-                position=(axis_length/2, 0, 0),
-                size=(axis_length/2, 0.05, 0.05),
-                rotation=(0, 0, 0)
-            )
-            x_axis.tag = "x_rotation"  # 使用不同的tag以区分平移控制器
-            x_axis.material.color = (1.0, 0.0, 0.0, 1.0)  # 红色
-            x_axis.transform_matrix = transform_matrix.copy()
-            
-            # X轴箭头
-            x_arrow = Geometry(
-                geo_type="box",
-                name="x_rotation_arrow",
-                position=(axis_length, 0, 0),
-                size=(arrow_size, arrow_size, arrow_size),
-                rotation=(0, 0, 45)
-            )
-            x_arrow.tag = "x_rotation"
-            x_arrow.material.color = (1.0, 0.0, 0.0, 1.0)  # 红色
-            x_arrow.transform_matrix = transform_matrix.copy()
-            
-            # Y轴旋转控制器（绿色）
-            y_axis = Geometry(
-                geo_type="box",
-                name="y_rotation_controller",
-                position=(0, axis_length/2, 0),
-                size=(0.05, axis_length/2, 0.05),
-                rotation=(0, 0, 0)
-            )
-            y_axis.tag = "y_rotation"
-            y_axis.material.color = (0.0, 1.0, 0.0, 1.0)  # 绿色
-            y_axis.transform_matrix = transform_matrix.copy()
-            
-            # Y轴箭头
-            y_arrow = Geometry(
-                geo_type="box",
-                name="y_rotation_arrow",
-                position=(0, axis_length, 0),
-                size=(arrow_size, arrow_size, arrow_size),
-                rotation=(0, 0, 45)
-            )
-            y_arrow.tag = "y_rotation"
-            y_arrow.material.color = (0.0, 1.0, 0.0, 1.0)  # 绿色
-            y_arrow.transform_matrix = transform_matrix.copy()
-            
-            # Z轴旋转控制器（蓝色）
-            z_axis = Geometry(
-                geo_type="box",
-                name="z_rotation_controller",
-                position=(0, 0, axis_length/2),
-                size=(0.05, 0.05, axis_length/2),
-                rotation=(0, 0, 0)
-            )
-            z_axis.tag = "z_rotation"
-            z_axis.material.color = (0.0, 0.0, 1.0, 1.0)  # 蓝色
-            z_axis.transform_matrix = transform_matrix.copy()
-            
-            # Z轴箭头
-            z_arrow = Geometry(
-                geo_type="box",
-                name="z_rotation_arrow",
-                position=(0, 0, axis_length),
-                size=(arrow_size, arrow_size, arrow_size),
-                rotation=(45, 0, 0)
-            )
-            z_arrow.tag = "z_rotation"
-            z_arrow.material.color = (0.0, 0.0, 1.0, 1.0)  # 蓝色
-            z_arrow.transform_matrix = transform_matrix.copy()
-            
-            self._controller_geometries = [x_axis, x_arrow, y_axis, y_arrow, z_axis, z_arrow]
-        
-        elif operation_mode == OperationMode.SCALE:
-            # 缩放控制器代码不变...
-            scale_factor = 2.0
-            box_size = 0.25 * scale_factor
-            axis_length = 2.0 * scale_factor
-            
-            # X轴
-            x_axis = Geometry(
-                geo_type="box",
-                name="x_axis_controller",
-                position=(axis_length/2, 0, 0),
-                size=(axis_length/2, 0.05, 0.05),
-                rotation=(0, 0, 0)
-            )
-            x_axis.tag = "x_axis"
-            x_axis.material.color = (1.0, 0.5, 0.5, 1.0)  # 浅红色
-            x_axis.transform_matrix = transform_matrix.copy()
-            
-            # X轴缩放盒
-            x_box = Geometry(
-                geo_type="box",
-                name="x_box_controller",
-                position=(axis_length, 0, 0),
-                size=(box_size, box_size, box_size),
-                rotation=(0, 0, 0)
-            )
-            x_box.tag = "x_axis"
-            x_box.material.color = (1.0, 0.0, 0.0, 1.0)  # 红色
-            x_box.transform_matrix = transform_matrix.copy()
-            
-            # Y轴
-            y_axis = Geometry(
-                geo_type="box",
-                name="y_axis_controller",
-                position=(0, axis_length/2, 0),
-                size=(0.05, axis_length/2, 0.05),
-                rotation=(0, 0, 0)
-            )
-            y_axis.tag = "y_axis"
-            y_axis.material.color = (0.5, 1.0, 0.5, 1.0)  # 浅绿色
-            y_axis.transform_matrix = transform_matrix.copy()
-            
-            # Y轴缩放盒
-            y_box = Geometry(
-                geo_type="box",
-                name="y_box_controller",
-                position=(0, axis_length, 0),
-                size=(box_size, box_size, box_size),
-                rotation=(0, 0, 0)
-            )
-            y_box.tag = "y_axis"
-            y_box.material.color = (0.0, 1.0, 0.0, 1.0)  # 绿色
-            y_box.transform_matrix = transform_matrix.copy()
-            
-            # Z轴
-            z_axis = Geometry(
-                geo_type="box",
-                name="z_axis_controller",
-                position=(0, 0, axis_length/2),
-                size=(0.05, 0.05, axis_length/2),
-                rotation=(0, 0, 0)
-            )
-            z_axis.tag = "z_axis"
-            z_axis.material.color = (0.5, 0.5, 1.0, 1.0)  # 浅蓝色
-            z_axis.transform_matrix = transform_matrix.copy()
-            
-            # Z轴缩放盒
-            z_box = Geometry(
-                geo_type="box",
-                name="z_box_controller",
-                position=(0, 0, axis_length),
-                size=(box_size, box_size, box_size),
-                rotation=(0, 0, 0)
-            )
-            z_box.tag = "z_axis"
-            z_box.material.color = (0.0, 0.0, 1.0, 1.0)  # 蓝色
-            z_box.transform_matrix = transform_matrix.copy()
-            
-            self._controller_geometries = [x_axis, x_box, y_axis, y_box, z_axis, z_box]
-        
-        # 创建控制器射线投射器
-        self._controllor_raycaster = GeometryRaycaster(
-            self._scene_viewmodel._camera_config, 
-            self._controller_geometries
-        )
+        # 如果没有选中对象或者处于观察模式，不显示控制器
+        if not selected_geo or operation_mode not in _CONTROLLER_HANDLES or not selected_geo.visible:
+            return None
+
+        # 与 _draw_transform_controller 保持一致：全局坐标系下只保留平移部分
+        frame = selected_geo.transform_matrix.copy()
+        if not self._use_local_coords:
+            frame[:3, :3] = np.eye(3)
+        return frame
 
     def _pick_controller(self, screen_x, screen_y, just_hover=False):
-        """检测是否点击到变换控制器"""
-        if self._controllor_raycaster is None:
-            self._update_controllor_raycaster()
-        
-        if self._controllor_raycaster is None:
-            return None
-        
+        """
+        检测屏幕坐标处的变换控制器手柄
+
+        参数:
+            screen_x: 屏幕X坐标
+            screen_y: 屏幕Y坐标
+            just_hover: 为True时仅检测悬停，不修改控制器和拖动状态
+
+        返回:
+            str: 命中的轴 'x'、'y'、'z'，未命中时返回None
+        """
         # 如果仅检测悬停，不重置控制器状态
         if not just_hover:
             # 重置控制器轴和拖动状态
             self._controller_axis = None
             self._drag_operation = None
             self._initial_value = None
-        
-        # 获取当前选中的对象
-        selected_obj = self._scene_viewmodel.selected_geometry
 
-       
-        if not selected_obj:
+        frame = self._controller_frame()
+        if frame is None:
             return None
-        
+
+        selected_obj = self._scene_viewmodel.selected_geometry
+        operation_mode = self._scene_viewmodel.operation_mode
+
         try:
-            # 使用控制器射线投射器检测点击
-            result = self._controllor_raycaster.raycast(screen_x, screen_y, self.width(), self.height())
-            
-            if result and result.is_hit():
-                # 查找控制器类型
-                geo = result.geometry
-                
-                # 记录初始值，用于撤销功能
-                operation_mode = self._scene_viewmodel.operation_mode
-                
+            # 将拾取射线变换到控制器坐标系，再与静态手柄代理逐一做解析求交
+            ray_origin, ray_direction = self._scene_viewmodel.camera.screen_to_ray(
+                screen_x, screen_y, self.width(), self.height())
+            rotation = frame[:3, :3]
+            local_origin = (ray_origin - frame[:3, 3]) @ rotation
+            local_direction = ray_direction @ rotation
+
+            axes, centers, half_sizes = _CONTROLLER_HANDLES[operation_mode]
+            distances = intersect_box_batch(
+                local_origin - centers,
+                np.broadcast_to(local_direction, centers.shape),
+                half_sizes
+            )
+            nearest = int(np.argmin(distances))
+            if not np.isfinite(distances[nearest]):
+                # 没有点击到控制器
+                return None
+
+            # 记录初始值，用于撤销功能
+            if not just_hover:
                 if operation_mode == OperationMode.TRANSLATE:
-                    if not just_hover:
-                        self._drag_operation = "translate"
-                        self._initial_value = selected_obj.position.copy()
-                
+                    self._drag_operation = "translate"
+                    self._initial_value = selected_obj.position.copy()
                 elif operation_mode == OperationMode.ROTATE:
-                    if not just_hover:
-                        self._drag_operation = "rotate"
-                        self._initial_value = selected_obj.rotation.copy()
-                    
-                    # 旋转控制器轴检测（基于tag）
-                    if hasattr(geo, 'tag'):
-                        tag = geo.tag
-                        if 'x_rotation' in tag:
-                            self._controller_axis = 'x'
-                            return 'x'
-                        elif 'y_rotation' in tag:
-                            self._controller_axis = 'y'
-                            return 'y'
-                        elif 'z_rotation' in tag:
-                            self._controller_axis = 'z'
-                            return 'z'
-                
+                    self._drag_operation = "rotate"
+                    self._initial_value = selected_obj.rotation.copy()
                 elif operation_mode == OperationMode.SCALE:
-                    if not just_hover:
-                        self._drag_operation = "scale"
-                        self._initial_value = selected_obj.size.copy()
-                
-                # 标准轴检测
-                if hasattr(geo, 'tag'):
-                    tag = geo.tag
-                    if 'x_axis' in tag:
-                        self._controller_axis = 'x'
-                        return 'x'
-                    elif 'y_axis' in tag:
-                        self._controller_axis = 'y'
-                        return 'y'
-                    elif 'z_axis' in tag:
-                        self._controller_axis = 'z'
-                        return 'z'
+                    self._drag_operation = "scale"
+                    self._initial_value = selected_obj.size.copy()
+
+            axis = axes[nearest]
+            if not just_hover:
+                self._controller_axis = axis
+            return axis
         except Exception as e:
             print(f"控制器拾取错误: {e}")
             import traceback
             traceback.print_exc()
-        
+
         # 没有点击到控制器
         return None
 
@@ -1367,10 +1276,6 @@ class OpenGLView(QOpenGLWidget):
         
         # 通知视图模型对象已更改
         self._scene_viewmodel.notify_object_changed(geometry)
-        
-        # 在拖动完成后触发状态记录
-        if hasattr(self._scene_viewmodel, 'control_viewmodel'):
-            self._scene_viewmodel.control_viewmodel._on_geometry_modified()
 
     def _handle_local_translation(self, geometry, drag_amount):
         """
@@ -1504,10 +1409,6 @@ class OpenGLView(QOpenGLWidget):
         
         # 通知视图模型对象已更改
         self._scene_viewmodel.notify_object_changed(geometry)
-        
-        # 在拖动完成后触发状态记录
-        if hasattr(self._scene_viewmodel, 'control_viewmodel'):
-            self._scene_viewmodel.control_viewmodel._on_geometry_modified()
 
     def _handle_local_rotation(self, geometry, drag_amount):
         """
@@ -1635,10 +1536,6 @@ class OpenGLView(QOpenGLWidget):
         
         # 通知视图模型对象已更改
         self._scene_viewmodel.notify_object_changed(geometry)
-        
-        # 在拖动完成后触发状态记录
-        if hasattr(self._scene_viewmodel, 'control_viewmodel'):
-            self._scene_viewmodel.control_viewmodel._on_geometry_modified()
 
     def _handle_local_scale(self, geometry, scale_factor):
         """
@@ -1837,13 +1734,12 @@ class OpenGLView(QOpenGLWidget):
         try:
             # 获取几何体类型值
             geo_type_text = event.mimeData().text()
-            print(f"拖拽类型: '{geo_type_text}'，类型: {type(geo_type_text)}")
             
             # 获取当前鼠标位置
             mouse_pos = event.pos()
             
             # 计算世界位置
-            world_pos = self._get_position_at_mouse(mouse_pos)
+            world_pos = self._get_position_at_mouse(mouse_pos, geo_type_text)
             
             # 更新预览状态
             self.drag_preview = {
@@ -1882,7 +1778,7 @@ class OpenGLView(QOpenGLWidget):
             
             # 获取放置位置
             mouse_pos = event.pos()
-            world_pos = self._get_position_at_mouse(mouse_pos)
+            world_pos = self._get_position_at_mouse(mouse_pos, geo_type_value)
             
             # 创建几何体
             self._create_geometry_at_position(geo_type_value, world_pos)
@@ -1897,52 +1793,45 @@ class OpenGLView(QOpenGLWidget):
             print(f"拖拽放置处理出错: {e}")
             event.ignore()
 
-    def _get_position_at_mouse(self, mouse_pos):
+    def _get_position_at_mouse(self, mouse_pos, geo_type_value=None):
         """
-        获取鼠标位置对应的世界坐标
+        获取鼠标位置处放置几何体的世界坐标
+        
+        把待放置的形状沿鼠标射线移动，停在与场景或地面（z=0）首次接触的位置，
+        放置后既不与现有物体穿插也不会悬空。
         
         参数:
             mouse_pos: 鼠标位置(QPoint)
+            geo_type_value: 待放置的几何体类型值（字符串），决定扫掠形状的尺寸
             
         返回:
-            世界坐标(numpy数组)
+            世界坐标(numpy数组)，即放置后几何体的中心
         """
         try:
-            # 获取视口尺寸
-            viewport_width = self.width()
-            viewport_height = self.height()
-            
             # 获取射线
-            ray_origin, ray_direction = self._get_mouse_ray(mouse_pos.x(), mouse_pos.y(), viewport_width, viewport_height)
-            
-            # 使用场景视图模型的射线投射器检测与几何体的交点
-            result = self._scene_viewmodel._raycaster.raycast(mouse_pos.x(), mouse_pos.y(), viewport_width, viewport_height)
-            
-            if result and result.is_hit():
-                # 如果射线击中了几何体，使用击中点
-                # RaycastResult 类使用 hit_point 而不是 hit_position
-                if hasattr(result, 'hit_point'):
-                    # 将位置稍微提高，避免与现有物体重叠
-                    return result.hit_point + np.array([0.0, 0.2, 0.0])
-                
-                # 如果没有hit_point，可以尝试使用距离计算击中点
-                if hasattr(result, 'distance'):
-                    hit_point = ray_origin + ray_direction * result.distance
-                    return hit_point + np.array([0.0, 0.2, 0.0])
-                
-                # 如果上述方法都失败，从几何体获取位置
-                if hasattr(result, 'geometry') and hasattr(result.geometry, 'get_world_position'):
-                    geometry_pos = result.geometry.get_world_position()
-                    # 将位置稍微提高，避免与现有物体重叠
-                    return geometry_pos + np.array([0.0, result.geometry.size[1] if hasattr(result.geometry, 'size') else 0.5, 0.0])
-            
-            # 如果没有击中几何体，计算与y=0平面的交点
-            if ray_direction[1] != 0:
-                t = -ray_origin[1] / ray_direction[1]
-                if t > 0:
-                    # 计算交点
-                    intersection = ray_origin + t * ray_direction
-                    return intersection
+            ray_origin, ray_direction = self._get_mouse_ray(mouse_pos.x(), mouse_pos.y(), self.width(), self.height())
+            ray_direction = ray_direction / np.linalg.norm(ray_direction)
+            
+            geo_type = next((gt for gt in GeometryType if gt.value == geo_type_value), GeometryType.BOX)
+            size = _DEFAULT_DROP_SIZES.get(geo_type, (0.5, 0.5, 0.5))
+            extent = np.array(shape_half_extents(geo_type.value, size))
+            
+            # 在场景的层次包围盒中扫掠，球体用球形扫掠，其余类型用包围盒扫掠
+            distance = np.inf
+            raycaster = self._scene_viewmodel._raycaster
+            if raycaster is not None:
+                if geo_type == GeometryType.SPHERE:
+                    result = raycaster.sweep_sphere((ray_origin, ray_direction), size[0])
+                else:
+                    result = raycaster.sweep_box((ray_origin, ray_direction), extent)
+                distance = result.distance
+            
+            # 与地面接触时形状底部贴地，中心高度为Z方向的半尺寸
+            if ray_direction[2] < 0 and ray_origin[2] > extent[2]:
+                distance = min(distance, (extent[2] - ray_origin[2]) / ray_direction[2])
+            
+            if np.isfinite(distance):
+                return ray_origin + ray_direction * distance
             
             # 默认返回原点
             return np.array([0.0, 0.0, 0.0])
@@ -1992,21 +1881,11 @@ class OpenGLView(QOpenGLWidget):
                 print(f"有效的几何体类型值: {[gt.value for gt in GeometryType]}")
                 return
             
-            # 为不同几何体类型设置默认尺寸
-            default_sizes = {
-                GeometryType.BOX: (0.5, 0.5, 0.5),
-                GeometryType.SPHERE: (0.5, 0.5, 0.5),
-                GeometryType.CYLINDER: (0.5, 0.5, 0.5),
-                GeometryType.PLANE: (1.0, 0.01, 1.0),
-                GeometryType.CAPSULE: (0.5, 0.5, 0.5),
-                GeometryType.ELLIPSOID: (0.5, 0.3, 0.5)
-            }
-            
             # 创建几何体
             geometry = self._scene_viewmodel.create_geometry(
                 geo_type=geo_type,
                 position=tuple(position),
-                size=default_sizes.get(geo_type, (0.5, 0.5, 0.5))
+                size=_DEFAULT_DROP_SIZES.get(geo_type, (0.5, 0.5, 0.5))
             )
             
             # 选中新创建的几何体
@@ -2054,18 +1933,8 @@ class OpenGLView(QOpenGLWidget):
             # 移动到预览位置
             glTranslatef(position[0], position[1], position[2])
             
-            # 为不同几何体类型设置默认尺寸
-            default_sizes = {
-                GeometryType.BOX: (0.5, 0.5, 0.5),
-                GeometryType.SPHERE: (0.5, 0.5, 0.5),
-                GeometryType.CYLINDER: (0.5, 0.5, 0.5),
-                GeometryType.PLANE: (1.0, 0.01, 1.0),
-                GeometryType.CAPSULE: (0.5, 0.5, 0.5),
-                GeometryType.ELLIPSOID: (0.5, 0.3, 0.5)
-            }
-            
             # 获取默认尺寸
-            size = default_sizes.get(geo_type, (0.5, 0.5, 0.5))
+            size = _DEFAULT_DROP_SIZES.get(geo_type, (0.5, 0.5, 0.5))
             
             # 根据几何体类型绘制
             if geo_type == GeometryType.BOX:
@@ -2299,8 +2168,7 @@ class OpenGLView(QOpenGLWidget):
     def _on_coordinate_system_changed(self, use_local_coords):
         """处理坐标系模式变化"""
         self._use_local_coords = use_local_coords
-        # 更新控制器
-        self._update_controllor_raycaster()
+        self._clear_controller_hover()
         # 重绘场景
         self.update()
         
@@ -0,0 +1,254 @@
+"""
+内容寻址的自动存档
+
+每个子树序列化为一个数据块：节点自身的属性加上各子节点数据块的哈希，数据块以内容的SHA-256
+命名保存在 objects/ 目录下。顶层子树的哈希列表按内容切分成若干页，每页也是一个数据块，每次存档
+只写一个很小的清单，记录各页的哈希；没有修改过的子树和页哈希不变，在多次存档之间共享同一个
+数据块。与上一次存档完全相同的场景不再重复保存。
+子树哈希按修订号缓存，存档时只重新序列化修改过的子树；写文件在后台线程中进行。
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+# 清单文件中标识存档格式的字段值
+MANIFEST_FORMAT = "chunked"
+# 顶层哈希列表的平均每页条数：哈希值满足条件的条目作为一页的结尾，插入或删除对象只影响相邻的页
+PAGE_BOUNDARY = 64
+# 每页的最大条数
+PAGE_LIMIT = 1024
+
+
+def _encode_chunk(content):
+    """数据块的内容和哈希；键排序、紧凑格式，相同的内容总是得到相同的哈希"""
+    data = json.dumps(content, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return hashlib.sha256(data).hexdigest(), data
+
+
+def _split_pages(digests):
+    """按内容把顶层哈希列表切分成页"""
+    pages = []
+    page = []
+    for digest in digests:
+        page.append(digest)
+        if int(digest[-4:], 16) % PAGE_BOUNDARY == 0 or len(page) >= PAGE_LIMIT:
+            pages.append(page)
+            page = []
+    if page:
+        pages.append(page)
+    return pages
+
+
+def _node_data(geo):
+    """节点自身的可序列化属性，字段与 SceneViewModel.get_serializable_geometries 一致（不含ID）"""
+    return {
+        'type': geo.type if isinstance(geo.type, str) else (geo.type.name if hasattr(geo.type, 'name') else str(geo.type)),
+        'position': geo.position.tolist(),
+        'rotation': geo.rotation.tolist(),
+        'scale': geo.size.tolist(),
+        'name': geo.name,
+        'color': geo.material.color.tolist(),
+        'properties': geo.get_specific_properties(),
+    }
+
+
+def _write_atomic(path, data):
+    """先写临时文件再替换，中途失败不会留下内容不完整的文件"""
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def read_save_file(file_path):
+    """
+    读取存档文件
+
+    参数:
+        file_path: 存档路径，可以是完整的JSON存档，也可以是内容寻址存档的清单
+
+    返回:
+        dict: get_serializable_geometries 格式的数据
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('format') != MANIFEST_FORMAT:
+        return data
+
+    objects_dir = os.path.join(os.path.dirname(file_path), data.get('objects', 'objects'))
+    chunks = {}  # 同一个数据块可能被多个节点引用（例如复制出的相同子树）
+
+    def read_chunk(digest):
+        chunk = chunks.get(digest)
+        if chunk is None:
+            with open(os.path.join(objects_dir, digest[:2], digest + ".json"), 'r', encoding='utf-8') as f:
+                chunk = chunks[digest] = json.load(f)
+        return chunk
+
+    roots = [digest for page in data['pages'] for digest in read_chunk(page)['roots']]
+    geometries = []
+    stack = [(digest, None) for digest in reversed(roots)]
+    while stack:
+        digest, parent_id = stack.pop()
+        chunk = read_chunk(digest)
+        geo_id = len(geometries) + 1
+        geo_data = dict(chunk['node'], id=geo_id, parent_id=parent_id)
+        geometries.append(geo_data)
+        stack.extend((child, geo_id) for child in reversed(chunk['children']))
+    return {'version': data.get('version', '1.0'), 'geometries': geometries}
+
+
+class AutosaveStore:
+    """
+    内容寻址的存档目录
+
+    清单保存为 <目录>/<时间戳>.json，数据块（子树和顶层列表的页）保存为
+    <目录>/objects/<哈希前两位>/<哈希>.json。
+    """
+    OBJECTS_DIR = "objects"
+
+    def __init__(self, directory):
+        """
+        参数:
+            directory: 存档目录
+        """
+        self._directory = directory
+        self._objects_dir = os.path.join(directory, self.OBJECTS_DIR)
+        self._hashes = weakref.WeakKeyDictionary()  # 节点 -> (子树修订号, 哈希, 子树节点数)
+        self._stored = set()  # 已经提交写入的数据块
+        self._last_pages = None  # 上一次存档的页哈希
+        self._last_path = None
+        self._failed = False  # 后台写入出错后不再信任 _stored，下次存档重新检查
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AutosaveWriter")
+
+    def save(self, roots, on_written=None):
+        """
+        保存场景
+
+        UI线程中只计算修改过的子树的哈希，新的数据块和清单交给后台线程写入。
+
+        参数:
+            roots: 场景的顶层几何体列表
+            on_written: 清单写入完成后在后台线程中调用的函数，参数为清单路径
+
+        返回:
+            tuple: (清单路径, 是否写入了新的存档)；场景与上一次存档相同时返回上一次的清单路径
+        """
+        if self._failed:
+            self._failed = False
+            self._stored.clear()
+            self._last_pages = None
+        if self._last_pages is None:
+            self._load_last_manifest()
+
+        chunks = {}
+        entries = [self._subtree_hash(root, chunks) for root in roots]
+        pages = []
+        for page in _split_pages([entry[0] for entry in entries]):
+            digest, content = _encode_chunk({'roots': page})
+            if digest not in self._stored:
+                chunks[digest] = content
+            pages.append(digest)
+        if pages == self._last_pages and self._last_path and os.path.exists(self._last_path):
+            return self._last_path, False
+
+        manifest = {
+            'version': '1.0',
+            'format': MANIFEST_FORMAT,
+            'objects': self.OBJECTS_DIR,
+            'geometry_count': sum(entry[1] for entry in entries),
+            'pages': pages,
+        }
+        path = self._new_manifest_path()
+        self._stored.update(chunks)
+        self._last_pages = pages
+        self._last_path = path
+        self._executor.submit(self._write, chunks, path, json.dumps(manifest, indent=4).encode('utf-8'), on_written)
+        return path, True
+
+    def close(self):
+        """等待尚未完成的写入"""
+        self._executor.shutdown(wait=True)
+
+    def _subtree_hash(self, root, chunks):
+        """
+        计算子树的哈希，修订号未变化的子树直接使用缓存
+
+        参数:
+            root: 子树的根节点
+            chunks: 收集需要写入的新数据块，哈希 -> 内容
+
+        返回:
+            tuple: (哈希, 子树节点数)
+        """
+        results = {}  # id(节点) -> (哈希, 子树节点数)
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            revision = node.revision
+            entry = self._hashes.get(node)
+            if entry is not None and entry[0] == revision:
+                results[id(node)] = entry[1:]
+                continue
+            if not expanded:
+                # 先处理子节点，再回到自身
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children)
+                continue
+
+            children = [results[id(child)] for child in node.children]
+            digest, content = _encode_chunk({'node': _node_data(node), 'children': [child[0] for child in children]})
+            if digest not in self._stored:
+                chunks[digest] = content
+            entry = self._hashes[node] = (revision, digest, 1 + sum(child[1] for child in children))
+            results[id(node)] = entry[1:]
+        return results[id(root)]
+
+    def _new_manifest_path(self):
+        """以时间戳命名清单，同一秒内的多次存档加上序号"""
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(self._directory, f"{timestamp}.json")
+        suffix = 1
+        while path == self._last_path or os.path.exists(path):
+            path = os.path.join(self._directory, f"{timestamp}_{suffix}.json")
+            suffix += 1
+        return path
+
+    def _load_last_manifest(self):
+        """读取目录中最新的清单，使重新启动后的第一次存档也能跳过没有变化的场景"""
+        try:
+            paths = [os.path.join(self._directory, name) for name in os.listdir(self._directory)
+                     if name.endswith(".json")]
+            if not paths:
+                return
+            path = max(paths, key=os.path.getmtime)
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('format') == MANIFEST_FORMAT:
+                self._last_pages = data['pages']
+                self._last_path = path
+        except Exception as e:
+            print(f"读取最近的存档清单失败: {str(e)}")
+
+    def _write(self, chunks, manifest_path, manifest, on_written):
+        """后台线程：先写数据块，最后写清单，清单出现时引用的数据块都已存在"""
+        try:
+            for digest, content in chunks.items():
+                folder = os.path.join(self._objects_dir, digest[:2])
+                path = os.path.join(folder, digest + ".json")
+                if os.path.exists(path):
+                    continue
+                os.makedirs(folder, exist_ok=True)
+                _write_atomic(path, content)
+            _write_atomic(manifest_path, manifest)
+            if on_written is not None:
+                on_written(manifest_path)
+        except Exception as e:
+            self._failed = True
+            print(f"写入自动存档失败: {str(e)}")
+            import traceback
+            traceback.print_exc()
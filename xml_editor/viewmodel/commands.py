@@ -0,0 +1,498 @@
+"""
+撤销/重做命令
+
+每条命令只记录一次修改涉及的几何体以及修改前后的值，撤销和重做时直接把差异应用到当前场景，
+代价与修改的规模成正比，与场景大小无关。
+"""
+
+import bisect
+import numpy as np
+from ..model.geometry import BaseGeometry
+from ..model.scene_arrays import gather_array
+
+# 参与撤销/重做的几何体属性
+UNDOABLE_PROPERTIES = ('name', 'position', 'size', 'rotation', 'color')
+
+# 快照中按数组保存的数值属性：(属性名, SceneArrays列名, 读取函数)
+_SNAPSHOT_ARRAYS = (
+    ('position', 'position', lambda geo: geo.position),
+    ('rotation', 'rotation', lambda geo: geo.rotation),
+    ('size', 'size', lambda geo: geo.size),
+    ('color', 'color', lambda geo: geo.material.color),
+)
+
+
+def read_property(geometry, name):
+    """读取几何体属性的副本（绑定SceneArrays时属性是存储的视图，必须复制）"""
+    if name == 'name':
+        return geometry.name
+    if name == 'color':
+        return np.array(geometry.material.color)
+    return np.array(getattr(geometry, name))
+
+
+def write_property(geometry, name, value):
+    """通过属性的setter写回，以便正确地使变换缓存失效并更新修订号"""
+    if name == 'color':
+        geometry.material.color = value
+    else:
+        setattr(geometry, name, value)
+
+
+def _gather(nodes, column, getter):
+    """
+    按原精度批量读取一组节点的数值属性
+
+    绑定同一个SceneArrays时直接按列读取；否则节点上的数组可能是float64，
+    转成float32会让恢复后的值与记录时不完全一致，因此按float64读取。
+    """
+    store = nodes[0]._store
+    if store is not None and all(node._store is store for node in nodes):
+        return gather_array(nodes, column, getter)
+    try:
+        return np.array([getter(node) for node in nodes], dtype=np.float64)
+    except ValueError:
+        return gather_array(nodes, column, getter).astype(np.float64)
+
+
+def _same_value(a, b):
+    """比较两个属性值是否相同"""
+    if isinstance(a, np.ndarray):
+        return a.shape == b.shape and np.array_equal(a, b)
+    return a == b
+
+
+def _reordered(pairs):
+    """
+    找出相对顺序发生变化的节点
+
+    参数:
+        pairs: 按新位置排列的 (原位置, 新位置) 列表
+
+    返回:
+        list: 不在原位置的最长递增子序列中的 (原位置, 新位置)
+    """
+    tails = []  # tails[k]: 长度为 k+1 的递增子序列的最小结尾在 pairs 中的下标
+    tail_values = []  # 对应的原位置，用于二分查找
+    previous = [-1] * len(pairs)
+    for i, (old_index, _) in enumerate(pairs):
+        k = bisect.bisect_left(tail_values, old_index)
+        previous[i] = tails[k - 1] if k > 0 else -1
+        if k == len(tails):
+            tails.append(i)
+            tail_values.append(old_index)
+        else:
+            tails[k] = i
+            tail_values[k] = old_index
+    kept = set()
+    i = tails[-1] if tails else -1
+    while i >= 0:
+        kept.add(i)
+        i = previous[i]
+    return [pair for i, pair in enumerate(pairs) if i not in kept]
+
+
+def _in_scene(geometry, root_ids):
+    """沿父对象链向上查找，判断几何体是否挂在某个顶层几何体之下"""
+    while geometry.parent is not None:
+        geometry = geometry.parent
+    return id(geometry) in root_ids
+
+
+class SceneSnapshot:
+    """
+    一组子树的完整快照
+
+    保存子树中所有节点的引用、层级关系和可撤销属性。节点对象在历史记录中一直保持存活，
+    因此恢复时把节点放回记录的位置并写回属性即可，不需要重新创建几何体。
+    历史时间线用整个场景的快照作为关键帧；添加、删除命令用子树快照记录子树进出场景时的状态。
+    """
+    def __init__(self, roots):
+        """
+        参数:
+            roots: 子树的根节点列表（整个场景时为顶层几何体列表）
+        """
+        nodes = []
+        parents = []
+        stack = [(root, -1) for root in reversed(roots)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(nodes)
+            nodes.append(node)
+            parents.append(parent)
+            stack.extend((child, index) for child in reversed(node.children))
+
+        self.nodes = nodes  # 先序排列的全部节点
+        self.parents = np.array(parents, dtype=np.int32)  # 父节点在 nodes 中的下标，根节点为-1
+        self.names = [node.name for node in nodes]
+        self.arrays = {}
+        for name, column, getter in _SNAPSHOT_ARRAYS:
+            self.arrays[name] = _gather(nodes, column, getter) if nodes else None
+
+    @classmethod
+    def from_data(cls, nodes, parents, names, arrays):
+        """
+        由已有的数据构造快照（例如从崩溃恢复日志读出的数据）
+
+        参数:
+            nodes: 先序排列的节点列表
+            parents: 父节点下标，根节点为-1
+            names: 名称列表
+            arrays: {属性名: (N, k) 数组}，属性名见 _SNAPSHOT_ARRAYS
+        """
+        snapshot = cls.__new__(cls)
+        snapshot.nodes = list(nodes)
+        snapshot.parents = np.asarray(parents, dtype=np.int32)
+        snapshot.names = list(names)
+        snapshot.arrays = {name: (np.asarray(arrays[name], dtype=np.float64) if nodes else None)
+                           for name, _, _ in _SNAPSHOT_ARRAYS}
+        return snapshot
+
+    @property
+    def nbytes(self):
+        """快照占用内存的粗略估计（字节）"""
+        arrays = sum(array.nbytes for array in self.arrays.values() if array is not None)
+        return arrays + self.parents.nbytes + 64 * len(self.nodes)
+
+    def restore(self, scene, include_roots=True):
+        """
+        恢复快照记录的状态
+
+        先比较层级，只移动位置发生变化的节点；再按数组比较属性，只对不同的节点调用setter，
+        这样没有变化的子树保持原来的修订号，依赖修订号的缓存仍然有效。
+
+        参数:
+            scene: 场景视图模型，提供 geometries / insert_geometry / detach_geometry
+            include_roots: 是否同时恢复场景的顶层列表；为False时只恢复子树内部，根节点由调用者放置
+        """
+        nodes = self.nodes
+        node_ids = {id(node) for node in nodes}
+
+        # 1. 层级：不在快照中的节点移除，父对象或位置不同的节点移动到记录的位置
+        containers = [node.children for node in nodes]
+        if include_roots:
+            containers.append(scene.geometries)
+        moves = []
+        for siblings in containers:
+            moves.extend((child, None, None) for child in siblings if id(child) not in node_ids)
+
+        index_maps = {}
+
+        def current_index(node):
+            siblings = node.parent.children if node.parent is not None else scene.geometries
+            index_map = index_maps.get(id(siblings))
+            if index_map is None:
+                index_map = index_maps[id(siblings)] = {id(child): i for i, child in enumerate(siblings)}
+            return index_map.get(id(node))
+
+        child_counts = np.zeros(len(nodes) + 1, dtype=np.int64)
+        for node, parent_index in zip(nodes, self.parents):
+            index = child_counts[parent_index]
+            child_counts[parent_index] += 1
+            if parent_index < 0 and not include_roots:
+                continue
+            parent = nodes[parent_index] if parent_index >= 0 else None
+            if node.parent is not parent or current_index(node) != index:
+                moves.append((node, parent, int(index)))
+
+        if moves:
+            apply_moves(scene, moves)
+
+        # 2. 属性：只写回与快照不同的节点
+        for name, column, getter in _SNAPSHOT_ARRAYS:
+            target = self.arrays[name]
+            if target is None:
+                continue
+            current = _gather(nodes, column, getter)
+            for i in np.nonzero(np.any(current != target, axis=1))[0]:
+                write_property(nodes[i], name, target[i])
+        for node, name in zip(nodes, self.names):
+            if node.name != name:
+                node.name = name
+
+
+class Command:
+    """
+    撤销/重做命令基类
+
+    子类通过 _apply_writes 写入属性，通过 _moves 返回要移动的几何体，
+    由 apply_commands 统一应用，这样批量命令中的结构变化可以一次性完成。
+    """
+    def undo(self, scene):
+        """撤销命令"""
+        apply_commands(scene, [self], undo=True)
+
+    def redo(self, scene):
+        """重做命令"""
+        apply_commands(scene, [self], undo=False)
+
+    def estimate_size(self):
+        """命令占用内存的粗略估计（字节），用于限制历史记录的总大小"""
+        return 64
+
+    def _apply_writes(self, scene, undo):
+        """写入属性"""
+        pass
+
+    def _moves(self, undo):
+        """返回 [(几何体, 目标父对象, 目标位置)]，目标位置为None表示从场景中移除"""
+        return []
+
+
+class SetPropertyCommand(Command):
+    """修改单个属性"""
+    def __init__(self, geometry, name, old_value, new_value):
+        self.geometry = geometry
+        self.name = name
+        self.old_value = old_value
+        self.new_value = new_value
+
+    def estimate_size(self):
+        return 64 + sum(getattr(value, 'nbytes', 64) for value in (self.old_value, self.new_value))
+
+    def _apply_writes(self, scene, undo):
+        write_property(self.geometry, self.name, self.old_value if undo else self.new_value)
+
+
+class AddCommand(Command):
+    """
+    向场景中添加几何体（连同其子树）
+
+    子树离开场景期间仍可能留着之后步骤的状态（例如从关键帧恢复时不在关键帧中的对象），
+    因此同时保存子树加入场景时的快照，放回场景之前先恢复子树内部。
+    """
+    def __init__(self, geometry, parent, index, snapshot=None):
+        self.geometry = geometry
+        self.parent = parent
+        self.index = index
+        self.snapshot = snapshot or SceneSnapshot([geometry])
+
+    def estimate_size(self):
+        return 64 + self.snapshot.nbytes
+
+    def _entering(self, undo):
+        """这次应用是否把子树放回场景"""
+        return not undo
+
+    def _apply_writes(self, scene, undo):
+        if self._entering(undo):
+            self.snapshot.restore(scene, include_roots=False)
+
+    def _moves(self, undo):
+        if self._entering(undo):
+            return [(self.geometry, self.parent, self.index)]
+        return [(self.geometry, None, None)]
+
+
+class RemoveCommand(AddCommand):
+    """从场景中移除几何体（连同其子树），记录原来的父对象、位置和移除时的子树快照"""
+    def _entering(self, undo):
+        return undo
+
+
+class ReparentCommand(Command):
+    """修改几何体的父对象"""
+    def __init__(self, geometry, old_parent, old_index, new_parent, new_index):
+        self.geometry = geometry
+        self.old_parent = old_parent
+        self.old_index = old_index
+        self.new_parent = new_parent
+        self.new_index = new_index
+
+    def _moves(self, undo):
+        if undo:
+            return [(self.geometry, self.old_parent, self.old_index)]
+        return [(self.geometry, self.new_parent, self.new_index)]
+
+
+class BatchCommand(Command):
+    """作为一个撤销步骤的一组命令"""
+    def __init__(self, commands):
+        self.commands = list(commands)
+
+    def estimate_size(self):
+        return 64 + sum(command.estimate_size() for command in self.commands)
+
+    def _apply_writes(self, scene, undo):
+        for command in (reversed(self.commands) if undo else self.commands):
+            command._apply_writes(scene, undo)
+
+    def _moves(self, undo):
+        commands = reversed(self.commands) if undo else self.commands
+        return [move for command in commands for move in command._moves(undo)]
+
+
+def apply_commands(scene, commands, undo):
+    """
+    把一组命令应用到场景
+
+    先写属性，再把所有移动的几何体取下，最后按目标位置从小到大依次插入。
+    未移动的兄弟节点保持相对顺序不变，所以按升序插入后每个节点恰好落在记录的位置上。
+
+    参数:
+        scene: 场景视图模型，提供 insert_geometry / detach_geometry
+        commands: 命令列表
+        undo: True表示撤销，False表示重做
+    """
+    if undo:
+        commands = list(reversed(commands))
+
+    moves = []
+    for command in commands:
+        command._apply_writes(scene, undo)
+        moves.extend(command._moves(undo))
+
+    apply_moves(scene, moves)
+
+
+def apply_moves(scene, moves):
+    """
+    移动一组几何体
+
+    参数:
+        scene: 场景视图模型，提供 insert_geometry / detach_geometry
+        moves: [(几何体, 目标父对象, 目标位置)]，目标位置为None表示从场景中移除
+    """
+    for geometry, _, _ in moves:
+        scene.detach_geometry(geometry)
+
+    inserts = [move for move in moves if move[2] is not None]
+    inserts.sort(key=lambda move: move[2])
+    for geometry, parent, index in inserts:
+        scene.insert_geometry(geometry, parent, index)
+
+
+class SceneChangeRecorder:
+    """
+    场景修改记录器
+
+    为场景中每个节点保存一份上一次记录时的属性和子节点列表，通过 BaseGeometry.recent_changes
+    找到之后被修改过的节点，只对这些节点做比较并生成命令。记录被挤出变化队列时退回到
+    对全部节点做比较。
+    """
+    def __init__(self):
+        self._states = {}  # id(节点) -> [节点, {属性: 值}, 子节点元组]
+        self._roots = ()  # 上一次记录时的顶层几何体
+        self._revision = 0  # 已处理到的修订号
+
+    def reset(self, roots):
+        """以当前场景为基准重新开始记录"""
+        self._states = {}
+        self._roots = tuple(roots)
+        for root in roots:
+            self._register(root)
+        changes = BaseGeometry.recent_changes
+        self._revision = changes[-1][0] if changes else 0
+
+    def _register(self, geometry):
+        """为整个子树保存当前状态"""
+        stack = [geometry]
+        while stack:
+            node = stack.pop()
+            self._states[id(node)] = [
+                node,
+                {name: read_property(node, name) for name in UNDOABLE_PROPERTIES},
+                tuple(node.children),
+            ]
+            stack.extend(node.children)
+
+    def _unregister(self, geometry):
+        """移除整个子树的状态"""
+        stack = [geometry]
+        while stack:
+            node = stack.pop()
+            self._states.pop(id(node), None)
+            stack.extend(node.children)
+
+    def _changed_nodes(self):
+        """上一次记录之后被修改过、且在场景中的节点"""
+        changes = BaseGeometry.recent_changes
+        if len(changes) == changes.maxlen and changes and changes[0][0] > self._revision:
+            # 可能有记录被挤出队列，比较全部节点
+            nodes = [state[0] for state in self._states.values()]
+        else:
+            nodes = []
+            seen = set()
+            for revision, node in reversed(changes):
+                if revision <= self._revision:
+                    break
+                state = self._states.get(id(node))
+                if state is not None and state[0] is node and id(node) not in seen:
+                    seen.add(id(node))
+                    nodes.append(node)
+        if changes:
+            self._revision = max(self._revision, changes[-1][0])
+        return nodes
+
+    def capture(self, roots):
+        """
+        比较当前场景与上一次记录的状态，生成描述这段时间内修改的命令
+
+        参数:
+            roots: 场景的顶层几何体列表
+
+        返回:
+            Command: 单条命令或批量命令，没有修改时返回None
+        """
+        commands = []
+        removed = {}  # id -> (节点, 原父对象, 原位置)
+        added = {}  # id -> (节点, 新父对象, 新位置)
+
+        def diff_children(parent, old_children, new_children):
+            old_ids = {id(node): i for i, node in enumerate(old_children)}
+            new_ids = {id(node): i for i, node in enumerate(new_children)}
+            for node_id, i in old_ids.items():
+                if node_id not in new_ids:
+                    removed[node_id] = (old_children[i], parent, i)
+            for node_id, i in new_ids.items():
+                if node_id not in old_ids:
+                    added[node_id] = (new_children[i], parent, i)
+            # 两边都有的节点若相对顺序改变，保持最长不变序列不动，其余节点视为在同一父对象下移动
+            common = [(old_ids[id(node)], i) for i, node in enumerate(new_children) if id(node) in old_ids]
+            for old_index, new_index in _reordered(common):
+                node = new_children[new_index]
+                commands.append(ReparentCommand(node, parent, old_index, parent, new_index))
+
+        for node in self._changed_nodes():
+            state = self._states[id(node)]
+            for name, old_value in state[1].items():
+                new_value = read_property(node, name)
+                if not _same_value(old_value, new_value):
+                    commands.append(SetPropertyCommand(node, name, old_value, new_value))
+                    state[1][name] = new_value
+            children = tuple(node.children)
+            if children != state[2]:
+                diff_children(node, state[2], children)
+                state[2] = children
+
+        # 顶层列表没有修订号，逐个比较对象标识
+        roots = tuple(roots)
+        if len(roots) != len(self._roots) or any(a is not b for a, b in zip(roots, self._roots)):
+            diff_children(None, self._roots, roots)
+            self._roots = roots
+
+        root_ids = {id(root) for root in roots}
+        moves = []
+        for node_id, (node, old_parent, old_index) in removed.items():
+            if node_id in added:
+                _, new_parent, new_index = added.pop(node_id)
+                moves.append(ReparentCommand(node, old_parent, old_index, new_parent, new_index))
+            elif _in_scene(node, root_ids):
+                # 移动到了新添加的子树中（例如先创建组再把选中的对象放进去），新父对象尚未被记录
+                new_parent = node.parent
+                siblings = new_parent.children if new_parent else roots
+                new_index = next(i for i, sibling in enumerate(siblings) if sibling is node)
+                moves.append(ReparentCommand(node, old_parent, old_index, new_parent, new_index))
+            else:
+                moves.append(RemoveCommand(node, old_parent, old_index))
+                self._unregister(node)
+        # 添加命令排在最前面：移动命令可能以新添加的组为父对象，重放编辑日志时要先创建出父对象
+        additions = []
+        for node, parent, index in added.values():
+            additions.append(AddCommand(node, parent, index))
+            self._register(node)
+        commands = additions + commands + moves
+
+        if not commands:
+            return None
+        return commands[0] if len(commands) == 1 else BatchCommand(commands)
@@ -7,6 +7,10 @@
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
 from ..model.geometry import OperationMode, GeometryType
 from ..viewmodel.scene_viewmodel import SceneViewModel
+from .commands import SceneChangeRecorder
+from .history import HistoryTimeline
+from .journal import EditJournal
+from .autosave import AutosaveStore, read_save_file, MANIFEST_FORMAT
 import json
 import os
 import datetime
@@ -25,6 +29,7 @@ class ControlViewModel(QObject):
     loadStateCompleted = pyqtSignal(bool)  # 加载状态完成，参数表示是否成功
     undoStateChanged = pyqtSignal(bool)  # 撤销状态变化，参数表示是否可以撤销
     redoStateChanged = pyqtSignal(bool)  # 重做状态变化，参数表示是否可以重做
+    historyChanged = pyqtSignal(int, int, int)  # 历史时间线变化，参数为最早步号、最新步号和当前步号
     
     def __init__(self, scene_viewmodel:SceneViewModel):
         """
@@ -46,12 +51,15 @@ class ControlViewModel(QObject):
         # 确保存档目录存在
         self._save_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "save")
         os.makedirs(self._save_dir, exist_ok=True)
+        # 自动存档按子树内容寻址保存，未修改的子树在多次存档之间共享
+        self._autosave = AutosaveStore(self._save_dir)
         
-        # 初始化撤销/重做相关的属性
-        self._history_files = []  # 历史状态文件列表
-        self._current_history_index = -1  # 当前历史状态索引
-        self._undo_redo_dir = os.path.join(self._save_dir, "history")
-        os.makedirs(self._undo_redo_dir, exist_ok=True)
+        # 初始化撤销/重做相关的属性：内存中的时间线，每一步是只记录修改前后值的命令，定期保存关键帧
+        self._timeline = HistoryTimeline()
+        self._recorder = SceneChangeRecorder()
+        
+        # 崩溃恢复日志：由 start_journal 开始记录，正常退出时由 shutdown 删除
+        self._journal = EditJournal(os.path.join(self._save_dir, "journal"))
         
         # 防止过于频繁的保存，增加节流逻辑
         self._last_save_time = datetime.datetime.now()
@@ -88,8 +96,14 @@ class ControlViewModel(QObject):
         if hasattr(self._scene_viewmodel, 'objectChanged'):
             self._scene_viewmodel.objectChanged.connect(self._on_geometry_modified)
         
-        # 记录初始状态
-        self._record_operation_state()
+        # 5. 连续操作的开始和结束：期间不记录，结束时整个操作记录为一步
+        self._gesture_active = False
+        self._scene_viewmodel.gestureStarted.connect(self._on_gesture_started)
+        self._scene_viewmodel.gestureFinished.connect(self._on_gesture_finished)
+        
+        # 以初始场景作为记录的基准
+        self._recorder.reset(self._scene_viewmodel.geometries)
+        self._timeline.reset(self._scene_viewmodel.geometries)
 
     @property
     def operation_mode(self):
@@ -155,9 +169,8 @@ class ControlViewModel(QObject):
                 self.loadStateCompleted.emit(False)
                 return False
             
-            # 读取JSON文件
-            with open(file_path, 'r', encoding='utf-8') as f:
-                geometries = json.load(f)
+            # 读取JSON文件（自动存档的清单会展开为完整的几何体数据）
+            geometries = read_save_file(file_path)
             
             # 将几何体数据传递给场景视图模型
             success = self._scene_viewmodel.load_geometries_from_data(geometries)
@@ -173,25 +186,19 @@ class ControlViewModel(QObject):
     @pyqtSlot()
     def auto_save_state(self):
         """
-        自动保存当前几何体状态到时间戳命名的文件
+        自动保存当前几何体状态到时间戳命名的存档清单
+        
+        只序列化上一次存档之后修改过的子树，新的数据块和清单在后台线程中写入，写完后发出
+        saveStateCompleted 信号。场景与上一次存档相同时不写入任何文件。
         
         返回:
-            str: 保存的文件路径，如果保存失败则返回None
+            str: 存档清单的路径（场景没有变化时为上一次存档的路径），如果保存失败则返回None
         """
         try:
-            # 创建时间戳文件名
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_path = os.path.join(self._save_dir, f"{timestamp}.json")
-            
-            # 从场景视图模型获取几何体数据
-            geometries = self._scene_viewmodel.get_serializable_geometries()
-            
-            # 写入JSON文件
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(geometries, f, indent=4)
-            
-            # 发送保存完成信号
-            self.saveStateCompleted.emit(file_path)
+            file_path, written = self._autosave.save(self._scene_viewmodel.geometries,
+                                                     on_written=self.saveStateCompleted.emit)
+            if not written:
+                print(f"场景与上一次存档相同，跳过保存: {file_path}")
             return file_path
         except Exception as e:
             print(f"自动保存几何体数据失败: {str(e)}")
@@ -243,8 +250,11 @@ class ControlViewModel(QObject):
             with open(file_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
             
-            # 获取几何体数量
-            geo_count = len(data.get('geometries', []))
+            # 获取几何体数量（自动存档的清单中直接记录了数量）
+            if data.get('format') == MANIFEST_FORMAT:
+                geo_count = data.get('geometry_count', 0)
+            else:
+                geo_count = len(data.get('geometries', []))
             
             return {
                 'path': file_path,
@@ -273,8 +283,7 @@ class ControlViewModel(QObject):
                 print(f"文件不存在: {file_path}")
                 return
             
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = read_save_file(file_path)
             
             print(f"存档版本: {data.get('version', '未知')}")
             print(f"几何体数量: {len(data.get('geometries', []))}")
@@ -305,6 +314,10 @@ class ControlViewModel(QObject):
         几何体被修改、添加或删除时调用的处理函数
         自动触发状态保存
         """
+        # 连续操作进行中，等操作结束时统一记录
+        if self._gesture_active:
+            return
+        
         print("几何体发生变化，准备保存状态...")  # 调试输出
         
         # 如果已经标记为待保存，不再处理
@@ -330,6 +343,19 @@ class ControlViewModel(QObject):
             self._last_save_time = current_time
             self._record_operation_state()
 
+    def _on_gesture_started(self):
+        """连续操作开始：先记录之前尚未记录的修改，使它们不与这次操作合并"""
+        self._save_pending = False
+        self._record_operation_state()
+        self._gesture_active = True
+    
+    def _on_gesture_finished(self):
+        """连续操作结束：把整个操作期间的修改记录为一步"""
+        self._gesture_active = False
+        self._save_pending = False
+        self._last_save_time = datetime.datetime.now()
+        self._record_operation_state()
+
     def _delayed_record_state(self):
         """延迟记录状态，由节流逻辑调用"""
         if self._save_pending:
@@ -338,168 +364,180 @@ class ControlViewModel(QObject):
             self._record_operation_state()
 
     def _record_operation_state(self):
-        """记录操作状态，用于撤销/重做"""
+        """
+        记录操作状态，用于撤销/重做
+
+        只比较上一次记录之后被修改过的几何体，把属性和层级的变化作为一条命令追加到时间线。
+
+        返回:
+            Command: 新记录的命令，没有变化时返回None
+        """
         try:
-            print("正在记录操作状态...")  # 调试输出
-            
-            # 创建时间戳文件名
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_path = os.path.join(self._undo_redo_dir, f"history_{timestamp}.json")
-            
-            # 从场景视图模型获取几何体数据
-            geometries = self._scene_viewmodel.get_serializable_geometries()
-            
-            # 写入JSON文件
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(geometries, f, indent=4)
-            
-            # 如果在历史记录中间进行了新操作，需要清除当前状态之后的所有历史
-            if self._current_history_index < len(self._history_files) - 1:
-                # 删除不再需要的历史文件
-                for old_file in self._history_files[self._current_history_index + 1:]:
-                    if os.path.exists(old_file):
-                        try:
-                            os.remove(old_file)
-                        except:
-                            print(f"无法删除文件: {old_file}")
-                # 截断历史记录列表
-                self._history_files = self._history_files[:self._current_history_index + 1]
-            
-            # 添加新的历史记录
-            self._history_files.append(file_path)
-            self._current_history_index = len(self._history_files) - 1
-            
+            command = self._recorder.capture(self._scene_viewmodel.geometries)
+            if command is None:
+                return None
+
+            # 新操作之后不能再重做
+            self._timeline.push(command, self._scene_viewmodel.geometries)
+            self._journal.log(command, self._scene_viewmodel.geometries)
+
             # 更新撤销/重做状态
-            self.undoStateChanged.emit(self._current_history_index > 0)
-            self.redoStateChanged.emit(False)  # 新操作后不可重做
-            
-            print(f"操作状态已记录，当前历史记录数: {len(self._history_files)}, 索引: {self._current_history_index}")  # 调试输出
-            return file_path
+            self._emit_history_state()
+
+            print(f"操作状态已记录，当前历史步骤: {self._timeline.position}")  # 调试输出
+            return command
         except Exception as e:
             print(f"记录操作状态失败: {str(e)}")
+            import traceback
+            traceback.print_exc()
             return None
-    
+
+    @pyqtSlot(int)
+    def jump_to_step(self, step):
+        """
+        把场景移动到历史时间线上的指定步骤
+
+        参数:
+            step: 目标步号，范围见 history_range
+
+        返回:
+            bool: 是否成功
+        """
+        # 先把尚未记录的修改记下来，保证跳转的起点是最新的状态
+        self._save_pending = False
+        self._record_operation_state()
+
+        scene = self._scene_viewmodel
+        try:
+            success = self._timeline.seek(scene, step)
+        except Exception as e:
+            print(f"跳转历史记录失败: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            # 命令只应用了一部分时场景与历史记录不再一致，以当前场景重新开始记录
+            self._timeline.reset(scene.geometries)
+            success = False
+
+        # 命令本身造成的变化不应该再被记录为新的操作，但要写入崩溃恢复日志
+        delta = self._recorder.capture(scene.geometries)
+        if delta is not None:
+            self._journal.log(delta, scene.geometries)
+
+        # 通知视图刷新；被撤销掉的对象不能继续保持选中
+        scene.update_all_transform_matrices()
+        scene.geometriesChanged.emit()
+        selected = scene.selected_geometry
+        if selected is not None:
+            if scene.contains_geometry(selected):
+                scene.notify_object_changed(selected)
+            else:
+                scene.selected_geometry = None
+
+        self._emit_history_state()
+        return success
+
     @pyqtSlot()
     def undo(self):
         """撤销操作"""
-        if self._current_history_index > 0:
-            print(f"执行撤销，从 {self._current_history_index} 到 {self._current_history_index - 1}")
-            self._current_history_index -= 1
-            file_path = self._history_files[self._current_history_index]
-            
-            try:
-                # 确保文件存在
-                if not os.path.exists(file_path):
-                    print(f"文件不存在: {file_path}")
-                    return False
-                
-                # 读取JSON文件
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    geometries = json.load(f)
-                
-                # 暂时禁用状态记录，防止加载过程中触发新的记录
-                original_pending = self._save_pending
-                self._save_pending = True
-                
-                # 将几何体数据传递给场景视图模型
-                success = self._scene_viewmodel.load_geometries_from_data(geometries)
-                
-                # 恢复状态记录设置
-                self._save_pending = original_pending
-                
-                # 发送状态变化信号
-                self.undoStateChanged.emit(self._current_history_index > 0)
-                self.redoStateChanged.emit(self._current_history_index < len(self._history_files) - 1)
-                
-                print(f"撤销{'成功' if success else '失败'}")
-                return success
-            except Exception as e:
-                print(f"撤销操作失败: {str(e)}")
-                return False
-        
+        if self.can_undo() and self.jump_to_step(self._timeline.position - 1):
+            print("撤销成功")
+            return True
         print("无法撤销，没有更早的历史记录")
         return False
-    
+
     @pyqtSlot()
     def redo(self):
         """重做操作"""
-        if self._current_history_index < len(self._history_files) - 1:
-            print(f"执行重做，从 {self._current_history_index} 到 {self._current_history_index + 1}")
-            self._current_history_index += 1
-            file_path = self._history_files[self._current_history_index]
-            
-            try:
-                # 确保文件存在
-                if not os.path.exists(file_path):
-                    print(f"文件不存在: {file_path}")
-                    return False
-                
-                # 读取JSON文件
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    geometries = json.load(f)
-                
-                # 暂时禁用状态记录，防止加载过程中触发新的记录
-                original_pending = self._save_pending
-                self._save_pending = True
-                
-                # 将几何体数据传递给场景视图模型
-                success = self._scene_viewmodel.load_geometries_from_data(geometries)
-                
-                # 恢复状态记录设置
-                self._save_pending = original_pending
-                
-                # 发送状态变化信号
-                self.undoStateChanged.emit(self._current_history_index > 0)
-                self.redoStateChanged.emit(self._current_history_index < len(self._history_files) - 1)
-                
-                print(f"重做{'成功' if success else '失败'}")
-                return success
-            except Exception as e:
-                print(f"重做操作失败: {str(e)}")
-                return False
-        
+        if self.can_redo() and self.jump_to_step(self._timeline.position + 1):
+            print("重做成功")
+            return True
         print("无法重做，没有更新的历史记录")
         return False
-    
+
+    def history_range(self):
+        """
+        获取历史时间线的范围
+
+        返回:
+            tuple: (最早步号, 最新步号, 当前步号)
+        """
+        return self._timeline.first_step, self._timeline.last_step, self._timeline.position
+
+    @property
+    def history_memory_budget(self):
+        """历史记录的内存预算（字节），超出时淘汰最早的关键帧"""
+        return self._timeline.memory_budget
+
+    @history_memory_budget.setter
+    def history_memory_budget(self, value):
+        """设置历史记录的内存预算"""
+        self._timeline.memory_budget = value
+        self._emit_history_state()
+
+    def _emit_history_state(self):
+        """发出撤销/重做状态和时间线范围的变化"""
+        self.undoStateChanged.emit(self.can_undo())
+        self.redoStateChanged.emit(self.can_redo())
+        self.historyChanged.emit(*self.history_range())
+
     def clear_history(self):
-        """清除所有历史记录"""
+        """清除所有历史记录，以当前场景作为新的基准"""
+        self._recorder.reset(self._scene_viewmodel.geometries)
+        self._timeline.reset(self._scene_viewmodel.geometries)
+
+        # 更新撤销/重做状态
+        self._emit_history_state()
+
+        print("历史记录已清除")
+        return True
+
+    def has_crash_journal(self):
+        """上一次运行是否没有正常退出，留下了可以重放的编辑日志"""
+        return self._journal.has_recovery_data()
+
+    def recover_from_journal(self):
+        """
+        重放上一次运行留下的编辑日志，恢复异常退出前的场景
+
+        恢复后的场景作为新的历史起点。
+
+        返回:
+            bool: 是否成功
+        """
+        scene = self._scene_viewmodel
         try:
-            # 删除所有历史文件
-            for file_path in self._history_files:
-                if os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                    except Exception as e:
-                        print(f"删除文件失败: {file_path} - {str(e)}")
-            
-            # 清除历史目录中的所有文件（以防有未包含在self._history_files中的文件）
-            if os.path.exists(self._undo_redo_dir):
-                for file_name in os.listdir(self._undo_redo_dir):
-                    file_path = os.path.join(self._undo_redo_dir, file_name)
-                    if os.path.isfile(file_path) and file_path.endswith('.json'):
-                        try:
-                            os.remove(file_path)
-                        except Exception as e:
-                            print(f"删除额外文件失败: {file_path} - {str(e)}")
-            
-            # 重置历史记录
-            self._history_files = []
-            self._current_history_index = -1
-            
-            # 更新撤销/重做状态
-            self.undoStateChanged.emit(False)
-            self.redoStateChanged.emit(False)
-            
-            print("历史记录已清除")
-            return True
+            count = self._journal.replay(scene)
         except Exception as e:
-            print(f"清除历史记录失败: {str(e)}")
+            print(f"重放编辑日志失败: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            count = -1
+
+        scene.update_all_transform_matrices()
+        scene.clear_selection()
+        scene.geometriesChanged.emit()
+        self.clear_history()
+        if count < 0:
             return False
-    
+        print(f"已从编辑日志恢复场景，重放了 {count} 条记录")
+        return True
+
+    def start_journal(self):
+        """以当前场景为检查点开始写崩溃恢复日志（会覆盖上一次留下的日志）"""
+        try:
+            self._journal.start(self._scene_viewmodel.geometries)
+        except Exception as e:
+            print(f"启动编辑日志失败: {str(e)}")
+
+    def shutdown(self):
+        """正常退出：停止写日志并删除日志文件，等待自动存档写完"""
+        self._journal.close(discard=True)
+        self._autosave.close()
+
     def can_undo(self):
         """检查是否可以撤销"""
-        return self._current_history_index > 0
+        return self._timeline.position > self._timeline.first_step
     
     def can_redo(self):
         """检查是否可以重做"""
-        return self._current_history_index < len(self._history_files) - 1
+        return self._timeline.position < self._timeline.last_step
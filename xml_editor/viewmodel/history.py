@@ -0,0 +1,159 @@
+"""
+历史记录时间线
+
+撤销/重做历史按“关键帧 + 增量”保存：每一步是一条只记录修改前后值的命令，每隔固定步数
+额外保存一份完整的场景关键帧。跳转到任意一步时，从当前状态或最近的关键帧出发，
+最多应用关键帧间隔那么多条命令。
+"""
+
+from .commands import SceneSnapshot
+
+
+class HistoryTimeline:
+    """
+    撤销/重做时间线
+
+    第 first_step 步到第 last_step 步之间的任意一步都可以直接跳转。_commands[i] 把第
+    first_step + i 步变为下一步；关键帧保存在步号为 keyframe_interval 整数倍的位置
+    （以及最早的一步）。总内存超过预算时淘汰最早的关键帧及其之后到下一个关键帧为止的命令。
+    """
+    # 默认每隔多少步保存一个关键帧
+    KEYFRAME_INTERVAL = 32
+    # 默认的内存预算（字节）
+    MEMORY_BUDGET = 64 * 1024 * 1024
+
+    def __init__(self, keyframe_interval=None, memory_budget=None):
+        """
+        参数:
+            keyframe_interval: 关键帧间隔步数
+            memory_budget: 历史记录的内存预算（字节）
+        """
+        self.keyframe_interval = keyframe_interval or self.KEYFRAME_INTERVAL
+        self._memory_budget = memory_budget or self.MEMORY_BUDGET
+        self._commands = []
+        self._sizes = []  # 每条命令的估计大小
+        self._keyframes = {}  # 步号 -> SceneSnapshot
+        self._first = 0
+        self._position = 0
+        self._memory = 0
+
+    @property
+    def first_step(self):
+        """最早可以到达的步号"""
+        return self._first
+
+    @property
+    def last_step(self):
+        """最新的步号"""
+        return self._first + len(self._commands)
+
+    @property
+    def position(self):
+        """当前所在的步号"""
+        return self._position
+
+    @property
+    def memory_usage(self):
+        """命令和关键帧占用内存的估计（字节）"""
+        return self._memory
+
+    @property
+    def memory_budget(self):
+        """内存预算（字节）"""
+        return self._memory_budget
+
+    @memory_budget.setter
+    def memory_budget(self, value):
+        """修改内存预算，超出时立即淘汰旧的历史"""
+        self._memory_budget = value
+        self._evict()
+
+    def reset(self, roots):
+        """清空历史，以当前场景作为第0步"""
+        self._commands = []
+        self._sizes = []
+        self._first = 0
+        self._position = 0
+        self._keyframes = {0: SceneSnapshot(roots)}
+        self._memory = self._keyframes[0].nbytes
+
+    def push(self, command, roots):
+        """
+        在当前位置之后追加一步，丢弃当前位置之后原有的步骤
+
+        参数:
+            command: 描述这一步修改的命令
+            roots: 应用命令之后场景的顶层几何体列表，用于按需保存关键帧
+        """
+        if self._position < self.last_step:
+            keep = self._position - self._first
+            self._memory -= sum(self._sizes[keep:])
+            del self._commands[keep:]
+            del self._sizes[keep:]
+            for step in [step for step in self._keyframes if step > self._position]:
+                self._memory -= self._keyframes.pop(step).nbytes
+
+        size = command.estimate_size()
+        self._commands.append(command)
+        self._sizes.append(size)
+        self._memory += size
+        self._position += 1
+
+        if self._position % self.keyframe_interval == 0:
+            keyframe = SceneSnapshot(roots)
+            self._keyframes[self._position] = keyframe
+            self._memory += keyframe.nbytes
+
+        self._evict()
+
+    def seek(self, scene, step):
+        """
+        把场景移动到指定的步骤
+
+        距离较远时先恢复离目标最近的关键帧，再逐条应用命令，因此应用的命令数不超过关键帧间隔。
+
+        参数:
+            scene: 场景视图模型
+            step: 目标步号，超出范围时截断到可到达的范围内
+
+        返回:
+            bool: 场景是否发生了变化
+        """
+        step = max(self._first, min(step, self.last_step))
+        if step == self._position:
+            return False
+
+        best_distance = abs(step - self._position)
+        best_keyframe = None
+        if best_distance > self.keyframe_interval:
+            floor = step - step % self.keyframe_interval
+            for candidate in (floor, floor + self.keyframe_interval, self._first):
+                if candidate in self._keyframes and abs(step - candidate) < best_distance:
+                    best_distance = abs(step - candidate)
+                    best_keyframe = candidate
+        if best_keyframe is not None:
+            self._keyframes[best_keyframe].restore(scene)
+            self._position = best_keyframe
+
+        while self._position < step:
+            self._commands[self._position - self._first].redo(scene)
+            self._position += 1
+        while self._position > step:
+            self._commands[self._position - 1 - self._first].undo(scene)
+            self._position -= 1
+        return True
+
+    def _evict(self):
+        """超出内存预算时淘汰最早的关键帧，直到下一个关键帧之前的命令一起丢弃"""
+        while self._memory > self._memory_budget:
+            steps = sorted(self._keyframes)
+            # 至少保留一个关键帧，且不能丢弃当前位置之前需要的历史
+            if len(steps) < 2 or steps[1] > self._position:
+                break
+            oldest, next_first = steps[0], steps[1]
+            self._memory -= self._keyframes.pop(oldest).nbytes
+            drop = next_first - self._first
+            self._memory -= sum(self._sizes[:drop])
+            del self._commands[:drop]
+            del self._sizes[:drop]
+            self._first = next_first
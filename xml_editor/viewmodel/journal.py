@@ -0,0 +1,332 @@
+"""
+崩溃恢复日志
+
+编辑过程中把每一步修改（与撤销/重做使用的同一种命令）追加到一个紧凑的日志文件，并定期写入
+整个场景的检查点。UI线程只把命令转换成简单的记录放进队列；JSON编码、写文件和fsync都在
+后台线程中进行，并且一批记录只fsync一次。编辑器异常退出后，从最近的检查点出发按顺序重放
+日志中的记录即可恢复场景。
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import weakref
+import numpy as np
+from ..model.geometry import Geometry, GeometryGroup
+from .commands import (SceneSnapshot, SetPropertyCommand, AddCommand, RemoveCommand,
+                       ReparentCommand, BatchCommand, apply_commands)
+
+
+def _to_json(value):
+    """json.dumps 的 default 钩子：numpy 数组和标量转换为普通列表/数值"""
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+class EditJournal:
+    """
+    编辑日志
+
+    日志中的节点用会话内唯一的整数编号表示。检查点保存全部节点的编号、类型、层级和属性；
+    之后的每条记录带有递增的序号，写入检查点之后清空日志，检查点中记录的序号之前的记录在重放时跳过，
+    因此写检查点和清空日志之间崩溃也不会重复应用。
+    """
+    JOURNAL_FILE = "journal.log"
+    CHECKPOINT_FILE = "checkpoint.json"
+    # 每隔多少条记录写一次检查点
+    CHECKPOINT_INTERVAL = 500
+    # 距上一个检查点的记录累计超过多少字节（估计值）时写检查点；单条很大的命令直接用检查点代替
+    CHECKPOINT_BYTES = 8 * 1024 * 1024
+    # 后台线程收集一批记录的最长等待时间（秒），一批只fsync一次
+    FLUSH_INTERVAL = 0.2
+
+    def __init__(self, directory):
+        """
+        参数:
+            directory: 存放日志和检查点的目录
+        """
+        self._directory = directory
+        self._ids = weakref.WeakKeyDictionary()  # 节点 -> 编号
+        self._next_id = 1
+        self._seq = 0
+        self._records_since_checkpoint = 0
+        self._bytes_since_checkpoint = 0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    @property
+    def journal_path(self):
+        return os.path.join(self._directory, self.JOURNAL_FILE)
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self._directory, self.CHECKPOINT_FILE)
+
+    @property
+    def running(self):
+        """后台写入线程是否在运行"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def has_recovery_data(self):
+        """目录中是否留有上一次未正常关闭的会话的检查点"""
+        return not self.running and os.path.exists(self.checkpoint_path)
+
+    def start(self, roots):
+        """
+        开始记录：启动后台线程，并以当前场景写入第一个检查点（同时丢弃旧的日志）
+
+        参数:
+            roots: 场景的顶层几何体列表
+        """
+        if self.running:
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        self._ids = weakref.WeakKeyDictionary()
+        self._next_id = 1
+        self._seq = 0
+        self._thread = threading.Thread(target=self._run, name="EditJournalWriter", daemon=True)
+        self._thread.start()
+        self.checkpoint(roots)
+
+    def log(self, command, roots):
+        """
+        追加一条命令（按重做的方向）
+
+        只做与修改规模成正比的转换，编码和写盘都交给后台线程。
+
+        参数:
+            command: 场景修改记录器生成的命令
+            roots: 应用命令之后场景的顶层几何体列表，需要写检查点时使用
+        """
+        if not self.running:
+            return
+        size = command.estimate_size()
+        if (self._records_since_checkpoint + 1 >= self.CHECKPOINT_INTERVAL or
+                self._bytes_since_checkpoint + size >= self.CHECKPOINT_BYTES):
+            # 检查点已经包含了这条命令的结果
+            self.checkpoint(roots)
+            return
+        self._seq += 1
+        record = self._encode_command(command)
+        record['seq'] = self._seq
+        self._queue.put(('record', record))
+        self._records_since_checkpoint += 1
+        self._bytes_since_checkpoint += size
+
+    def checkpoint(self, roots):
+        """
+        写入整个场景的检查点
+
+        UI线程只复制一份场景快照，编码和原子替换文件在后台线程中完成。
+        """
+        if not self.running:
+            return
+        snapshot = SceneSnapshot(roots)
+        self._queue.put(('checkpoint', {'seq': self._seq, 'tree': self._encode_snapshot(snapshot)}))
+        self._records_since_checkpoint = 0
+        self._bytes_since_checkpoint = 0
+
+    def close(self, discard=True, timeout=5.0):
+        """
+        停止记录，等待后台线程把已提交的记录写完
+
+        参数:
+            discard: 是否删除日志和检查点（正常退出时删除，下次启动就不会提示恢复）
+            timeout: 等待后台线程的最长时间（秒）
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        finished = not self._thread.is_alive()
+        self._thread = None
+        if discard and finished:
+            for path in (self.journal_path, self.checkpoint_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _node_id(self, node):
+        """节点在日志中的编号，第一次出现时分配"""
+        node_id = self._ids.get(node)
+        if node_id is None:
+            node_id = self._ids[node] = self._next_id
+            self._next_id += 1
+        return node_id
+
+    def _encode_snapshot(self, snapshot):
+        """把子树快照转换为记录；数组留给后台线程编码"""
+        return {
+            'ids': [self._node_id(node) for node in snapshot.nodes],
+            'types': [node.type for node in snapshot.nodes],
+            'parents': snapshot.parents,
+            'names': snapshot.names,
+            'arrays': dict(snapshot.arrays),
+        }
+
+    def _encode_command(self, command):
+        """把命令转换为记录"""
+        if isinstance(command, BatchCommand):
+            return {'op': 'batch', 'items': [self._encode_command(item) for item in command.commands]}
+        if isinstance(command, SetPropertyCommand):
+            return {'op': 'set', 'id': self._node_id(command.geometry), 'name': command.name,
+                    'value': command.new_value}
+        if isinstance(command, RemoveCommand):
+            return {'op': 'remove', 'id': self._node_id(command.geometry)}
+        if isinstance(command, AddCommand):
+            parent = command.parent
+            return {'op': 'add', 'parent': self._node_id(parent) if parent is not None else None,
+                    'index': command.index, 'tree': self._encode_snapshot(command.snapshot)}
+        if isinstance(command, ReparentCommand):
+            parent = command.new_parent
+            return {'op': 'move', 'id': self._node_id(command.geometry),
+                    'parent': self._node_id(parent) if parent is not None else None,
+                    'index': command.new_index}
+        raise TypeError(f"无法记录的命令类型: {type(command).__name__}")
+
+    def _run(self):
+        """后台写入线程：成批取出记录，写入后统一flush和fsync"""
+        journal = None
+        try:
+            journal = open(self.journal_path, 'a', encoding='utf-8')
+            while True:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self.FLUSH_INTERVAL
+                while batch[-1] is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+
+                for item in batch:
+                    if item is None:
+                        break
+                    kind, payload = item
+                    if kind == 'checkpoint':
+                        journal.flush()
+                        os.fsync(journal.fileno())
+                        self._write_checkpoint(payload)
+                        # 检查点之前的记录不再需要
+                        journal.close()
+                        journal = open(self.journal_path, 'w', encoding='utf-8')
+                    else:
+                        journal.write(json.dumps(payload, separators=(',', ':'), default=_to_json))
+                        journal.write('\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+                if batch[-1] is None:
+                    return
+        except Exception as e:
+            print(f"写入编辑日志失败: {str(e)}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            if journal is not None:
+                journal.close()
+
+    def _write_checkpoint(self, payload):
+        """先写临时文件再原子替换，崩溃时总能留下一个完整的检查点"""
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, separators=(',', ':'), default=_to_json)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+    def replay(self, scene):
+        """
+        从检查点和日志恢复场景
+
+        检查点直接恢复为整个场景；之后的记录转换回命令按重做的方向应用。日志末尾
+        写了一半的记录（崩溃时常见）及其之后的内容被忽略。
+
+        参数:
+            scene: 场景视图模型
+
+        返回:
+            int: 重放的记录条数，无法恢复时返回-1
+        """
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except Exception as e:
+            print(f"读取检查点失败: {str(e)}")
+            return -1
+
+        nodes = {}  # 编号 -> 节点
+        snapshot = self._decode_snapshot(checkpoint['tree'], nodes)
+        snapshot.restore(scene)
+
+        count = 0
+        records = []
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        print("编辑日志末尾的记录不完整，已忽略")
+                        break
+        except FileNotFoundError:
+            pass
+
+        for record in records:
+            if record.get('seq', 0) <= checkpoint['seq']:
+                continue
+            command = self._decode_command(record, nodes)
+            if command is not None:
+                apply_commands(scene, [command], undo=False)
+                count += 1
+        return count
+
+    @staticmethod
+    def _decode_snapshot(tree, nodes):
+        """把记录转换回子树快照，已存在的编号复用原来的节点"""
+        tree_nodes = []
+        for node_id, geo_type, name in zip(tree['ids'], tree['types'], tree['names']):
+            node = nodes.get(node_id)
+            if node is None:
+                if geo_type == 'group':
+                    node = GeometryGroup(name=name)
+                else:
+                    node = Geometry(geo_type=geo_type, name=name)
+                nodes[node_id] = node
+            tree_nodes.append(node)
+        return SceneSnapshot.from_data(tree_nodes, tree['parents'], tree['names'], tree['arrays'])
+
+    @classmethod
+    def _decode_command(cls, record, nodes):
+        """把记录转换回命令；引用了未知节点的记录被跳过"""
+        op = record['op']
+        if op == 'batch':
+            commands = [cls._decode_command(item, nodes) for item in record['items']]
+            commands = [command for command in commands if command is not None]
+            return BatchCommand(commands) if commands else None
+
+        parent_id = record.get('parent')
+        parent = nodes.get(parent_id) if parent_id is not None else None
+        if op == 'add':
+            snapshot = cls._decode_snapshot(record['tree'], nodes)
+            return AddCommand(snapshot.nodes[0], parent, record['index'], snapshot)
+
+        node = nodes.get(record['id'])
+        if node is None or (parent_id is not None and parent is None):
+            print(f"编辑日志引用了未知的节点: {record}")
+            return None
+        if op == 'set':
+            value = record['value']
+            return SetPropertyCommand(node, record['name'], None,
+                                      value if record['name'] == 'name' else np.array(value))
+        if op == 'remove':
+            return RemoveCommand(node, None, None, snapshot=SceneSnapshot([]))
+        if op == 'move':
+            return ReparentCommand(node, None, None, parent, record['index'])
+        print(f"未知的编辑日志记录: {op}")
+        return None
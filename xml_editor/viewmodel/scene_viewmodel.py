@@ -10,10 +10,13 @@ import os
 
 from ..model.geometry import (
     Geometry, GeometryGroup, GeometryType, 
-    Material, OperationMode
+    Material, OperationMode, update_transforms_batch
 )
 from ..model.xml_parser import XMLParser
 from ..model.raycaster import GeometryRaycaster, RaycastResult
+from ..model.overlap import OverlapDetector
+from ..model.camera import Camera
+from ..model.scene_arrays import SceneArrays
 
 class SceneViewModel(QObject):
     """
@@ -33,21 +36,34 @@ class SceneViewModel(QObject):
     positionChanged = pyqtSignal(object)  # 位置变化信号
     rotationChanged = pyqtSignal(object)  # 旋转变化信号
     scaleChanged = pyqtSignal(object)     # 缩放变化信号
+    gestureStarted = pyqtSignal()  # 连续操作（如拖动变换控制器）开始
+    gestureFinished = pyqtSignal()  # 连续操作结束，期间的修改作为一次操作记录
     
-    def __init__(self):
+    def __init__(self, use_scene_arrays=False):
+        """
+        初始化场景视图模型
+        
+        参数:
+            use_scene_arrays: 是否把场景数值数据集中保存在 SceneArrays 中
+        """
         super().__init__()
         self._geometries = []  # 场景中的几何体列表
+        self._use_scene_arrays = use_scene_arrays
+        self._scene_arrays = SceneArrays() if use_scene_arrays else None  # 可选的结构化数组存储
+        self._export_cache = {}  # 保存时按顶层对象缓存的XML片段，见 XMLParser.export_mujoco_xml
         self._selected_geo = None  # 当前选中的几何体
         self._operation_mode = OperationMode.OBSERVE  # 当前操作模式
         self._raycaster = None  # 射线投射器
-        self._camera_config = {
+        self._overlap_detector = OverlapDetector()  # 穿插检测器，场景修改后增量检测
+        self._camera = Camera({
             'position': np.array([0, 0, 10]),
             'target': np.array([0, 0, 0]),
             'up': np.array([0, 1, 0]),
             'view_matrix': np.eye(4),
             'projection_matrix': np.eye(4)
-        }
+        })  # 摄像机，缓存反投影矩阵，射线投射器共享同一个对象
         self._use_local_coords = True
+        self._gesture_depth = 0  # 正在进行的连续操作的嵌套层数
         self.hierarchyViewModel = None  # 添加 hierarchyViewModel 属性
     
     @property
@@ -59,9 +75,23 @@ class SceneViewModel(QObject):
     def geometries(self, value):
         """设置几何体列表并发出通知"""
         self._geometries = value
+        self._reset_scene_arrays()
         self._update_raycaster()
+        self._overlap_detector.invalidate()
         self.geometriesChanged.emit()
     
+    @property
+    def scene_arrays(self):
+        """获取场景的结构化数组存储，未启用时为None"""
+        return self._scene_arrays
+    
+    def _reset_scene_arrays(self):
+        """为当前场景重新建立结构化数组存储"""
+        if not self._use_scene_arrays:
+            return
+        self._scene_arrays = SceneArrays(capacity=max(1024, 2 * len(self._geometries)))
+        self._scene_arrays.attach(self._geometries)
+    
     @property
     def selected_geometry(self):
         """获取当前选中的几何体"""
@@ -121,18 +151,29 @@ class SceneViewModel(QObject):
             # 通知OpenGL视图更新坐标系模式
             self.coordinateSystemChanged.emit(value)
     
+    @property
+    def camera(self):
+        """获取摄像机"""
+        return self._camera
+    
     def set_camera_config(self, config):
-        """设置摄像机配置"""
-        self._camera_config.update(config)
-        self._update_raycaster()
+        """
+        设置摄像机配置
+        
+        视图每一帧都会调用，射线投射器与视图模型共享同一个摄像机，这里不需要重建射线投射器，
+        也不能让其加速结构失效。
+        """
+        self._camera.update(config)
+        if self._raycaster is None:
+            self._raycaster = GeometryRaycaster(self._camera, self._geometries)
     
     def _update_raycaster(self):
         """更新射线投射器"""
         if self._raycaster:
-            self._raycaster.update_camera(self._camera_config)
+            self._raycaster.update_camera(self._camera)
             self._raycaster.update_geometries(self._geometries)
         else:
-            self._raycaster = GeometryRaycaster(self._camera_config, self._geometries)
+            self._raycaster = GeometryRaycaster(self._camera, self._geometries)
     
     def create_geometry(self, geo_type, name=None, position=(0, 0, 0), size=(1, 1, 1), rotation=(0, 0, 0), parent=None):
         """
@@ -170,6 +211,8 @@ class SceneViewModel(QObject):
             parent.add_child(geometry)
         else:
             self._geometries.append(geometry)
+            if self._scene_arrays is not None:
+                self._scene_arrays.attach(geometry)
         
         # 触发更新
         self.geometriesChanged.emit()
@@ -207,6 +250,8 @@ class SceneViewModel(QObject):
             parent.add_child(group)
         else:
             self._geometries.append(group)
+            if self._scene_arrays is not None:
+                self._scene_arrays.attach(group)
         
         # 触发更新
         self.geometriesChanged.emit()
@@ -231,11 +276,58 @@ class SceneViewModel(QObject):
         elif geometry in self._geometries:
             self._geometries.remove(geometry)
         
+        # 释放其在结构化数组存储中占用的行
+        if self._scene_arrays is not None:
+            self._scene_arrays.detach(geometry)
+        
         # 触发更新
         self.geometriesChanged.emit()
         self.geometryDeleted.emit(geometry)
         print(f"发射了 geometryDeleted 信号: {geometry.name}")
     
+    def insert_geometry(self, geometry, parent=None, index=None):
+        """
+        把已有的几何体（连同其子树）放回场景，不发出信号，供撤销/重做使用
+
+        参数:
+            geometry: 要插入的几何体
+            parent: 父对象，为None时放到顶层
+            index: 在兄弟节点中的位置，为None时追加到末尾
+        """
+        siblings = parent.children if parent else self._geometries
+        if index is None or index > len(siblings):
+            index = len(siblings)
+
+        if parent:
+            parent.insert_child(index, geometry)
+        else:
+            self._geometries.insert(index, geometry)
+            geometry.parent = None
+            if self._scene_arrays is not None:
+                self._scene_arrays.attach(geometry)
+
+    def detach_geometry(self, geometry):
+        """
+        把几何体（连同其子树）从场景中取下，不发出信号，供撤销/重做使用
+
+        参数:
+            geometry: 要取下的几何体
+        """
+        if geometry.parent:
+            geometry.parent.remove_child(geometry)
+        elif geometry in self._geometries:
+            self._geometries.remove(geometry)
+
+        if self._scene_arrays is not None:
+            self._scene_arrays.detach(geometry)
+
+    def contains_geometry(self, geometry):
+        """几何体当前是否挂在场景的层级结构中"""
+        root = geometry
+        while root.parent is not None:
+            root = root.parent
+        return any(root is geo for geo in self._geometries)
+
     def select_at(self, screen_x, screen_y, viewport_width, viewport_height):
         """
         在指定屏幕坐标选择几何体
@@ -273,6 +365,8 @@ class SceneViewModel(QObject):
         """
         try:
             self._geometries = XMLParser.load(filename)
+            self._export_cache.clear()
+            self._reset_scene_arrays()
             self._update_raycaster()
             self.geometriesChanged.emit()
             return True
@@ -295,7 +389,8 @@ class SceneViewModel(QObject):
             _, ext = os.path.splitext(filename)
             
             if ext.lower() == '.xml':
-                return XMLParser.export_mujoco_xml(filename, self._geometries)
+                # 只重新生成修订号变化过的顶层子树
+                return XMLParser.export_mujoco_xml(filename, self._geometries, cache=self._export_cache)
             else:
                 return XMLParser.export_enhanced_xml(filename, self._geometries)
         except Exception as e:
@@ -358,14 +453,7 @@ class SceneViewModel(QObject):
             else:
                 return False
                 
-            # 如果更新了变换相关属性，更新变换矩阵
-            if property_name in ('position', 'size', 'rotation'):
-                geometry.update_transform_matrix()
-                
-                # 递归更新所有子对象的变换矩阵
-                if hasattr(geometry, 'children') and geometry.children:
-                    for child in geometry.children:
-                        self._update_transform_recursive(child)
+            # 变换相关属性的setter会使该对象的子树矩阵失效，下次读取时自动重新计算
             
             # 触发更新
             self.geometriesChanged.emit()
@@ -412,20 +500,12 @@ class SceneViewModel(QObject):
         返回:
             (ray_origin, ray_direction): 射线起点和方向
         """
-        # 转换为归一化设备坐标(NDC)
-        ndc_x = (2.0 * screen_x / viewport_width) - 1.0
-        ndc_y = 1.0 - (2.0 * screen_y / viewport_height)  # Y轴方向翻转
-        
-        # 获取近平面和远平面上的点
-        near_point = self.unproject_point(ndc_x, ndc_y, 0.0)
-        far_point = self.unproject_point(ndc_x, ndc_y, 1.0)
+        # 近平面和远平面上的点由摄像机缓存的矩阵一次求出，不需要矩阵求逆
+        _, ray_direction = self._camera.screen_to_ray(screen_x, screen_y, viewport_width, viewport_height,
+                                                      near_z=0.0, far_z=1.0)
         
         # 射线起点(相机位置)
-        ray_origin = np.array(self._camera_config['position'])
-        
-        # 射线方向
-        ray_direction = np.array(far_point) - np.array(near_point)
-        ray_direction = ray_direction / np.linalg.norm(ray_direction)  # 归一化
+        ray_origin = np.array(self._camera.position)
         
         return (ray_origin, ray_direction)
     
@@ -439,25 +519,8 @@ class SceneViewModel(QObject):
         返回:
             世界坐标(x, y, z)
         """
-        # 获取投影和视图矩阵
-        proj_matrix = self._camera_config['projection_matrix']
-        view_matrix = self._camera_config['view_matrix']
-        
-        # 计算视图投影矩阵的逆矩阵
-        view_proj = np.matmul(proj_matrix, view_matrix)
-        inv_view_proj = np.linalg.inv(view_proj)
-        
-        # 将NDC坐标转换为齐次裁剪空间坐标
-        clip_coords = np.array([ndc_x, ndc_y, ndc_z, 1.0])
-        
-        # 应用逆矩阵转换为世界坐标
-        world_coords = np.matmul(inv_view_proj, clip_coords)
-        
-        # 透视除法
-        if world_coords[3] != 0:
-            world_coords = world_coords / world_coords[3]
-        
-        return world_coords[:3]
+        # 逆视图投影矩阵由摄像机按修订号缓存
+        return self._camera.unproject(ndc_x, ndc_y, ndc_z)
     
     def get_geometry_at(self, screen_x, screen_y, viewport_width, viewport_height):
         """
@@ -479,35 +542,80 @@ class SceneViewModel(QObject):
         
         # 没有击中任何几何体
         return None
-    
-    def update_all_transform_matrices(self):
+
+    def get_geometries_at(self, screen_x, screen_y, viewport_width, viewport_height,
+                          max_distance=float('inf'), filter=None, max_hits=None):
         """
-        更新场景中所有几何体的变换矩阵
-        
-        从根节点开始递归更新层次结构中的所有变换矩阵
+        获取指定屏幕坐标处射线命中的所有几何体，但不改变选择状态
+
+        参数:
+            screen_x, screen_y: 屏幕坐标
+            viewport_width, viewport_height: 视口尺寸
+            max_distance: 最大检测距离
+            filter: RaycastFilter 或过滤函数，为None时只检测可见几何体
+            max_hits: 最多返回的命中数量
+
+        返回:
+            list: RaycastResult 列表，按距离由近到远排列
         """
-        # 获取场景中的顶层节点
-        top_level_objects = self.get_all_geometries()
-        
-        # 递归更新所有节点的变换矩阵
-        for obj in top_level_objects:
-            self._update_object_transform_recursive(obj)
-    
-    def _update_object_transform_recursive(self, obj):
+        ray = self._camera.screen_to_ray(screen_x, screen_y, viewport_width, viewport_height)
+        return self._raycaster.raycast_all(ray, max_distance, filter, max_hits)
+
+    def cycle_selection_at(self, screen_x, screen_y, viewport_width, viewport_height):
         """
-        递归更新对象及其子对象的变换矩阵
-        
+        在指定屏幕坐标处循环选择层叠的几何体
+
+        当前选中的对象位于该处时选中它后面的下一个几何体，已经是最后一个时清除选择；
+        否则选中最近的几何体。在同一位置重复点击即可依次选中被遮挡的对象。
+
         参数:
-            obj: 要更新的对象
+            screen_x, screen_y: 屏幕坐标
+            viewport_width, viewport_height: 视口尺寸
+
+        返回:
+            选中的几何体，没有选中时返回None
         """
-        # 确保对象有update_transform_matrix方法
-        if hasattr(obj, 'update_transform_matrix'):
-            obj.update_transform_matrix()
+        stack = [hit.geometry for hit in self.get_geometries_at(screen_x, screen_y, viewport_width, viewport_height)]
+        current = self.selected_geometry
+        index = next((i for i, geo in enumerate(stack) if geo is current), -1)
+        if index + 1 < len(stack):
+            self.selected_geometry = stack[index + 1]
+        else:
+            self.clear_selection()
+        return self.selected_geometry
+
+    def find_overlapping_geometries(self):
+        """
+        检测场景初始姿态下相互穿插的几何体
+
+        同一父对象下、以及父子对象中的几何体之间不报告。
+
+        返回:
+            list: (几何体, 几何体) 元组列表，按场景顺序排列
+        """
+        return self._overlap_detector.find_overlaps(self._geometries)
+
+    def get_geometries_in_rect(self, x0, y0, x1, y1, viewport_width, viewport_height, contain=False):
+        """
+        获取屏幕矩形选框内的所有可见几何体，但不改变选择状态
+
+        参数:
+            x0, y0, x1, y1: 选框两个对角的屏幕坐标
+            viewport_width, viewport_height: 视口尺寸
+            contain: 为True时只返回投影完全落在选框内的几何体，否则返回与选框相交的几何体
+
+        返回:
+            list: 几何体列表
+        """
+        return self._raycaster.select_in_rect(x0, y0, x1, y1, viewport_width, viewport_height, contain)
+
+    def update_all_transform_matrices(self):
+        """
+        更新场景中所有几何体的变换矩阵
         
-        # 如果对象有子对象，递归更新它们
-        if hasattr(obj, 'children'):
-            for child in obj.children:
-                self._update_object_transform_recursive(child)
+        从根节点开始逐层批量更新，每一层只对标记为脏的节点调用一次向量化计算
+        """
+        update_transforms_batch(self._geometries)
     
     def add_geometry(self, geometry_type, name=None, position=None, size=None, rotation=None, parent=None):
         """
@@ -629,6 +737,7 @@ class SceneViewModel(QObject):
             
             # 清除当前场景中的所有几何体
             self._geometries = []
+            self._reset_scene_arrays()
             
             # 创建ID到几何体的映射，用于处理父子关系
             id_to_geo = {}
@@ -743,8 +852,34 @@ class SceneViewModel(QObject):
         清除场景中的所有几何体
         """
         self._geometries = []
+        self._export_cache.clear()
+        self._reset_scene_arrays()
         self.geometriesChanged.emit()
     
+    @property
+    def in_gesture(self):
+        """是否正处于一次连续操作之中"""
+        return self._gesture_depth > 0
+    
+    def begin_gesture(self):
+        """
+        开始一次连续操作（例如按下鼠标开始拖动变换控制器）
+        
+        到对应的 end_gesture 为止，期间的所有修改在历史记录中合并为一步。可以嵌套调用，
+        只有最外层的开始和结束会发出信号。
+        """
+        self._gesture_depth += 1
+        if self._gesture_depth == 1:
+            self.gestureStarted.emit()
+    
+    def end_gesture(self):
+        """结束一次连续操作（例如松开鼠标）"""
+        if self._gesture_depth == 0:
+            return
+        self._gesture_depth -= 1
+        if self._gesture_depth == 0:
+            self.gestureFinished.emit()
+    
     def notifyPositionChanged(self, geometry):
         """通知几何体位置变化"""
         self.positionChanged.emit(geometry)